@@ -0,0 +1,187 @@
+import argparse
+import math
+import random
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from db.db import DB_CONFIG
+from db.migrations import load_migrations
+from benchmarks.permission_index import SCHEMA_FILE
+
+# Bytes handed to COPY at once
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class CopyStream:
+    """File-like object feeding lines of a generator to `COPY ... FROM STDIN`, so rows are never all in memory."""
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._rest = ""
+
+    def read(self, size: int = -1) -> str:
+        parts, length = [self._rest], len(self._rest)
+        for line in self._lines:
+            parts.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        data = "".join(parts)
+        if size < 0:
+            self._rest = ""
+            return data
+        data, self._rest = data[:size], data[size:]
+        return data
+
+
+def copy_rows(cur, table: str, columns: tuple, lines) -> None:
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", CopyStream(lines), size=COPY_CHUNK_SIZE)
+
+def membership_counts(users: int, projects: int, memberships: int, skew: float, max_per_user: int) -> list[int]:
+    """Splits memberships between users by a Zipf distribution.
+
+    The user of rank `r` gets a share proportional to `1 / r ** skew`, at least
+    one project and at most `max_per_user`. The scale of the shares is searched
+    so the capped counts still add up to about `memberships`.
+
+    Returns:
+        list: Number of projects of every user, by rank.
+    """
+    cap = min(max_per_user, projects)
+    weights = [1 / rank ** skew for rank in range(1, users + 1)]
+
+    def counts(scale: float) -> list[int]:
+        return [min(max(1, round(scale * weight)), cap) for weight in weights]
+
+    low, high = 0.0, memberships / weights[-1]
+    for _ in range(40):
+        middle = (low + high) / 2
+        if sum(counts(middle)) < memberships:
+            low = middle
+        else:
+            high = middle
+    return counts(high)
+
+def coprime_step(projects: int) -> int:
+    """Returns a stride visiting every project once, so a user's projects are distinct without tracking them."""
+    step = 104729
+    while math.gcd(step, projects) != 1:
+        step += 2
+    return step
+
+def drop_foreign_keys(cur, table: str) -> list[tuple[str, str]]:
+    """Drops foreign keys of a table before it's loaded, checking them row by row dominates COPY.
+
+    Returns:
+        list: Names and definitions of the dropped constraints, for `add_constraints`.
+    """
+    cur.execute("""
+        SELECT conname, pg_get_constraintdef(oid) AS definition
+        FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype = 'f'
+        """, (table,))
+    constraints = [(row["conname"], row["definition"]) for row in cur.fetchall()]
+    for name, _ in constraints:
+        cur.execute(f"ALTER TABLE {table} DROP CONSTRAINT {name}")
+    return constraints
+
+def add_constraints(cur, table: str, constraints: list[tuple[str, str]]) -> None:
+    """Adds constraints back, each one is validated with a single scan of the loaded rows."""
+    for name, definition in constraints:
+        cur.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+
+def apply_migrations(cur) -> None:
+    """Applies all migrations to the tables of `sql/schema.sql` in the current `search_path`."""
+    for _, _, path in load_migrations():
+        cur.execute(path.read_text())
+
+def generate(cur, memberships: int, users: int | None = None, projects: int | None = None,
+             skew: float = 1.0, max_per_user: int = 5_000, seed: int = 0) -> dict:
+    """Creates the schema and loads users, projects and skewed memberships with COPY.
+
+    Users are named `user_<rank>`, so `user_1` is in the most projects and
+    the last user in the fewest. Every user owns its first project and
+    participates in the rest. The same arguments always produce the same rows.
+
+    Args:
+        cur (psycopg2.cursor): Cursor, the schema is created in its current `search_path`.
+        memberships (int): Approximate number of `user_project` rows.
+        users (int, optional): Number of users, defaults to `memberships / 20`.
+        projects (int, optional): Number of projects, defaults to `memberships / 10`.
+        skew (float): Zipf exponent, 0 spreads projects evenly, higher values give more to the first users.
+        max_per_user (int): Most projects of one user.
+        seed (int): Seed of the random placement of memberships.
+
+    Returns:
+        dict: Numbers of generated rows, memberships of the heaviest, median and lightest user and load time.
+    """
+    users = users or max(memberships // 20, 10)
+    projects = projects or max(memberships // 10, 10)
+    started = time.perf_counter()
+    counts = membership_counts(users, projects, memberships, skew, max_per_user)
+    step = coprime_step(projects)
+    rng = random.Random(seed)
+    starts = [rng.randrange(projects) for _ in range(users)]
+
+    cur.execute(SCHEMA_FILE.read_text())
+    copy_rows(cur, "users", ("user_id", "password"), (f"user_{rank}\tpassword\n" for rank in range(1, users + 1)))
+    created_at = "2024-01-01 00:00:00"
+    copy_rows(
+        cur, "projects", ("project_id", "name", "created_at", "modified_at"),
+        (f"{project_id}\tproject_{project_id}\t{created_at}\t{created_at}\n" for project_id in range(1, projects + 1)),
+    )
+    cur.execute("SELECT setval(pg_get_serial_sequence('projects', 'project_id'), %s)", (projects,))
+    foreign_keys = drop_foreign_keys(cur, "user_project")
+    copy_rows(
+        cur, "user_project", ("user_id", "project_id", "permission"),
+        (
+            f"user_{rank}\t{(start + k * step) % projects + 1}\t{'owner' if k == 0 else 'participant'}\n"
+            for rank, (count, start) in enumerate(zip(counts, starts), 1)
+            for k in range(count)
+        ),
+    )
+    add_constraints(cur, "user_project", foreign_keys)
+    # Keys and indexes of the migrations are built once over the loaded rows, faster than maintaining them row by row
+    apply_migrations(cur)
+    cur.execute("ANALYZE")
+
+    return {
+        "users": users,
+        "projects": projects,
+        "memberships": sum(counts),
+        "skew": skew,
+        "max_per_user": counts[0],
+        "median_per_user": counts[users // 2],
+        "min_per_user": counts[-1],
+        "load_seconds": round(time.perf_counter() - started, 3),
+    }
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Generates users, projects and skewed memberships into a schema of the database")
+    parser.add_argument("--schema", default="bench_data", help="schema the data is generated into, it's dropped first")
+    parser.add_argument("--memberships", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--projects", type=int)
+    parser.add_argument("--skew", type=float, default=1.0)
+    parser.add_argument("--max-per-user", type=int, default=5_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(**DB_CONFIG, cursor_factory=RealDictCursor)
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE")
+            cur.execute(f"CREATE SCHEMA {args.schema}")
+            cur.execute(f"SET LOCAL search_path TO {args.schema}")
+            summary = generate(cur, args.memberships, args.users, args.projects, args.skew, args.max_per_user, args.seed)
+    finally:
+        conn.close()
+
+    print(", ".join(f"{key}: {value}" for key, value in summary.items()))
+    print(f"Query it with SET search_path TO {args.schema}; drop it with DROP SCHEMA {args.schema} CASCADE")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timezone
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from db import db
+from db.db import DB_CONFIG, permission_cache
+from db.models import Project
+from benchmarks.datagen import generate
+from benchmarks.stats import percentile
+
+BENCH_SCHEMA = "bench_db_functions"
+DEFAULT_SCALES = "1000,10000,100000,1000000"
+# First page of `GET /projects`, with the extra row telling if there's a next one
+PAGE_LIMIT = 51
+# Statements that can be explained, others like `SET` are skipped
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+_statements = []
+
+
+class RecordingCursor(RealDictCursor):
+    """Cursor keeping the SQL it executed with its parameters bound, so the statements of a function can be explained."""
+
+    def execute(self, query, vars=None):
+        result = super().execute(query, vars)
+        _statements.append(self.query.decode())
+        return result
+
+
+def plan_nodes(plan: dict, depth: int = 0) -> list[str]:
+    """Flattens an `EXPLAIN (FORMAT JSON)` plan to one line per node, indented by depth."""
+    line = "  " * depth + plan["Node Type"]
+    if "Relation Name" in plan:
+        line += f" on {plan['Relation Name']}"
+    if "Index Name" in plan:
+        line += f" using {plan['Index Name']}"
+    return [line, *(node for child in plan.get("Plans", ()) for node in plan_nodes(child, depth + 1))]
+
+def seq_scans(plan: dict) -> list[str]:
+    relations = [plan["Relation Name"]] if plan["Node Type"] == "Seq Scan" else []
+    return relations + [relation for child in plan.get("Plans", ()) for relation in seq_scans(child)]
+
+def explain(cur, statements: list[str], min_rows: int) -> tuple[list[dict], list[str]]:
+    """Explains the statements a function executed.
+
+    Returns:
+        tuple: Plans of the statements, and sequential scans of tables with at least `min_rows` rows.
+    """
+    plans, violations = [], []
+    for statement in statements:
+        if not statement.lstrip().upper().startswith(EXPLAINABLE):
+            continue
+        cur.execute("EXPLAIN (FORMAT JSON) " + statement)
+        plan = cur.fetchone()["QUERY PLAN"][0]["Plan"]
+        plans.append({"statement": " ".join(statement.split()), "cost": plan["Total Cost"], "nodes": plan_nodes(plan)})
+        for relation in seq_scans(plan):
+            cur.execute("SELECT reltuples::bigint AS rows FROM pg_class WHERE oid = to_regclass(%s)", (relation,))
+            rows = cur.fetchone()["rows"]
+            if rows >= min_rows:
+                violations.append(f"Seq Scan on {relation} ({rows} rows)")
+    return plans, violations
+
+def measure(conn, call, iterations: int, min_rows: int) -> dict:
+    """Times `call(i)` for every iteration and explains the statements of its first call.
+
+    The permission cache is cleared before every call, so the database is
+    what's timed, as for a worker that hasn't seen the user yet.
+    """
+    latencies = []
+    for i in range(iterations):
+        permission_cache.clear()
+        _statements.clear()
+        started = time.perf_counter()
+        call(i)
+        latencies.append(time.perf_counter() - started)
+        if i == 0:
+            statements = list(_statements)
+
+    with conn.cursor() as cur:
+        plans, violations = explain(cur, statements, min_rows)
+    values = sorted(latencies)
+    return {
+        "mean_ms": round(sum(values) / len(values) * 1000, 4),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 4),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 4),
+        "max_ms": round(values[-1] * 1000, 4),
+        "plans": plans,
+        "seq_scans": violations,
+    }
+
+def sample_memberships(cur, count: int, rows: int, seed: int) -> list[dict]:
+    """Picks memberships with a repeatable sample, without sorting the whole table."""
+    percent = min(100.0, count * 4 / max(rows, 1) * 100)
+    cur.execute(
+        "SELECT user_id, project_id FROM user_project TABLESAMPLE BERNOULLI (%s) REPEATABLE (%s) LIMIT %s",
+        (percent, seed, count),
+    )
+    return cur.fetchall()
+
+def run_scale(conn, memberships: int, args: argparse.Namespace) -> dict:
+    """Generates data of one scale in the scratch schema and measures every function against it."""
+    with conn.cursor() as cur:
+        data = generate(cur, memberships, skew=args.skew, max_per_user=args.max_per_user, seed=args.seed)
+        sample = sample_memberships(cur, args.iterations, data["memberships"], args.seed)
+        cur.execute("INSERT INTO users VALUES ('bench_owner', 'password')")
+
+    heavy, light = "user_1", f"user_{data['users']}"
+    rng = random.Random(args.seed)
+    pairs = [sample[rng.randrange(len(sample))] for _ in range(args.iterations)]
+    created = []
+
+    def insert(i):
+        created.append(db.insert_project(conn, "bench_owner", Project(name=f"bench_project_{i}")))
+
+    cases = {
+        "check_permission": lambda i: db.check_permission(conn, pairs[i]["user_id"], pairs[i]["project_id"]),
+        "select_project_info[project]": lambda i: db.select_project_info(conn, pairs[i]["user_id"], pairs[i]["project_id"]),
+        "select_project_info[heavy_user]": lambda i: db.select_project_info(conn, heavy, limit=PAGE_LIMIT),
+        "select_project_info[light_user]": lambda i: db.select_project_info(conn, light, limit=PAGE_LIMIT),
+        "select_projects_with_permissions[heavy_user]": lambda i: db.select_projects_with_permissions(conn, heavy),
+        "select_projects_with_permissions[light_user]": lambda i: db.select_projects_with_permissions(conn, light),
+        "insert_project": insert,
+        # Deletes the projects `insert_project` created, their memberships are removed by the cascade
+        "delete_project": lambda i: db.delete_project(conn, "bench_owner", created[i]),
+    }
+    results = {name: measure(conn, call, args.iterations, args.seq_scan_rows) for name, call in cases.items()}
+    return {"target_memberships": memberships, "data": data, "cases": results}
+
+def compare(result: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> list[str]:
+    """Finds cases whose median latency grew by more than `tolerance` and `min_delta_ms` against a baseline report."""
+    regressions = []
+    base_scales = {scale["target_memberships"]: scale for scale in baseline.get("scales", [])}
+    for scale in result["scales"]:
+        base = base_scales.get(scale["target_memberships"])
+        if base is None:
+            continue
+        for name, case in scale["cases"].items():
+            base_case = base["cases"].get(name)
+            if base_case is None:
+                continue
+            current, before = case["p50_ms"], base_case["p50_ms"]
+            if current > before * (1 + tolerance) and current - before > min_delta_ms:
+                regressions.append(f"{scale['target_memberships']} memberships, {name}: p50 {before:.3f} ms -> {current:.3f} ms")
+    return regressions
+
+def print_scale(scale: dict) -> None:
+    data = scale["data"]
+    print(
+        f"\n{data['memberships']} memberships, {data['users']} users, {data['projects']} projects "
+        f"(per user max {data['max_per_user']}, median {data['median_per_user']}), loaded in {data['load_seconds']} s"
+    )
+    print(f"{'function':<46}{'p50 ms':>10}{'p95 ms':>10}  scans")
+    for name, case in scale["cases"].items():
+        scans = sorted({node.strip() for plan in case["plans"] for node in plan["nodes"] if "Scan" in node})
+        print(f"{name:<46}{case['p50_ms']:>10.3f}{case['p95_ms']:>10.3f}  {'; '.join(scans)}")
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Times db.db functions against generated data of growing size and checks their plans")
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help="comma separated numbers of user_project rows, e.g. 1000,10000000")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of projects per user")
+    parser.add_argument("--max-per-user", type=int, default=5_000)
+    parser.add_argument("--iterations", type=int, default=200, help="timed calls of every function")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--seq-scan-rows", type=int, default=10_000, help="tables from this size must not be read with a Seq Scan")
+    parser.add_argument("--output", default="db_functions.json", help="JSON report")
+    parser.add_argument("--baseline", help="JSON report of an earlier run, median latencies are checked against it")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative growth of median latency")
+    parser.add_argument("--min-delta-ms", type=float, default=0.1, help="growth of median latency below this is noise")
+    args = parser.parse_args(argv)
+
+    scales = []
+    for memberships in (int(value) for value in args.scales.split(",")):
+        conn = psycopg2.connect(**DB_CONFIG, cursor_factory=RecordingCursor)
+        try:
+            with conn.cursor() as cur:
+                # Every scale is generated in a scratch schema inside one transaction that is rolled back
+                cur.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+                cur.execute(f"SET LOCAL search_path TO {BENCH_SCHEMA}")
+            scale = run_scale(conn, memberships, args)
+        finally:
+            conn.rollback()
+            conn.close()
+            permission_cache.clear()
+        print_scale(scale)
+        scales.append(scale)
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "baseline")}
+    result = {"started_at": datetime.now(timezone.utc).isoformat(), "config": config, "scales": scales}
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nReport written to {args.output}")
+
+    failures = [f"{scale['target_memberships']} memberships, {name}: {violation}"
+                for scale in scales for name, case in scale["cases"].items() for violation in case["seq_scans"]]
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures += compare(result, json.load(f), args.tolerance, args.min_delta_ms)
+    if failures:
+        raise SystemExit("Regressions:\n" + "\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
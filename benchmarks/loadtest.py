@@ -0,0 +1,374 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import socket
+import time
+from datetime import datetime, timezone
+
+import httpx
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+from db.migrations import migrate
+from tests.fake_s3 import FakeS3Client
+from tests.sample_documents import make_pdf
+from benchmarks.stats import percentile
+
+load_dotenv()
+
+# The load test resets the tables it seeds, so it runs against the throwaway test database
+BENCH_DB_CONFIG = {
+    "host": os.getenv("TEST_DB_HOST"),
+    "database": os.getenv("TEST_DB_NAME"),
+    "user": os.getenv("TEST_DB_USER"),
+    "password": os.getenv("TEST_DB_PASSWORD"),
+}
+
+PASSWORD = "password"
+CONTENT_TYPE = "application/pdf"
+
+# Operation: (method, route template) reported for it
+OPERATIONS = {
+    "login": ("POST", "/login"),
+    "list_projects": ("GET", "/projects"),
+    "list_documents": ("GET", "/projects/{project_id}/documents"),
+    "download": ("GET", "/projects/{project_id}/documents/{document_id}"),
+    "upload": ("POST", "/projects/{project_id}/documents"),
+    "delete": ("DELETE", "/projects/{project_id}/documents/{document_id}"),
+}
+DEFAULT_MIX = "login=5,list_projects=25,list_documents=25,download=25,upload=12,delete=8"
+
+
+def document_payload(size: int, seed: int) -> bytes:
+    """Returns a PDF of about `size` bytes with random words, the content of every seeded and uploaded document.
+
+    A real PDF keeps the text extraction jobs queued by uploads part of the load.
+    """
+    rng = random.Random(seed)
+    words, length = [], 0
+    while length < size:
+        word = "".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 10)))
+        words.append(word)
+        length += len(word) + 1
+    return make_pdf(" ".join(words))
+
+def reset(cur) -> None:
+    """Deletes everything the load test creates, like the test suite does after each test."""
+    for table in ("user_project", "users", "projects", "blobs", "jobs"):
+        cur.execute(f"DELETE FROM {table}")
+
+def seed(cur, users: int, projects: int, memberships: int, documents: int, etag: str, document_bytes: int) -> None:
+    """Fills the database with users, projects, memberships and indexed documents.
+
+    Projects are owned round robin, each user additionally participates in
+    `memberships` projects spread by a fixed multiplicative hash, so the same
+    arguments always produce the same data.
+    """
+    reset(cur)
+    cur.execute("INSERT INTO users SELECT 'load_user_' || i, %s FROM generate_series(1, %s) i", (PASSWORD, users))
+    cur.execute("""
+        INSERT INTO projects (name, created_at, modified_at)
+        SELECT 'load_project_' || i, now(), now() FROM generate_series(1, %s) i
+        """, (projects,))
+    cur.execute("""
+        CREATE TEMP TABLE load_projects ON COMMIT DROP AS
+        SELECT project_id, row_number() OVER (ORDER BY project_id) - 1 AS n FROM projects
+        """)
+    cur.execute("""
+        INSERT INTO user_project (user_id, project_id, permission)
+        SELECT 'load_user_' || (n %% %s + 1), project_id, 'owner' FROM load_projects
+        """, (users,))
+    cur.execute("""
+        INSERT INTO user_project (user_id, project_id, permission)
+        SELECT 'load_user_' || u, p.project_id, 'participant'
+        FROM generate_series(1, %s) u, generate_series(1, %s) m, load_projects p
+        WHERE p.n = (u * 7919 + m * 104729) %% %s
+        ON CONFLICT DO NOTHING
+        """, (users, memberships, projects))
+    cur.execute("""
+        INSERT INTO documents (project_id, name, key, size, content_type, etag)
+        SELECT project_id, 'doc_' || d || '.pdf', project_id || '/doc_' || d || '.pdf', %s, %s, %s
+        FROM load_projects, generate_series(1, %s) d
+        """, (document_bytes, CONTENT_TYPE, etag, documents))
+    cur.execute("ANALYZE")
+
+
+class LoadTestS3Client(FakeS3Client):
+    """In process S3 stand-in that keeps no call log, which would grow for the whole run."""
+
+    def _record(self, operation: str, **kwargs) -> None:
+        pass
+
+
+def serve(port: int, document_bytes: int, payload_seed: int) -> None:
+    """Runs the application with uvicorn against the bench database and an in-process S3 stand-in.
+
+    Runs in its own process, so the load generator doesn't compete with the
+    application for the GIL.
+    """
+    import uvicorn
+
+    from db.db import DB_CONFIG
+    import storage.s3
+    from main import app
+
+    DB_CONFIG.update(BENCH_DB_CONFIG)
+    s3 = LoadTestS3Client()
+    payload = document_payload(document_bytes, payload_seed)
+    with psycopg2.connect(**BENCH_DB_CONFIG, cursor_factory=RealDictCursor) as conn, conn.cursor() as cur:
+        cur.execute("SELECT key, etag FROM documents")
+        for row in cur.fetchall():
+            s3.store(storage.s3.BUCKET_NAME, row["key"], payload, CONTENT_TYPE, row["etag"])
+    conn.close()
+    # `open_s3_client` keeps a client that is already set
+    storage.s3._client = s3
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get("/metrics")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError("The application didn't start")
+        await asyncio.sleep(0.2)
+
+
+class Results:
+    """Latencies and errors of completed requests, by operation."""
+
+    def __init__(self):
+        self.latencies = {operation: [] for operation in OPERATIONS}
+        self.errors = {operation: 0 for operation in OPERATIONS}
+        self.recording = False
+
+    def add(self, operation: str, seconds: float, ok: bool) -> None:
+        if not self.recording:
+            return
+        self.latencies[operation].append(seconds)
+        if not ok:
+            self.errors[operation] += 1
+
+
+class VirtualUser:
+    """One simulated client: logs in, then runs operations picked by the mix until the run ends.
+
+    Args:
+        client (httpx.AsyncClient): Client of the application.
+        name (str): Unique name of the client, prefixes names of its uploads.
+        user_id (str): Seeded user the client logs in as.
+        documents (int): Seeded documents per project, downloads pick one of them.
+        payload (bytes): Content of uploaded files.
+        rng (random.Random): Source of the client's choices.
+        results (Results): Where timings are recorded.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, name: str, user_id: str, documents: int, payload: bytes, rng: random.Random, results: Results):
+        self.client = client
+        self.name = name
+        self.user_id = user_id
+        self.documents = documents
+        self.payload = payload
+        self.rng = rng
+        self.results = results
+        self.headers = {}
+        self.project_ids = []
+        # Only documents this client uploaded are deleted, so seeded documents stay downloadable
+        self.uploaded = []
+        self.uploads = 0
+
+    async def request(self, operation: str, method: str, url: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        response = await self.client.request(method, url, headers=self.headers, **kwargs)
+        # The body is read in full, a download is timed until its last byte
+        await response.aread()
+        self.results.add(operation, time.perf_counter() - started, response.status_code < 400)
+        return response
+
+    async def login(self) -> None:
+        response = await self.request("login", "POST", "/login", json={"user_id": self.user_id, "password": PASSWORD})
+        if response.status_code == 200:
+            self.headers = {"Authorization": f"Bearer {response.json()['token']}"}
+
+    async def list_projects(self) -> None:
+        response = await self.request("list_projects", "GET", "/projects")
+        if response.status_code == 200:
+            self.project_ids = [int(project_id) for project_id in response.json()]
+
+    async def list_documents(self, project_id: int) -> None:
+        await self.request("list_documents", "GET", f"/projects/{project_id}/documents")
+
+    async def download(self, project_id: int) -> None:
+        await self.request("download", "GET", f"/projects/{project_id}/documents/doc_{self.rng.randint(1, self.documents)}.pdf")
+
+    async def upload(self, project_id: int) -> None:
+        self.uploads += 1
+        name = f"{self.name}_upload_{self.uploads}.pdf"
+        response = await self.request("upload", "POST", f"/projects/{project_id}/documents", files=[("files", (name, self.payload, CONTENT_TYPE))])
+        if response.status_code == 200:
+            self.uploaded.append((project_id, name))
+
+    async def delete(self) -> None:
+        project_id, name = self.uploaded.pop(self.rng.randrange(len(self.uploaded)))
+        await self.request("delete", "DELETE", f"/projects/{project_id}/documents/{name}")
+
+    async def run(self, mix: dict[str, int], deadline: float) -> None:
+        await self.login()
+        await self.list_projects()
+        operations, weights = list(mix), list(mix.values())
+        while time.monotonic() < deadline:
+            operation = self.rng.choices(operations, weights)[0]
+            if operation == "login":
+                await self.login()
+            elif operation == "list_projects" or not self.project_ids:
+                await self.list_projects()
+            elif operation == "list_documents":
+                await self.list_documents(self.rng.choice(self.project_ids))
+            elif operation == "download" and self.documents:
+                await self.download(self.rng.choice(self.project_ids))
+            elif operation == "delete" and self.uploaded:
+                await self.delete()
+            else:
+                # Nothing to delete yet, so the client uploads instead
+                await self.upload(self.rng.choice(self.project_ids))
+
+
+def summarize(latencies: list[float], errors: int, seconds: float) -> dict:
+    values = sorted(latencies)
+    summary = {"requests": len(values), "errors": errors, "rps": round(len(values) / seconds, 2)}
+    if values:
+        summary.update({
+            "mean_ms": round(sum(values) / len(values) * 1000, 3),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3),
+        })
+    return summary
+
+def report(results: Results, seconds: float, config: dict) -> dict:
+    endpoints = {
+        operation: {"method": OPERATIONS[operation][0], "route": OPERATIONS[operation][1], **summarize(latencies, results.errors[operation], seconds)}
+        for operation, latencies in results.latencies.items() if latencies
+    }
+    every_latency = [latency for latencies in results.latencies.values() for latency in latencies]
+    return {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "config": config,
+        "measured_seconds": round(seconds, 3),
+        "total": summarize(every_latency, sum(results.errors.values()), seconds),
+        "endpoints": endpoints,
+    }
+
+def parse_mix(value: str) -> dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        operation, _, weight = part.partition("=")
+        if operation.strip() not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation {operation!r}, expected one of {', '.join(OPERATIONS)}")
+        mix[operation.strip()] = int(weight)
+    return mix
+
+def print_report(result: dict, baseline: dict | None = None) -> None:
+    print(f"{'endpoint':<16}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'vs base':>10}")
+    rows = [*result["endpoints"].items(), ("total", result["total"])]
+    for name, summary in rows:
+        change = ""
+        base = (baseline or {}).get("endpoints", {}).get(name) if name != "total" else (baseline or {}).get("total")
+        if base and base.get("p95_ms") and "p95_ms" in summary:
+            # Relative change of p95 latency, positive is slower
+            change = f"{(summary['p95_ms'] / base['p95_ms'] - 1) * 100:+.1f}%"
+        print(
+            f"{name:<16}{summary['requests']:>10}{summary['errors']:>8}{summary['rps']:>10.1f}"
+            f"{summary.get('p50_ms', 0):>10.2f}{summary.get('p95_ms', 0):>10.2f}{summary.get('p99_ms', 0):>10.2f}{change:>10}"
+        )
+
+async def drive(base_url: str, args: argparse.Namespace, payload: bytes) -> tuple[Results, float]:
+    """Runs `args.concurrency` virtual users for the warmup and the measured duration."""
+    results = Results()
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        await wait_until_ready(client)
+        deadline = time.monotonic() + args.warmup + args.duration
+        virtual_users = [
+            VirtualUser(client, f"client_{i}", f"load_user_{i % args.users + 1}", args.documents, payload, random.Random(rng.random()), results)
+            for i in range(args.concurrency)
+        ]
+        tasks = [asyncio.create_task(user.run(args.mix, deadline)) for user in virtual_users]
+        await asyncio.sleep(args.warmup)
+        results.recording = True
+        started = time.monotonic()
+        await asyncio.gather(*tasks)
+    return results, time.monotonic() - started
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Load tests the application against the test database and an in-process S3 stand-in")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--projects", type=int, default=1_000)
+    parser.add_argument("--memberships", type=int, default=5, help="projects each user participates in besides the ones they own")
+    parser.add_argument("--documents", type=int, default=20, help="documents per project")
+    parser.add_argument("--document-bytes", type=int, default=64 * 1024)
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual users sending requests at once")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds run before measuring")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help=f"operation weights, default {DEFAULT_MIX}")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="loadtest.json", help="JSON report")
+    parser.add_argument("--baseline", help="JSON report of an earlier run to compare p95 latencies with")
+    parser.add_argument("--keep-data", action="store_true", help="leave the seeded rows in the database")
+    args = parser.parse_args(argv)
+
+    payload = document_payload(args.document_bytes, args.seed)
+    etag = f'"{hashlib.md5(payload).hexdigest()}"'
+    conn = psycopg2.connect(**BENCH_DB_CONFIG, cursor_factory=RealDictCursor)
+    try:
+        migrate(conn)
+        with conn, conn.cursor() as cur:
+            seed(cur, args.users, args.projects, args.memberships, args.documents, etag, args.document_bytes)
+
+        port = free_port()
+        server = multiprocessing.get_context("spawn").Process(target=serve, args=(port, args.document_bytes, args.seed))
+        server.start()
+        try:
+            results, seconds = asyncio.run(drive(f"http://127.0.0.1:{port}", args, payload))
+        finally:
+            # uvicorn shuts the application down gracefully on SIGTERM
+            server.terminate()
+            server.join(30)
+
+        if not args.keep_data:
+            with conn, conn.cursor() as cur:
+                reset(cur)
+    finally:
+        conn.close()
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "keep_data")}
+    result = report(results, seconds, config)
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
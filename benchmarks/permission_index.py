@@ -0,0 +1,91 @@
+import argparse
+import random
+import time
+from pathlib import Path
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from db.db import DB_CONFIG
+from db.migrations import MIGRATIONS_DIR
+
+SCHEMA_FILE = Path(__file__).resolve().parent.parent / "sql" / "schema.sql"
+MIGRATION_FILE = MIGRATIONS_DIR / "0001_user_project_keys.sql"
+BENCH_SCHEMA = "bench_permission_index"
+
+PERMISSION_QUERY = "SELECT * FROM user_project WHERE user_id = %s AND project_id = %s"
+
+
+def seed(cur, users: int, projects: int, memberships_per_user: int) -> None:
+    """Creates the application schema and fills it with generated rows."""
+    cur.execute(SCHEMA_FILE.read_text())
+    cur.execute("INSERT INTO users SELECT 'user_' || i, 'password' FROM generate_series(1, %s) i", (users,))
+    cur.execute("""
+        INSERT INTO projects (name, created_at, modified_at)
+        SELECT 'project_' || i, now(), now() FROM generate_series(1, %s) i
+        """, (projects,))
+    cur.execute("""
+        INSERT INTO user_project (user_id, project_id, permission)
+        SELECT 'user_' || u, ((u * 7919 + m * 104729) %% %s) + 1, CASE WHEN m = 0 THEN 'owner' ELSE 'participant' END::permission
+        FROM generate_series(1, %s) u, generate_series(0, %s - 1) m
+        ON CONFLICT DO NOTHING
+        """, (projects, users, memberships_per_user))
+    cur.execute("ANALYZE")
+
+def measure(cur, users: int, projects: int, lookups: int) -> dict:
+    """Explains and times the `check_permission` query.
+
+    Returns:
+        dict: Plan node type, planner cost and average lookup time in milliseconds.
+    """
+    cur.execute("SELECT user_id, project_id FROM user_project ORDER BY random() LIMIT 1")
+    sample = cur.fetchone()
+    cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + PERMISSION_QUERY, (sample["user_id"], sample["project_id"]))
+    plan = cur.fetchone()["QUERY PLAN"][0]["Plan"]
+
+    rng = random.Random(0)
+    started = time.perf_counter()
+    for _ in range(lookups):
+        cur.execute(PERMISSION_QUERY, (f"user_{rng.randint(1, users)}", rng.randint(1, projects)))
+        cur.fetchone()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "node": plan["Node Type"],
+        "index": plan.get("Index Name"),
+        "cost": plan["Total Cost"],
+        "avg_ms": elapsed / lookups * 1000,
+    }
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Compares check_permission before and after the user_project indexes migration")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--projects", type=int, default=20_000)
+    parser.add_argument("--memberships", type=int, default=10, help="projects per user")
+    parser.add_argument("--lookups", type=int, default=1_000)
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(**DB_CONFIG, cursor_factory=RealDictCursor)
+    try:
+        with conn.cursor() as cur:
+            # Everything runs in a scratch schema inside one transaction that is rolled back
+            cur.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+            cur.execute(f"SET LOCAL search_path TO {BENCH_SCHEMA}")
+            seed(cur, args.users, args.projects, args.memberships)
+
+            before = measure(cur, args.users, args.projects, args.lookups)
+            cur.execute(MIGRATION_FILE.read_text())
+            cur.execute("ANALYZE user_project")
+            after = measure(cur, args.users, args.projects, args.lookups)
+    finally:
+        conn.rollback()
+        conn.close()
+
+    print(f"user_project rows: ~{args.users * args.memberships}, lookups: {args.lookups}")
+    print(f"{'':<8}{'plan':<20}{'index':<24}{'cost':>10}{'avg ms':>10}")
+    for label, result in (("before", before), ("after", after)):
+        print(f"{label:<8}{result['node']:<20}{result['index'] or '-':<24}{result['cost']:>10.2f}{result['avg_ms']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
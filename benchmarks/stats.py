@@ -0,0 +1,6 @@
+import math
+
+
+def percentile(sorted_values: list[float], quantile: float) -> float:
+    """Nearest rank percentile of sorted values."""
+    return sorted_values[max(math.ceil(quantile * len(sorted_values)) - 1, 0)]
@@ -0,0 +1,176 @@
+import asyncio
+import contextvars
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from db import db
+from observability.profiler import record_span
+
+__all__ = [
+    "run_sync",
+    "get_async_db",
+    "shutdown_executors",
+    "insert_user",
+    "select_user",
+    "update_user",
+    "insert_project",
+    "update_project",
+    "delete_project",
+    "select_projects_with_permissions",
+    "select_project_info",
+    "check_permission",
+    "insert_permission",
+    "delete_permission",
+    "delete_user",
+    "upsert_document",
+    "delete_document",
+    "select_documents",
+    "select_document",
+    "select_document_names",
+    "select_document_names_by_project",
+    "select_project_version",
+    "upsert_document_text",
+    "select_document_text_etag",
+    "select_documents_without_text",
+    "search_documents",
+    "select_project_ids",
+    "select_existing_project_ids",
+    "lock_blob",
+    "insert_blob",
+    "delete_unreferenced_blobs",
+    "select_dedup_stats",
+    "insert_job",
+    "claim_job",
+    "extend_job_lease",
+    "complete_job",
+    "fail_job",
+    "select_job",
+]
+
+# psycopg2 is blocking, so every call runs on a thread pool. Pool checkouts get
+# their own executor, so requests waiting for a free connection never take the
+# threads that requests already holding one need to finish their queries.
+_query_executor = None
+_checkout_executor = None
+# Returns of connections whose requester was cancelled during checkout, referenced until done
+_abandoned_checkouts = set()
+
+
+def _get_executors() -> tuple[ThreadPoolExecutor, ThreadPoolExecutor]:
+    global _query_executor, _checkout_executor
+    if _query_executor is None:
+        max_workers = db.POOL_CONFIG["max_size"]
+        _query_executor = ThreadPoolExecutor(max_workers, thread_name_prefix="db-query")
+        _checkout_executor = ThreadPoolExecutor(max_workers, thread_name_prefix="db-checkout")
+    return _query_executor, _checkout_executor
+
+def shutdown_executors() -> None:
+    """Stops the database threads, used on application shutdown."""
+    global _query_executor, _checkout_executor
+    if _query_executor is not None:
+        _query_executor.shutdown(wait=True)
+        _checkout_executor.shutdown(wait=True)
+        _query_executor = _checkout_executor = None
+
+async def _run(executor: ThreadPoolExecutor, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await loop.run_in_executor(executor, call)
+
+async def run_sync(func, *args, **kwargs):
+    """Runs a blocking database call on the query thread pool.
+
+    Args:
+        func (callable): Function to call, usually one of `db.db` functions.
+        *args, **kwargs: Arguments passed to `func`.
+
+    Returns:
+        Any: Whatever `func` returns. Exceptions are raised as is.
+    """
+    query_executor, _ = _get_executors()
+    return await _run(query_executor, func, *args, **kwargs)
+
+async def _return_abandoned(checkout: asyncio.Future, executor: ThreadPoolExecutor, context_manager) -> None:
+    try:
+        await checkout
+    except Exception:
+        # No connection was checked out
+        return
+    await _run(executor, context_manager.__exit__, None, None, None)
+
+@asynccontextmanager
+async def get_async_db():
+    """Async counterpart of `db.db.get_db`.
+
+    Checks a connection out of the pool without blocking the event loop and
+    commits, rolls back and returns it off the loop as well. The checkout
+    thread can't be interrupted, so when the caller is cancelled while
+    waiting, the connection it gets is returned to the pool before the
+    cancellation is raised.
+    """
+    query_executor, checkout_executor = _get_executors()
+    context_manager = db.get_db()
+    start = time.perf_counter()
+    checkout = asyncio.ensure_future(_run(checkout_executor, context_manager.__enter__))
+    try:
+        conn = await asyncio.shield(checkout)
+    except asyncio.CancelledError:
+        release = asyncio.ensure_future(_return_abandoned(checkout, query_executor, context_manager))
+        _abandoned_checkouts.add(release)
+        release.add_done_callback(_abandoned_checkouts.discard)
+        await asyncio.shield(release)
+        raise
+    record_span("db_checkout", time.perf_counter() - start)
+    try:
+        yield conn
+    except BaseException as e:
+        if not await _run(query_executor, context_manager.__exit__, type(e), e, e.__traceback__):
+            raise
+    else:
+        await _run(query_executor, context_manager.__exit__, None, None, None)
+
+def _awaitable(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_sync(func, *args, **kwargs)
+    return wrapper
+
+
+insert_user = _awaitable(db.insert_user)
+select_user = _awaitable(db.select_user)
+update_user = _awaitable(db.update_user)
+insert_project = _awaitable(db.insert_project)
+update_project = _awaitable(db.update_project)
+delete_project = _awaitable(db.delete_project)
+select_projects_with_permissions = _awaitable(db.select_projects_with_permissions)
+select_project_info = _awaitable(db.select_project_info)
+check_permission = _awaitable(db.check_permission)
+insert_permission = _awaitable(db.insert_permission)
+delete_permission = _awaitable(db.delete_permission)
+delete_user = _awaitable(db.delete_user)
+upsert_document = _awaitable(db.upsert_document)
+delete_document = _awaitable(db.delete_document)
+select_documents = _awaitable(db.select_documents)
+select_document = _awaitable(db.select_document)
+select_document_names = _awaitable(db.select_document_names)
+select_document_names_by_project = _awaitable(db.select_document_names_by_project)
+select_project_version = _awaitable(db.select_project_version)
+upsert_document_text = _awaitable(db.upsert_document_text)
+select_document_text_etag = _awaitable(db.select_document_text_etag)
+select_documents_without_text = _awaitable(db.select_documents_without_text)
+search_documents = _awaitable(db.search_documents)
+select_project_ids = _awaitable(db.select_project_ids)
+select_existing_project_ids = _awaitable(db.select_existing_project_ids)
+lock_blob = _awaitable(db.lock_blob)
+insert_blob = _awaitable(db.insert_blob)
+delete_unreferenced_blobs = _awaitable(db.delete_unreferenced_blobs)
+select_dedup_stats = _awaitable(db.select_dedup_stats)
+insert_job = _awaitable(db.insert_job)
+claim_job = _awaitable(db.claim_job)
+extend_job_lease = _awaitable(db.extend_job_lease)
+complete_job = _awaitable(db.complete_job)
+fail_job = _awaitable(db.fail_job)
+select_job = _awaitable(db.select_job)
@@ -0,0 +1,162 @@
+import json
+import logging
+import select
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+PERMISSION_CHANNEL = "permission_invalidation"
+
+
+class PermissionCache:
+    """Bounded LRU cache of `(user_id, project_id) -> permission` with a TTL.
+
+    Only granted permissions are cached, a missing permission is always checked
+    in the database again.
+
+    Args:
+        max_size (int): Maximum number of entries, 0 disables the cache.
+        ttl (float): Seconds an entry stays valid.
+    """
+
+    def __init__(self, max_size: int = 10_000, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    @staticmethod
+    def _key(user_id: str, project_id) -> tuple[str, int]:
+        return user_id, int(project_id)
+
+    def get(self, user_id: str, project_id: int) -> str | None:
+        """Returns cached permission or None if it isn't cached."""
+        key = self._key(user_id, project_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+
+            permission, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._counters["expirations"] += 1
+                self._counters["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return permission
+
+    def set(self, user_id: str, project_id: int, permission: str) -> None:
+        if self.max_size <= 0:
+            return
+        key = self._key(user_id, project_id)
+        with self._lock:
+            self._entries[key] = (permission, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def invalidate(self, user_id: str | None = None, project_id: int | None = None) -> None:
+        """Drops cached permissions. `None` matches every user or every project."""
+        with self._lock:
+            if user_id is not None and project_id is not None:
+                removed = 1 if self._entries.pop(self._key(user_id, project_id), None) else 0
+            else:
+                project_id = None if project_id is None else int(project_id)
+                keys = [
+                    key for key in self._entries
+                    if (user_id is None or key[0] == user_id) and (project_id is None or key[1] == project_id)
+                ]
+                for key in keys:
+                    del self._entries[key]
+                removed = len(keys)
+            self._counters["invalidations"] += removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "size": len(self._entries),
+                "hit_ratio": self._counters["hits"] / lookups if lookups else 0.0,
+                **self._counters,
+            }
+
+
+class PermissionInvalidationListener(threading.Thread):
+    """Applies invalidations sent by other workers through Postgres NOTIFY.
+
+    Runs on a dedicated autocommit connection. After a lost connection the whole
+    cache is cleared, because notifications sent in the meantime are lost.
+
+    Args:
+        cache (PermissionCache): Cache to invalidate.
+        poll_interval (float): Seconds between checks of the stop flag.
+        **connect_kwargs: Passed as is to `psycopg2.connect`.
+    """
+
+    def __init__(self, cache: PermissionCache, poll_interval: float = 1.0, **connect_kwargs):
+        super().__init__(name="permission-invalidation-listener", daemon=True)
+        self.cache = cache
+        self.poll_interval = poll_interval
+        self._connect_kwargs = connect_kwargs
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join(timeout=self.poll_interval * 2)
+
+    def run(self) -> None:
+        backoff = self.poll_interval
+        while not self._stop_event.is_set():
+            try:
+                self._listen()
+                backoff = self.poll_interval
+            except psycopg2.Error:
+                logger.exception("Permission invalidation listener lost its connection")
+                self.cache.clear()
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    def _listen(self) -> None:
+        conn = psycopg2.connect(**self._connect_kwargs)
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {PERMISSION_CHANNEL}")
+
+            while not self._stop_event.is_set():
+                if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self._apply(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
+
+    def _apply(self, payload: str) -> None:
+        try:
+            message = json.loads(payload)
+            self.cache.invalidate(message.get("user_id"), message.get("project_id"))
+        except (ValueError, AttributeError):
+            logger.warning("Ignoring malformed permission invalidation: %r", payload)
@@ -0,0 +1,59 @@
+from contextlib import AsyncExitStack
+
+from db.aio import get_async_db, check_permission
+
+
+class RequestContext:
+    """State shared by everything that runs for a single request.
+
+    Holds at most one pooled connection, checked out on first use and kept in a
+    single transaction until the request ends or `release()` is called. Resolved
+    permissions are memoized, so a project's permission is looked up once per
+    request however many functions need it.
+
+    Args:
+        user_id (str): ID of a user who sent the request.
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self._conn = None
+        self._stack = None
+        self._permissions = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._close(exc_type, exc, tb)
+
+    async def connection(self):
+        """Returns the request's connection, checking one out of the pool if needed."""
+        if self._conn is None:
+            self._stack = AsyncExitStack()
+            self._conn = await self._stack.enter_async_context(get_async_db())
+        return self._conn
+
+    async def release(self) -> None:
+        """Commits and returns the connection to the pool before a long non database operation.
+
+        Memoized permissions are kept, a later `connection()` checks out a new connection.
+        """
+        await self._close(None, None, None)
+
+    async def permission(self, project_id: int) -> str:
+        """Returns user's permission to a project, querying the database only once per request.
+
+        Raises:
+            HTTPException 404: If user has no permission to the project.
+        """
+        project_id = int(project_id)
+        if project_id not in self._permissions:
+            conn = await self.connection()
+            self._permissions[project_id] = await check_permission(conn, self.user_id, project_id)
+        return self._permissions[project_id]
+
+    async def _close(self, exc_type, exc, tb) -> None:
+        stack, self._stack, self._conn = self._stack, None, None
+        if stack is not None:
+            await stack.__aexit__(exc_type, exc, tb)
@@ -1,6 +1,10 @@
 from fastapi import HTTPException, status
 
 from db.models import *
+from db.pool import ConnectionPool, PoolTimeout
+from db.cache import PermissionCache, PermissionInvalidationListener, PERMISSION_CHANNEL
+from observability.metrics import DB_QUERY_SECONDS, Counter, Gauge
+from observability.profiler import record_span
 
 from datetime import datetime
 import psycopg2
@@ -8,7 +12,11 @@ from psycopg2.extras import RealDictCursor
 from contextlib import contextmanager
 
 from dotenv import load_dotenv
+import contextvars
+import functools
+import json
 import os
+import time
 
 load_dotenv()
 
@@ -27,20 +35,141 @@ for env_var, config_key in REQUIRED_ENV_VARIABLES.items():
         raise ValueError(f"Environment variable '{env_var}' is not set.")
     DB_CONFIG[config_key] = value
 
+POOL_CONFIG = {
+    "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 1)),
+    "max_size": int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+    "timeout": float(os.getenv("DB_POOL_TIMEOUT_SECONDS", 10)),
+    "health_check_after": float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER_SECONDS", 30)),
+}
+
+_pool = None
+
+permission_cache = PermissionCache(
+    max_size=int(os.getenv("PERMISSION_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("PERMISSION_CACHE_TTL_SECONDS", 60)),
+)
+_permission_listener = None
+
+
+# Name of the `db.db` function running in the current context, statements of other code are labelled `other`
+_query_function = contextvars.ContextVar("query_function", default="other")
+
+
+def instrumented(func):
+    """Labels the statements a function executes with its name in `db_query_duration_seconds`."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _query_function.set(func.__name__)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _query_function.reset(token)
+    return wrapper
+
+
+class InstrumentedCursor(RealDictCursor):
+    """Cursor of pooled connections recording how long statements take, by the `instrumented` function that executed them."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            function, elapsed = _query_function.get(), time.perf_counter() - start
+            DB_QUERY_SECONDS.labels(function).observe(elapsed)
+            record_span("db", elapsed, function)
+
+
+def _pool_gauges() -> dict:
+    stats = pool_stats()
+    if not stats:
+        return {}
+    return {("idle",): stats["idle"], ("in_use",): stats["in_use"], ("waiting",): stats["waiting"]}
+
+def _pool_counters() -> dict:
+    stats = pool_stats()
+    events = ("checkouts", "timeouts", "connections_created", "connections_discarded", "health_checks_failed")
+    return {(event,): stats[event] for event in events} if stats else {}
+
+Gauge("db_pool_connections", "Connections of the pool by state, `waiting` counts requests waiting for one.", ("state",), callback=_pool_gauges)
+Counter("db_pool_events_total", "Checkouts, timeouts and connection changes of the pool.", ("event",), callback=_pool_counters)
+
 # TODO: Refactor. Add `try` stetmant to functions
 
+def open_pool() -> ConnectionPool:
+    """Opens the shared connection pool, used on application startup.
+
+    Returns:
+        ConnectionPool: The opened pool.
+    """
+    global _pool
+    if _pool is None or _pool.closed:
+        _pool = ConnectionPool(**POOL_CONFIG, **DB_CONFIG, cursor_factory=InstrumentedCursor)
+        _pool.open()
+    return _pool
+
+def close_pool() -> None:
+    """Closes the shared connection pool, used on application shutdown."""
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+def pool_stats() -> dict:
+    """Returns statistics of the shared connection pool, empty if it isn't open."""
+    if _pool is None:
+        return {}
+    return _pool.stats()
+
+def start_permission_listener() -> None:
+    """Starts applying permission cache invalidations sent by other workers."""
+    global _permission_listener
+    if _permission_listener is None and permission_cache.max_size > 0:
+        _permission_listener = PermissionInvalidationListener(permission_cache, **DB_CONFIG)
+        _permission_listener.start()
+
+def stop_permission_listener() -> None:
+    global _permission_listener
+    if _permission_listener is not None:
+        _permission_listener.stop()
+        _permission_listener = None
+
+@instrumented
+def invalidate_permissions(conn, user_id: str = None, project_id: int = None) -> None:
+    """Drops cached permissions in this worker and, after commit, in every other one.
+
+    Args:
+        conn (psycopg2.connect): Connection to database, notification is sent when its transaction commits.
+        user_id (str, optional): User whose permissions changed, None for all users.
+        project_id (int, optional): Project whose permissions changed, None for all projects.
+    """
+    permission_cache.invalidate(user_id, project_id)
+    payload = json.dumps({"user_id": user_id, "project_id": None if project_id is None else int(project_id)})
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_notify(%s, %s);", (PERMISSION_CHANNEL, payload))
+
 @contextmanager
 def get_db():
-    conn = psycopg2.connect(**DB_CONFIG, cursor_factory=RealDictCursor)
+    pool = open_pool()
+    try:
+        conn = pool.getconn()
+    except PoolTimeout:
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "Database is busy, try again later")
+
+    discard = False
     try:
         yield conn
         conn.commit()
     except Exception:
-        conn.rollback()
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            discard = True
         raise
     finally:
-        conn.close()
+        pool.putconn(conn, discard=discard)
 
+@instrumented
 def insert_user(conn, user: User) -> None:
     """Inserting a user to database
 
@@ -51,6 +180,7 @@ def insert_user(conn, user: User) -> None:
     with conn.cursor() as cur:
         cur.execute("INSERT INTO users (user_id, password) VALUES (%s, %s);", (user.user_id, user.password))
 
+@instrumented
 def select_user(conn, user_id: str) -> User:
     """
     Queries for user data.
@@ -70,6 +200,7 @@ def select_user(conn, user_id: str) -> User:
         else: 
             return None
 
+@instrumented
 def update_user(conn, user_id: str, user: User) -> None:
     """Updating users data
 
@@ -81,6 +212,7 @@ def update_user(conn, user_id: str, user: User) -> None:
     with conn.cursor() as cur:
         cur.execute("UPDATE users SET password = %s WHERE user_id = %s;", (user.password, user_id))
 
+@instrumented
 def insert_project(conn, user_id: str, project: Project) -> int:
     """Creates a project and user - project relation with user as an `owner`.
     
@@ -121,6 +253,7 @@ def insert_project(conn, user_id: str, project: Project) -> int:
         return project_id 
 
 
+@instrumented
 def update_project(conn, project: Project):
     """Updates a project with provided values.
     Automatically changes `modified_at` to current time.
@@ -167,6 +300,7 @@ def update_project(conn, project: Project):
 
 
 
+@instrumented
 def delete_project(conn, user_id: str, project_id: int):
     """Deletes a project if users have such permissions.
 
@@ -188,6 +322,7 @@ def delete_project(conn, user_id: str, project_id: int):
     except Exception as e:
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, e)
 
+@instrumented
 def select_projects_with_permissions(conn, user_id):
     """Returns all projects that user have permission to.
     
@@ -208,15 +343,21 @@ def select_projects_with_permissions(conn, user_id):
         result = cur.fetchall()
     return [row["project_id"] for row in result]
 
-def select_project_info(conn, user_id: str, project_id: int = None) -> dict:
+@instrumented
+def select_project_info(conn, user_id: str, project_id: int = None, limit: int = None, after: int = None, order: SortOrder = SortOrder.asc, permission: str = None) -> dict:
     """Queries database for project's info that user has access to.
     If project_id is provided than queries only for singular requested project.
-    If project_id is NOT provided than returns all accessible projects.
+    If project_id is NOT provided than returns accessible projects in one query,
+    ordered by `project_id` and paginated with a keyset cursor.
 
     Args:
         conn (psycopg2.connect): Connection to database.
         user_id (str): ID of a user whose permissions are checked.
         project_id (int, optional): If provided than queries only one project. Defaults to None.
+        limit (int, optional): Maximum number of returned projects. Defaults to None (no limit).
+        after (int, optional): Cursor, returns only projects after this `project_id` in the given order.
+        order (SortOrder, optional): Sort order of `project_id`. Defaults to ascending.
+        permission (str, optional): Already resolved permission of the user to `project_id`, skips `check_permission`.
 
     Raises:
         HTTPException 401: If user has no permissions.
@@ -227,7 +368,9 @@ def select_project_info(conn, user_id: str, project_id: int = None) -> dict:
             (name, description, created_at, modified_at)
     """
     if project_id is not None:
-        if check_permission(conn, user_id, project_id) is not None:
+        if permission is None:
+            permission = check_permission(conn, user_id, project_id)
+        if permission is not None:
             with conn.cursor() as cur:
                 cur.execute("SELECT * FROM projects WHERE project_id = %s", (project_id,))
                 result = cur.fetchone()
@@ -241,13 +384,27 @@ def select_project_info(conn, user_id: str, project_id: int = None) -> dict:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED)
 
     else:
-        accessible_projects = select_projects_with_permissions(conn, user_id)
+        descending = SortOrder(order) == SortOrder.desc
+        conditions = ["up.user_id = %s"]
+        values = [user_id]
 
-        if not accessible_projects:
-            return {}
+        if after is not None:
+            conditions.append("up.project_id < %s" if descending else "up.project_id > %s")
+            values.append(after)
+
+        query = f"""
+            SELECT p.project_id, p.name, p.description, p.created_at, p.modified_at
+            FROM user_project up
+            JOIN projects p ON p.project_id = up.project_id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY up.project_id {"DESC" if descending else "ASC"}
+        """
+        if limit is not None:
+            query += " LIMIT %s"
+            values.append(limit)
 
         with conn.cursor() as cur:
-            cur.execute("SELECT * FROM projects WHERE project_id IN %s", (tuple(accessible_projects),))
+            cur.execute(query, values)
             
             rows = cur.fetchall()
             result = {}
@@ -262,6 +419,7 @@ def select_project_info(conn, user_id: str, project_id: int = None) -> dict:
 
             return result
 
+@instrumented
 def check_permission(conn, user_id: str, project_id: int) -> str:
     """Checks if user have permissions to project and of which type.
 
@@ -270,29 +428,39 @@ def check_permission(conn, user_id: str, project_id: int) -> str:
         user_id (str): ID of a user whose permission is checked.
         project_id (int): ID of a project where permission is checked.
 
+    Granted permissions are served from `permission_cache` when possible.
+
     Returns:
         str: If user have a permission to project and of what type (here "participant" or "owner").
         None: If user doesn't have any permissions to project.
     """
+    cached_permission = permission_cache.get(user_id, project_id)
+    if cached_permission is not None:
+        return cached_permission
+
     with conn.cursor() as cur:
         cur.execute("SELECT * FROM user_project WHERE user_id = %s AND project_id = %s", (user_id, project_id))
         result = cur.fetchone()
     if result is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Not found")
     if result:
+        permission_cache.set(user_id, project_id, result["permission"])
         return result["permission"]
     else:
         return None
 
+@instrumented
 def insert_permission(conn, user_id: str, project_id: int, permission: Permission) -> None:
     try:
         with conn.cursor() as cur:
             cur.execute("INSERT INTO user_project VALUES (%s, %s, %s)", (user_id, project_id, permission))
+        invalidate_permissions(conn, user_id, project_id)
     except Exception as e:
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, e)
 
 
-def delete_permission(conn, requester_id: str, user_id: str, project_id: int) -> None:
+@instrumented
+def delete_permission(conn, requester_id: str, user_id: str, project_id: int, permission: str = None) -> None:
     """Deleting permission if user is an 'owner' or user himself is requesting for revoking his permissions
     
 
@@ -301,12 +469,13 @@ def delete_permission(conn, requester_id: str, user_id: str, project_id: int) ->
         requester (str): ID of a user who is requesting for deletion.
         user_id (str): ID of a user whose permission have to be deleted.
         project_id (int): ID of a project to which user have to lose permissions.
+        permission (str, optional): Already resolved permission of the requester, skips `check_permission`.
 
     Raises:
         HTTPException 403: If 'owner' of a project wants to revoke his own permissions 
         or user who isn't an owner wants to revoke someone's pemissions
     """
-    requester_permission = check_permission(conn, requester_id, project_id)
+    requester_permission = permission if permission is not None else check_permission(conn, requester_id, project_id)
 
     if requester_permission == "owner" and requester_id == user_id:
         raise HTTPException(status.HTTP_403_FORBIDDEN, "Owner can't delete his own permission")
@@ -314,10 +483,12 @@ def delete_permission(conn, requester_id: str, user_id: str, project_id: int) ->
     if requester_permission == "owner" or requester_id == user_id:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM user_project WHERE user_id = %s AND project_id = %s;", (user_id, project_id))
-            return True
+        invalidate_permissions(conn, user_id, project_id)
+        return True
     else:
         raise HTTPException(status.HTTP_403_FORBIDDEN, "You don't have permission")
 
+@instrumented
 def delete_user(conn, user_id: str) -> None:
     """Deleting user
 
@@ -327,26 +498,536 @@ def delete_user(conn, user_id: str) -> None:
     """
     with conn.cursor() as cur:
         cur.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
+    invalidate_permissions(conn, user_id=user_id)
 
-def delete_project(conn, requester_id: str, project_id: int) -> None:
+@instrumented
+def delete_project(conn, requester_id: str, project_id: int, permission: str = None) -> None:
     """Deleting project, if requester have FPns to do so
 
     Args:
         conn (psycopg2.connect): Connection to database.
         requester_id (str): ID of a user who is requesting for deletion.
         project_id (int): ID of a project for deletion.
+        permission (str, optional): Already resolved permission of the requester, skips `check_permission`.
 
     Raises:
         HTTPException 403: If user doesn't have permission for project deleting, only owner can do so.
     """
-    requester_permission = check_permission(conn, requester_id, project_id)
+    requester_permission = permission if permission is not None else check_permission(conn, requester_id, project_id)
 
     if requester_permission == "owner":
         with conn.cursor() as cur:
             cur.execute("DELETE FROM projects WHERE project_id = %s", (project_id,))
+        invalidate_permissions(conn, project_id=project_id)
     else:
         raise HTTPException(status.HTTP_403_FORBIDDEN, "You don't have permission")
 
 
 
 
+@instrumented
+def upsert_document(conn, project_id: int, name: str, key: str, size: int, content_type: str, etag: str, digest: str | None = None) -> None:
+    """Adds a document to the documents index or updates it if it's already there.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+        project_id (int): ID of a project the document belongs to.
+        name (str): Name of the document within the project (`document_id` in routes).
+        key (str): Key of the S3 object with document's content.
+        size (int): Size of the document in bytes.
+        content_type (str): Content type of the document.
+        etag (str): ETag of the S3 object.
+        digest (str, optional): Digest of a blob with document's content, for deduplicated documents.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO documents (project_id, name, key, size, content_type, etag, digest)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (project_id, name) DO UPDATE
+            SET key = EXCLUDED.key,
+                size = EXCLUDED.size,
+                content_type = EXCLUDED.content_type,
+                etag = EXCLUDED.etag,
+                digest = EXCLUDED.digest,
+                modified_at = now();
+            """,
+            (project_id, name, key, size, content_type, etag, digest))
+
+@instrumented
+def delete_document(conn, project_id: int, name: str) -> bool:
+    """Removes a document from the documents index.
+
+    Also changes project's `modified_at` to current time, a removed document
+    leaves nothing behind to date the change of the project's listing.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+        project_id (int): ID of a project the document belongs to.
+        name (str): Name of the document within the project.
+
+    Returns:
+        bool: True if the document was in the index.
+    """
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM documents WHERE project_id = %s AND name = %s;", (project_id, name))
+        if cur.rowcount == 0:
+            return False
+        cur.execute("UPDATE projects SET modified_at = %s WHERE project_id = %s;", (current_time, project_id))
+        return True
+
+@instrumented
+def select_documents(conn, project_id: int) -> list[dict]:
+    """Queries the documents index for all documents of a project.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+        project_id (int): ID of a project whose documents are queried.
+
+    Returns:
+        list: Dictionaries with `name`, `key`, `size`, `content_type`, `etag`, `digest`, `created_at` and `modified_at`, ordered by name.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT name, key, size, content_type, etag, digest, created_at, modified_at
+            FROM documents
+            WHERE project_id = %s
+            ORDER BY name;
+            """,
+            (project_id,))
+        return cur.fetchall()
+
+@instrumented
+def select_document(conn, project_id: int, name: str) -> dict | None:
+    """Queries the documents index for one document.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+        project_id (int): ID of a project the document belongs to.
+        name (str): Name of the document within the project.
+
+    Returns:
+        dict: Same fields as `select_documents` returns, or None if the document isn't indexed.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT name, key, size, content_type, etag, digest, created_at, modified_at
+            FROM documents
+            WHERE project_id = %s AND name = %s;
+            """,
+            (project_id, name))
+        return cur.fetchone()
+
+@instrumented
+def select_document_names(conn, project_id: int) -> list[str]:
+    """Queries the documents index for names of all documents of a project.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+        project_id (int): ID of a project whose documents are queried.
+
+    Returns:
+        list: Names of documents ordered by name.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT name FROM documents WHERE project_id = %s ORDER BY name;", (project_id,))
+        return [row["name"] for row in cur.fetchall()]
+
+@instrumented
+def select_document_names_by_project(conn, project_ids: list[int], timeout: float | None = None) -> dict[int, list[str]]:
+    """Queries the documents index for names of documents of many projects at once.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+        project_ids (list): IDs of projects whose documents are queried.
+        timeout (float, optional): Seconds after which the query is cancelled, for the rest of the transaction.
+
+    Returns:
+        dict: Names of documents ordered by name for every requested project ID.
+
+    Raises:
+        psycopg2.errors.QueryCanceled: If the query took longer than `timeout`.
+    """
+    documents = {int(project_id): [] for project_id in project_ids}
+    with conn.cursor() as cur:
+        if timeout is not None:
+            cur.execute("SELECT set_config('statement_timeout', %s, true);", (f"{int(timeout * 1000)}ms",))
+        cur.execute("""
+            SELECT project_id, name
+            FROM documents
+            WHERE project_id = ANY(%s)
+            ORDER BY project_id, name;
+            """,
+            (list(documents),))
+        for row in cur.fetchall():
+            documents[row["project_id"]].append(row["name"])
+    return documents
+
+@instrumented
+def select_project_version(conn, project_id: int) -> dict | None:
+    """Queries what identifies the current state of a project and its documents listing.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+        project_id (int): ID of a project.
+
+    Returns:
+        dict: `modified_at` of the project, number of its `documents`, `listing_digest`
+            of their names and ETags and `documents_modified_at` of the latest change
+            to a document, or None if the project doesn't exist.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT p.modified_at, d.documents, d.listing_digest, d.documents_modified_at
+            FROM projects p
+            CROSS JOIN LATERAL (
+                SELECT
+                    count(*) AS documents,
+                    md5(coalesce(string_agg(name || '/' || etag, '|' ORDER BY name), '')) AS listing_digest,
+                    max(modified_at) AT TIME ZONE current_setting('TimeZone') AS documents_modified_at
+                FROM documents
+                WHERE project_id = p.project_id
+            ) d
+            WHERE p.project_id = %s;
+            """,
+            (project_id,))
+        return cur.fetchone()
+
+@instrumented
+def upsert_document_text(conn, project_id: int, name: str, etag: str, text: str, config: str = "simple") -> bool:
+    """Stores searchable text of a document version, unless the document changed or was removed meanwhile.
+
+    The document's name is indexed with a higher weight than its text.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+        project_id (int): ID of a project the document belongs to.
+        name (str): Name of the document within the project.
+        etag (str): ETag of the document version the text was extracted from.
+        text (str): Extracted text, may be empty.
+        config (str): Postgres text search configuration.
+
+    Returns:
+        bool: True if the text was stored.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO document_texts (project_id, name, etag, search, characters)
+            SELECT
+                d.project_id, d.name, d.etag,
+                setweight(to_tsvector(%(config)s::regconfig, regexp_replace(d.name, '[._/-]+', ' ', 'g')), 'A')
+                    || setweight(to_tsvector(%(config)s::regconfig, %(text)s), 'D'),
+                length(%(text)s)
+            FROM documents d
+            WHERE d.project_id = %(project_id)s AND d.name = %(name)s AND d.etag = %(etag)s
+            ON CONFLICT (project_id, name) DO UPDATE SET
+                etag = EXCLUDED.etag,
+                search = EXCLUDED.search,
+                characters = EXCLUDED.characters,
+                extracted_at = now();
+            """,
+            {"project_id": project_id, "name": name, "etag": etag, "text": text, "config": config})
+        return cur.rowcount > 0
+
+@instrumented
+def select_document_text_etag(conn, project_id: int, name: str) -> str | None:
+    """Returns ETag of the document version whose text is indexed, or None if none is."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT etag FROM document_texts WHERE project_id = %s AND name = %s;", (project_id, name))
+        row = cur.fetchone()
+        return row["etag"] if row is not None else None
+
+@instrumented
+def select_documents_without_text(conn, limit: int | None = None) -> list[dict]:
+    """Queries documents whose current version has no indexed text.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+        limit (int, optional): Maximum number of returned documents.
+
+    Returns:
+        list: Dictionaries with `project_id`, `name` and `etag`.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT d.project_id, d.name, d.etag
+            FROM documents d
+            LEFT JOIN document_texts t ON t.project_id = d.project_id AND t.name = d.name
+            WHERE t.etag IS DISTINCT FROM d.etag
+            ORDER BY d.project_id, d.name
+            LIMIT %s;
+            """,
+            (limit,))
+        return cur.fetchall()
+
+@instrumented
+def search_documents(conn, user_id: str, query: str, config: str = "simple", limit: int = 20, offset: int = 0) -> list[dict]:
+    """Full-text search in documents of projects the user has access to.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+        user_id (str): ID of a user whose projects are searched.
+        query (str): Search terms in web search syntax, e.g. `"exact phrase" -excluded`.
+        config (str): Postgres text search configuration the texts were indexed with.
+        limit (int): Maximum number of returned documents.
+        offset (int): Number of best matching documents to skip.
+
+    Returns:
+        list: Dictionaries with `project_id`, `project_name`, `name` and `rank`, best matches first.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT t.project_id, p.name AS project_name, t.name, ts_rank_cd(t.search, q.query) AS rank
+            FROM websearch_to_tsquery(%(config)s::regconfig, %(query)s) AS q(query)
+            JOIN document_texts t ON t.search @@ q.query
+            JOIN user_project up ON up.project_id = t.project_id AND up.user_id = %(user_id)s
+            JOIN projects p ON p.project_id = t.project_id
+            ORDER BY rank DESC, t.project_id, t.name
+            LIMIT %(limit)s OFFSET %(offset)s;
+            """,
+            {"user_id": user_id, "query": query, "config": config, "limit": limit, "offset": offset})
+        return cur.fetchall()
+
+@instrumented
+def select_project_ids(conn) -> list[int]:
+    """Queries IDs of all projects.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+
+    Returns:
+        list: Project IDs in ascending order.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT project_id FROM projects ORDER BY project_id;")
+        return [row["project_id"] for row in cur.fetchall()]
+
+@instrumented
+def select_existing_project_ids(conn, project_ids: list[int]) -> set[int]:
+    """Queries which of the given project IDs belong to existing projects.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+        project_ids (list): Checked project IDs.
+
+    Returns:
+        set: IDs of existing projects.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT project_id FROM projects WHERE project_id = ANY(%s);", (list(project_ids),))
+        return {row["project_id"] for row in cur.fetchall()}
+
+@instrumented
+def lock_blob(conn, digest: str) -> dict | None:
+    """Queries a blob and locks it until the end of the transaction.
+
+    While the lock is held garbage collection can't remove the blob, so a
+    document referencing it can be inserted safely in the same transaction.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+        digest (str): SHA-256 of blob's content.
+
+    Returns:
+        dict: `digest`, `key`, `size`, `etag` and `ref_count` of the blob, or None if there is no such blob.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT digest, key, size, etag, ref_count FROM blobs WHERE digest = %s FOR UPDATE;", (digest,))
+        return cur.fetchone()
+
+@instrumented
+def insert_blob(conn, digest: str, key: str, size: int, etag: str) -> None:
+    """Records a blob stored in S3, does nothing if it's already recorded.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+        digest (str): SHA-256 of blob's content.
+        key (str): Key of the S3 object with the content.
+        size (int): Size of the content in bytes.
+        etag (str): ETag of the S3 object.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO blobs (digest, key, size, etag, unreferenced_at)
+            VALUES (%s, %s, %s, %s, now())
+            ON CONFLICT (digest) DO NOTHING;
+            """,
+            (digest, key, size, etag))
+
+@instrumented
+def delete_unreferenced_blobs(conn, grace_seconds: float, limit: int = 1000) -> list[dict]:
+    """Removes records of blobs no document has referenced for at least `grace_seconds`.
+
+    The records stay locked until the transaction ends, it should be committed
+    only after the S3 objects are deleted, so no upload can reference a blob
+    that is being removed.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+        grace_seconds (float): How long a blob has to be unreferenced.
+        limit (int): Maximum number of removed blobs.
+
+    Returns:
+        list: `digest`, `key` and `size` of removed blobs.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            DELETE FROM blobs
+            WHERE digest IN (
+                SELECT digest FROM blobs
+                WHERE ref_count = 0 AND unreferenced_at <= now() - make_interval(secs => %s)
+                ORDER BY unreferenced_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            AND ref_count = 0
+            RETURNING digest, key, size;
+            """,
+            (grace_seconds, limit))
+        return cur.fetchall()
+
+@instrumented
+def select_dedup_stats(conn) -> dict:
+    """Queries sizes of deduplicated documents and of blobs storing them.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+
+    Returns:
+        dict: `documents`, `logical_bytes`, `blobs`, `stored_bytes` and `dedup_ratio`, logical to stored bytes.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT
+                (SELECT count(*) FROM documents WHERE digest IS NOT NULL) AS documents,
+                (SELECT coalesce(sum(size), 0) FROM documents WHERE digest IS NOT NULL) AS logical_bytes,
+                (SELECT count(*) FROM blobs) AS blobs,
+                (SELECT coalesce(sum(size), 0) FROM blobs) AS stored_bytes;
+            """)
+        stats = {key: int(value) for key, value in cur.fetchone().items()}
+    stats["dedup_ratio"] = stats["logical_bytes"] / stats["stored_bytes"] if stats["stored_bytes"] else 1.0
+    return stats
+
+@instrumented
+def insert_job(conn, kind: str, payload: dict, created_by: str | None = None, max_attempts: int = 5) -> int:
+    """Adds a job to the queue, it's processed once the transaction commits.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+        kind (str): Name of a registered job handler.
+        payload (dict): JSON serializable arguments of the handler.
+        created_by (str, optional): ID of a user who requested the job.
+        max_attempts (int): Attempts before the job is marked as failed.
+
+    Returns:
+        int: ID of the job.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO jobs (kind, payload, created_by, max_attempts)
+            VALUES (%s, %s, %s, %s)
+            RETURNING job_id;
+            """,
+            (kind, json.dumps(payload), created_by, max_attempts))
+        return cur.fetchone()["job_id"]
+
+@instrumented
+def claim_job(conn, lease_seconds: float) -> dict | None:
+    """Takes the next due job, or a running job whose lease expired, and leases it.
+
+    Claiming counts an attempt, so a job whose worker died on its last
+    attempt is marked as failed instead of being claimed again.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+        lease_seconds (float): How long the job belongs to the caller unless the lease is extended.
+
+    Returns:
+        dict: The claimed job, or None if no job is due.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE jobs
+            SET status = 'failed', last_error = 'Lease expired', locked_until = NULL, updated_at = now()
+            WHERE status = 'running' AND locked_until < now() AND attempts >= max_attempts;
+            """)
+        cur.execute("""
+            UPDATE jobs
+            SET status = 'running',
+                attempts = attempts + 1,
+                locked_until = now() + make_interval(secs => %s),
+                updated_at = now()
+            WHERE job_id = (
+                SELECT job_id FROM jobs
+                WHERE ((status = 'queued' AND run_at <= now())
+                    OR (status = 'running' AND locked_until < now()))
+                    AND attempts < max_attempts
+                ORDER BY run_at
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *;
+            """,
+            (lease_seconds,))
+        return cur.fetchone()
+
+@instrumented
+def extend_job_lease(conn, job_id: int, attempt: int, lease_seconds: float) -> bool:
+    """Extends the lease of a running job.
+
+    Returns:
+        bool: False if the job was meanwhile claimed by another worker or finished.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE jobs
+            SET locked_until = now() + make_interval(secs => %s), updated_at = now()
+            WHERE job_id = %s AND attempts = %s AND status = 'running';
+            """,
+            (lease_seconds, job_id, attempt))
+        return cur.rowcount > 0
+
+@instrumented
+def complete_job(conn, job_id: int, attempt: int, result: dict | None = None) -> None:
+    """Marks an attempt of a job as succeeded, unless another worker took the job over."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE jobs
+            SET status = 'succeeded', result = %s, locked_until = NULL, updated_at = now()
+            WHERE job_id = %s AND attempts = %s AND status = 'running';
+            """,
+            (json.dumps(result), job_id, attempt))
+
+@instrumented
+def fail_job(conn, job_id: int, attempt: int, error: str, retry_in: float | None) -> None:
+    """Records a failed attempt of a job.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+        job_id (int): ID of the job.
+        attempt (int): Number of the failed attempt.
+        error (str): Description of the failure.
+        retry_in (float, optional): Seconds until the next attempt, None marks the job as failed.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE jobs
+            SET status = CASE WHEN %s IS NULL THEN 'failed' ELSE 'queued' END,
+                run_at = now() + make_interval(secs => coalesce(%s, 0)),
+                last_error = %s,
+                locked_until = NULL,
+                updated_at = now()
+            WHERE job_id = %s AND attempts = %s AND status = 'running';
+            """,
+            (retry_in, retry_in, error, job_id, attempt))
+
+@instrumented
+def select_job(conn, job_id: int) -> dict | None:
+    """Queries a job by its ID.
+
+    Returns:
+        dict: The job, or None if there is no such job.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT * FROM jobs WHERE job_id = %s;", (job_id,))
+        return cur.fetchone()
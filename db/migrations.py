@@ -0,0 +1,118 @@
+import argparse
+import re
+from pathlib import Path
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "sql" / "migrations"
+MIGRATION_FILE_PATTERN = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+# Key of the advisory lock that serializes migrations of concurrently starting workers
+MIGRATION_LOCK_ID = 7_351_240
+
+
+def load_migrations(directory: Path = MIGRATIONS_DIR) -> list[tuple[int, str, Path]]:
+    """Finds migration files named `<version>_<name>.sql`.
+
+    Args:
+        directory (Path): Directory with migration files.
+
+    Raises:
+        ValueError: If two migrations share the same version.
+
+    Returns:
+        list: Tuples (version, name, path) sorted by version.
+    """
+    migrations = {}
+    for path in directory.glob("*.sql"):
+        match = MIGRATION_FILE_PATTERN.match(path.name)
+        if match is None:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise ValueError(f"Duplicated migration version {version}: {path.name}, {migrations[version][2].name}")
+        migrations[version] = (version, match.group(2), path)
+    return [migrations[version] for version in sorted(migrations)]
+
+def applied_versions(conn) -> set[int]:
+    """Returns versions of migrations already applied to the database.
+
+    Args:
+        conn (psycopg2.connect): Connection to database.
+    """
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT now()
+            );
+            """)
+        cur.execute("SELECT version FROM schema_migrations")
+        return {row["version"] for row in cur.fetchall()}
+
+def migrate(conn, directory: Path = MIGRATIONS_DIR) -> list[str]:
+    """Applies pending migrations, each one in its own transaction.
+
+    Migrations are written to be idempotent, and applied versions are recorded in
+    `schema_migrations`, so running it again is a no-op.
+
+    Args:
+        conn (psycopg2.connect): Connection to database, not in autocommit mode.
+        directory (Path): Directory with migration files.
+
+    Returns:
+        list: File names of applied migrations.
+    """
+    applied = []
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    try:
+        done = applied_versions(conn)
+        conn.commit()
+
+        for version, name, path in load_migrations(directory):
+            if version in done:
+                continue
+            with conn.cursor() as cur:
+                cur.execute(path.read_text())
+                cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            conn.commit()
+            applied.append(path.name)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        conn.commit()
+    return applied
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Applies pending database migrations from sql/migrations")
+    parser.add_argument("--list", action="store_true", help="only list migrations and whether they are applied")
+    args = parser.parse_args(argv)
+
+    from db.db import DB_CONFIG
+
+    conn = psycopg2.connect(**DB_CONFIG, cursor_factory=RealDictCursor)
+    try:
+        if args.list:
+            done = applied_versions(conn)
+            conn.commit()
+            for version, name, path in load_migrations():
+                print(f"[{'x' if version in done else ' '}] {path.name}")
+            return
+
+        applied = migrate(conn)
+        for file_name in applied:
+            print(f"Applied {file_name}")
+        if not applied:
+            print("Database is up to date")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
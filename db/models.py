@@ -20,6 +20,10 @@ class Permission(str, Enum):
     owner: str = "owner"
     participant: str = "participant" 
 
+class SortOrder(str, Enum):
+    asc: str = "asc"
+    desc: str = "desc"
+
 class User_Project(BaseModel):
     user_id: str
     project_id: int
@@ -32,6 +36,16 @@ class Project(BaseModel):
     created_at: datetime | None = None
     modified_at: datetime  | None = None
 
+class PresignedUploadFile(BaseModel):
+    name: str
+    content_type: str | None = None
+
+class PresignedUploadRequest(BaseModel):
+    files: list[PresignedUploadFile]
+
+class UploadConfirmation(BaseModel):
+    names: list[str]
+
 class TokenResponse(BaseModel):
     access_token: str
     token_type: str = "bearer"
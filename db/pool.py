@@ -0,0 +1,220 @@
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out within the timeout."""
+
+
+class PoolClosed(Exception):
+    """Raised when a connection is requested from a closed pool."""
+
+
+class ConnectionPool:
+    """Thread safe pool of psycopg2 connections.
+
+    Connections are handed out LIFO, so a small set of warm connections serves
+    most of the traffic while the rest may sit idle. When every connection is
+    in use, `getconn` waits up to `timeout` seconds for one to be returned.
+
+    Args:
+        min_size (int): Connections opened by `open()` and kept around.
+        max_size (int): Upper limit of connections opened at the same time.
+        timeout (float): Seconds `getconn` waits for a free connection.
+        health_check_after (float): Idle seconds after which a connection is
+            pinged with `SELECT 1` on checkout. 0 pings on every checkout.
+        **connect_kwargs: Passed as is to `psycopg2.connect`.
+    """
+
+    def __init__(self, min_size: int = 1, max_size: int = 10, timeout: float = 30.0, health_check_after: float = 30.0, **connect_kwargs):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min_size={min_size}, max_size={max_size}")
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self._connect_kwargs = connect_kwargs
+
+        self._idle = deque()
+        self._last_used = {}
+        self._size = 0
+        self._waiting = 0
+        self._closed = True
+        self._cond = threading.Condition()
+
+        self._counters = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "connections_created": 0,
+            "connections_discarded": 0,
+            "health_checks_failed": 0,
+            "wait_seconds_total": 0.0,
+        }
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def open(self) -> None:
+        """Opens the pool and fills it up to `min_size` connections."""
+        with self._cond:
+            if not self._closed:
+                return
+            self._closed = False
+
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            conn = self._connect()
+            self.putconn(conn)
+
+    def close(self) -> None:
+        """Closes idle connections. Connections in use are closed when returned."""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+
+        for conn in idle:
+            self._last_used.pop(id(conn), None)
+            conn.close()
+
+    def getconn(self, timeout: float | None = None):
+        """Checks out a healthy connection.
+
+        Args:
+            timeout (float, optional): Overrides the pool's checkout timeout.
+
+        Raises:
+            PoolTimeout: If no connection is available within the timeout.
+            PoolClosed: If the pool has been closed.
+
+        Returns:
+            connection: psycopg2 connection, has to be given back with `putconn`.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolClosed("Connection pool is closed")
+                    if self._idle:
+                        conn = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters["timeouts"] += 1
+                        raise PoolTimeout(f"No database connection available after {timeout}s")
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn):
+                self._discard(conn)
+                continue
+
+            with self._cond:
+                self._counters["checkouts"] += 1
+                self._counters["wait_seconds_total"] += time.monotonic() - started
+            return conn
+
+    def putconn(self, conn, discard: bool = False) -> None:
+        """Returns a connection to the pool.
+
+        Args:
+            conn (connection): Connection checked out with `getconn`.
+            discard (bool): Closes the connection instead of keeping it.
+        """
+        if not discard and not conn.closed:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+        if discard or conn.closed or self._closed:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._last_used[id(conn)] = time.monotonic()
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        """Returns a snapshot of the pool's size and counters."""
+        with self._cond:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "waiting": self._waiting,
+                "closed": self._closed,
+                **self._counters,
+            }
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._connect_kwargs)
+        with self._cond:
+            self._counters["connections_created"] += 1
+        return conn
+
+    def _discard(self, conn) -> None:
+        self._last_used.pop(id(conn), None)
+        try:
+            conn.close()
+        finally:
+            with self._cond:
+                self._size -= 1
+                self._counters["connections_discarded"] += 1
+                self._cond.notify()
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        idle_for = time.monotonic() - self._last_used.get(id(conn), 0.0)
+        if idle_for < self.health_check_after:
+            return True
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            with self._cond:
+                self._counters["health_checks_failed"] += 1
+            return False
@@ -1,7 +1,19 @@
 from fastapi import FastAPI
 from starlette.middleware.sessions import SessionMiddleware
 
-from views import auth, document, project
+from contextlib import asynccontextmanager
+
+from views import auth, document, project, stats, jobs, search, metrics, admin
+from db.db import open_pool, close_pool, get_db, start_permission_listener, stop_permission_listener
+from db.migrations import migrate
+from db.aio import shutdown_executors
+from storage.s3 import open_s3_client, close_s3_client
+from storage.disk_cache import document_cache
+from tasks.queue import job_worker
+from search.extract import shutdown_extraction_pool
+from observability.metrics import MetricsMiddleware
+from observability.profiler import ProfilerMiddleware, request_profiler
+from observability.watchdog import LOOP_WATCHDOG_ENABLED, loop_watchdog
 
 
 from dotenv import load_dotenv
@@ -10,11 +22,46 @@ import os
 load_dotenv()
 
 SECRET_KEY = os.getenv("SECRET_KEY")
+MIGRATE_ON_STARTUP = os.getenv("DB_MIGRATE_ON_STARTUP", "true").lower() == "true"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    open_pool()
+    if MIGRATE_ON_STARTUP:
+        with get_db() as conn:
+            migrate(conn)
+    start_permission_listener()
+    await open_s3_client()
+    document_cache.open()
+    job_worker.start()
+    request_profiler.start()
+    if LOOP_WATCHDOG_ENABLED:
+        loop_watchdog.start()
+    try:
+        yield
+    finally:
+        await loop_watchdog.stop()
+        request_profiler.stop()
+        await job_worker.stop()
+        shutdown_extraction_pool()
+        document_cache.close()
+        await close_s3_client()
+        stop_permission_listener()
+        shutdown_executors()
+        close_pool()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(SessionMiddleware, secret_key=SECRET_KEY)
+app.add_middleware(ProfilerMiddleware)
+# Added last, so it wraps the whole stack and times everything a request goes through
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(auth.router)
 app.include_router(project.router)
-app.include_router(document.router)
\ No newline at end of file
+app.include_router(document.router)
+app.include_router(stats.router)
+app.include_router(jobs.router)
+app.include_router(search.router)
+app.include_router(metrics.router)
+app.include_router(admin.router)
\ No newline at end of file
@@ -0,0 +1,303 @@
+import bisect
+import threading
+import time
+
+from observability.profiler import record_span
+
+# Seconds, from a cached permission lookup to a large document transfer
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames: tuple, labelvalues: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Registry:
+    """Collection of metrics rendered together in the Prometheus text format.
+
+    `prometheus_client` isn't used on purpose. The app needs only counters,
+    gauges and histograms in one exposition format, and every worker is
+    scraped on its own, so the library's multiprocess mode would go unused.
+    Labelled metrics read at scrape time, like the pool's connections by
+    state, are a `callback` here but a custom collector there.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: "Metric") -> None:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    """Base of metrics with a fixed set of label names.
+
+    Children holding the values of one combination of labels are created on
+    first use and kept, so the hot path is a dictionary lookup and an update
+    under the child's lock. A metric with a `callback` has no children, its
+    samples are read from the callback when metrics are rendered.
+
+    Args:
+        name (str): Name of the metric.
+        help (str): Description shown in the exposition.
+        labelnames (tuple): Names of the labels.
+        callback (callable, optional): Returns `{label values tuple: value}` at render time.
+        registry (Registry): Registry the metric is rendered by.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), callback=None, registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._children = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *labelvalues):
+        child = self._children.get(labelvalues)
+        if child is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labelvalues}")
+            with self._lock:
+                child = self._children.setdefault(labelvalues, self._new_child())
+        return child
+
+    def samples(self) -> list[str]:
+        if self.callback is not None:
+            return [
+                f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+                for labelvalues, value in self.callback().items()
+            ]
+        with self._lock:
+            children = list(self._children.items())
+        return [line for labelvalues, child in children for line in self._child_samples(labelvalues, child)]
+
+    def _child_samples(self, labelvalues: tuple, child) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(child.get())}"]
+
+
+class _Value:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = value
+
+    def get(self) -> float:
+        with self._lock:
+            return self._value
+
+
+class Counter(Metric):
+    """Monotonically increasing total, e.g. requests or bytes."""
+
+    type = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Increments the counter without labels."""
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    """Value that goes up and down, e.g. requests in flight."""
+
+    type = "gauge"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+
+class _HistogramValue:
+    def __init__(self, buckets: tuple):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def get(self) -> tuple[list[int], float]:
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+class Histogram(Metric):
+    """Distribution of observed values, e.g. latencies, in cumulative buckets.
+
+    Args:
+        buckets (tuple): Upper bounds of the buckets, `+Inf` is added.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry=registry)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _child_samples(self, labelvalues: tuple, child: _HistogramValue) -> list[str]:
+        counts, total = child.get()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = 'le="' + _format_value(bound) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, labelvalues)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+HTTP_REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being handled.")
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time from receiving a request until its response was sent.", ("method", "route", "status"))
+HTTP_REQUEST_BYTES = Counter("http_request_body_bytes_total", "Bytes of request bodies received.", ("route",))
+HTTP_RESPONSE_BYTES = Counter("http_response_body_bytes_total", "Bytes of response bodies sent, including streamed documents.", ("route",))
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "Time of SQL statements by the function executing them.", ("function",))
+S3_REQUESTS_IN_FLIGHT = Gauge("s3_requests_in_flight", "S3 API calls waiting for a response.")
+S3_REQUEST_SECONDS = Histogram("s3_request_duration_seconds", "Time of S3 API calls including retries.", ("operation", "status"))
+
+
+def _route_of(scope: dict) -> str:
+    route = scope.get("route")
+    # Unmatched paths share one label, so random URLs can't add series
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, in-flight requests and body bytes of HTTP requests.
+
+    Requests are labelled with the template of their route, e.g. `/projects/{project_id}`.
+    A streamed response is timed until its last chunk was sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        state = {"status": 500, "content_length": 0, "received": 0, "sent": 0}
+
+        async def receive_counted():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+            return message
+
+        async def send_counted(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                state["content_length"] = int(dict(message.get("headers", [])).get(b"content-length", 0))
+            elif message["type"] == "http.response.body":
+                state["sent"] += len(message.get("body", b""))
+            elif message["type"] == "http.response.pathsend":
+                # The file may be gone by now, its size was announced when the response started
+                state["sent"] += state["content_length"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive_counted, send_counted)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            route = _route_of(scope)
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route, str(state["status"])).observe(time.perf_counter() - start)
+            if state["received"]:
+                HTTP_REQUEST_BYTES.labels(route).inc(state["received"])
+            if state["sent"]:
+                HTTP_RESPONSE_BYTES.labels(route).inc(state["sent"])
+
+
+def instrument_s3_client(client) -> None:
+    """Records duration and outcome of every API call the S3 client makes.
+
+    All operations, including paginated ones, go through the client's
+    `_make_api_call`, so wrapping it covers them in one place, also calls
+    that fail without a response.
+    """
+    make_api_call = client._make_api_call
+
+    async def timed_api_call(operation_name, api_params):
+        start = time.perf_counter()
+        status = "error"
+        S3_REQUESTS_IN_FLIGHT.inc()
+        try:
+            response = await make_api_call(operation_name, api_params)
+            status = str(response.get("ResponseMetadata", {}).get("HTTPStatusCode", 200))
+            return response
+        except Exception as e:
+            response = getattr(e, "response", None)
+            if isinstance(response, dict):
+                status = str(response.get("ResponseMetadata", {}).get("HTTPStatusCode", "error"))
+            raise
+        finally:
+            S3_REQUESTS_IN_FLIGHT.dec()
+            elapsed = time.perf_counter() - start
+            S3_REQUEST_SECONDS.labels(operation_name, status).observe(elapsed)
+            record_span("s3", elapsed, operation_name)
+
+    client._make_api_call = timed_api_call
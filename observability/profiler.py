@@ -0,0 +1,261 @@
+from dotenv import load_dotenv
+import asyncio
+import contextvars
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime, timezone
+
+load_dotenv()
+
+# Shared secret of the admin endpoints and the `X-Profile-Token` header, both are disabled without it
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") or None
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "true").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_SECONDS", 0.01))
+PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", 50))
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", 2))
+
+PROFILE_TOKEN_HEADER = b"x-profile-token"
+# Stacks of requests running longer than this part of the slow threshold are sampled, so a slow request's profile covers its tail
+SLOW_SAMPLING_FRACTION = 0.5
+MAX_STACK_DEPTH = 64
+
+_current_profile = contextvars.ContextVar("current_profile", default=None)
+
+
+def is_admin_token(token: str | None) -> bool:
+    """Checks a token against `ADMIN_TOKEN` in constant time, always False when it isn't set."""
+    return ADMIN_TOKEN is not None and token is not None and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def record_span(kind: str, seconds: float, name: str | None = None) -> None:
+    """Adds time spent in a DB call or an S3 await to the profile of the current request, if there is one."""
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.add_span(kind, seconds, name)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}.{getattr(code, 'co_qualname', code.co_name)}:{frame.f_lineno}"
+
+def _thread_stack(frame) -> list[str]:
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+def _await_stack(coro) -> list[str]:
+    """Follows a suspended coroutine's chain of awaits down to what it's waiting for."""
+    stack = []
+    while coro is not None and len(stack) < MAX_STACK_DEPTH:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "ag_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            stack.append(f"[waiting for {type(coro).__name__}]")
+            break
+        stack.append(_frame_label(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "ag_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return stack
+
+
+class RequestProfile:
+    """Time split and stack samples of one request.
+
+    Args:
+        method (str): HTTP method.
+        path (str): Requested path.
+        reason (str, optional): Why the request is profiled from its start, `requested` or `sampled`.
+    """
+
+    def __init__(self, method: str, path: str, reason: str | None = None):
+        self.profile_id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.task = asyncio.current_task()
+        self.thread_id = threading.get_ident()
+        self.spans = {"db": [0.0, 0], "s3": [0.0, 0]}
+        self.span_names = Counter()
+        self.samples = Counter()
+        self._lock = threading.Lock()
+
+    def add_span(self, kind: str, seconds: float, name: str | None = None) -> None:
+        with self._lock:
+            span = self.spans.setdefault(kind, [0.0, 0])
+            span[0] += seconds
+            span[1] += 1
+            if name is not None:
+                self.span_names[f"{kind}:{name}"] += seconds
+
+    def sample(self, thread_frame) -> None:
+        """Records where the request's task is: its Python frames when it's running, its awaits when it's suspended."""
+        coro = self.task.get_coro() if self.task is not None else None
+        if coro is None:
+            return
+        if getattr(coro, "cr_running", False) and thread_frame is not None:
+            stack = _thread_stack(thread_frame) + ["[running]"]
+        else:
+            stack = _await_stack(coro)
+        with self._lock:
+            self.samples[";".join(stack)] += 1
+
+    def finish(self, route: str, status: int) -> dict:
+        duration = time.perf_counter() - self.start
+        with self._lock:
+            spans = {kind: {"seconds": round(seconds, 6), "calls": calls} for kind, (seconds, calls) in self.spans.items()}
+            span_names = {name: round(seconds, 6) for name, seconds in self.span_names.most_common()}
+            samples = dict(self.samples.most_common())
+        awaited = sum(span["seconds"] for span in spans.values())
+        return {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "route": route,
+            "status": status,
+            "reason": self.reason or "slow",
+            "started_at": self.started_at.isoformat(),
+            "duration_seconds": round(duration, 6),
+            "time_split": {**spans, "other": {"seconds": round(max(duration - awaited, 0.0), 6)}},
+            "time_by_call": span_names,
+            "sample_interval_seconds": PROFILE_INTERVAL_SECONDS,
+            "samples": samples,
+        }
+
+
+class RequestProfiler:
+    """Keeps the time split of requests in flight, samples their stacks and stores profiles worth keeping.
+
+    A request is profiled from its start when it carries `X-Profile-Token` with
+    the admin token or is picked by `PROFILE_SAMPLE_RATE`. Every other request
+    is sampled once it runs for half of `SLOW_REQUEST_SECONDS`, and kept if it
+    ends up slower than that. Samples are taken by a background thread, so the
+    request itself only pays for the bookkeeping of its DB and S3 calls.
+
+    Args:
+        interval (float): Seconds between stack samples.
+        buffer_size (int): Number of kept profiles, the oldest are dropped.
+        slow_seconds (float): Duration from which a request's profile is kept.
+    """
+
+    def __init__(self, interval: float = 0.01, buffer_size: int = 50, slow_seconds: float = 2.0):
+        self.interval = interval
+        self.slow_seconds = slow_seconds
+        self.profiles = deque(maxlen=buffer_size)
+        self._active = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def begin(self, profile: RequestProfile) -> contextvars.Token:
+        with self._lock:
+            self._active[profile.profile_id] = profile
+        return _current_profile.set(profile)
+
+    def end(self, profile: RequestProfile, token: contextvars.Token, route: str, status: int) -> dict | None:
+        """Stops profiling a request.
+
+        Returns:
+            dict: The stored profile, or None if the request wasn't worth keeping.
+        """
+        _current_profile.reset(token)
+        with self._lock:
+            self._active.pop(profile.profile_id, None)
+        result = profile.finish(route, status)
+        if profile.reason is None and result["duration_seconds"] < self.slow_seconds:
+            return None
+        self.profiles.append(result)
+        return result
+
+    def summaries(self) -> list[dict]:
+        """Returns stored profiles without their samples, newest first."""
+        return [{key: value for key, value in profile.items() if key != "samples"} for profile in reversed(self.profiles)]
+
+    def get(self, profile_id: str) -> dict | None:
+        for profile in self.profiles:
+            if profile["profile_id"] == profile_id:
+                return profile
+        return None
+
+    def sample(self) -> None:
+        """Takes one stack sample of every request that's being profiled."""
+        sampled_after = time.perf_counter() - self.slow_seconds * SLOW_SAMPLING_FRACTION
+        with self._lock:
+            active = [profile for profile in self._active.values() if profile.reason is not None or profile.start <= sampled_after]
+        if not active:
+            return
+        frames = sys._current_frames()
+        for profile in active:
+            profile.sample(frames.get(profile.thread_id))
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+
+request_profiler = RequestProfiler(
+    interval=PROFILE_INTERVAL_SECONDS,
+    buffer_size=PROFILE_BUFFER_SIZE,
+    slow_seconds=SLOW_REQUEST_SECONDS,
+)
+
+
+class ProfilerMiddleware:
+    """ASGI middleware that profiles requests with `request_profiler`.
+
+    A request profiled on demand gets an `X-Profile-Id` response header with
+    the ID its profile can be downloaded with.
+    """
+
+    def __init__(self, app, profiler: RequestProfiler = request_profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILER_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        reason = None
+        if is_admin_token(dict(scope["headers"]).get(PROFILE_TOKEN_HEADER, b"").decode("latin-1") or None):
+            reason = "requested"
+        elif PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            reason = "sampled"
+
+        profile = RequestProfile(scope["method"], scope["path"], reason)
+        state = {"status": 500}
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                if reason == "requested":
+                    message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile.profile_id.encode())]
+            await send(message)
+
+        token = self.profiler.begin(profile)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            self.profiler.end(profile, token, route, state["status"])
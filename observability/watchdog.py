@@ -0,0 +1,127 @@
+from dotenv import load_dotenv
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from observability.metrics import Counter, Gauge, Histogram
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LOOP_WATCHDOG_ENABLED = os.getenv("LOOP_WATCHDOG_ENABLED", "true").lower() == "true"
+LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("LOOP_LAG_INTERVAL_SECONDS", 0.05))
+LOOP_BLOCK_THRESHOLD_SECONDS = float(os.getenv("LOOP_BLOCK_THRESHOLD_SECONDS", 0.1))
+# Lag measurements the reported percentiles are computed from
+LOOP_LAG_WINDOW = 1200
+STACK_LIMIT = 40
+QUANTILES = (0.5, 0.9, 0.99, 1.0)
+
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds",
+    "How much later than scheduled the event loop ran a timer.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+EVENT_LOOP_BLOCKS = Counter("event_loop_blocks_total", "Times a callback blocked the event loop longer than the threshold.")
+
+
+class LoopWatchdog:
+    """Measures event loop lag and reports callbacks that block the loop.
+
+    A task on the loop sleeps for `interval` and records how late it wakes up.
+    A thread checks that the task keeps waking up; when it's late by more than
+    `threshold`, whatever blocks the loop is still running, so the thread logs
+    the loop thread's current stack.
+
+    Args:
+        interval (float): Seconds between lag measurements.
+        threshold (float): Lag from which the loop counts as blocked.
+        window (int): Number of recent measurements percentiles are computed from.
+    """
+
+    def __init__(self, interval: float = 0.05, threshold: float = 0.1, window: int = LOOP_LAG_WINDOW):
+        self.interval = interval
+        self.threshold = threshold
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._beat = None
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        """Starts watching the running event loop."""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._measure(), name="loop-watchdog")
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        task, thread, self._task, self._thread = self._task, self._thread, None, None
+        self._stop.set()
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        if thread is not None:
+            thread.join()
+
+    def percentiles(self) -> dict:
+        """Returns lag percentiles over the recent measurements, `1.0` is the maximum."""
+        with self._lock:
+            recent = sorted(self._recent)
+        if not recent:
+            return {}
+        return {quantile: recent[min(int(quantile * len(recent)), len(recent) - 1)] for quantile in QUANTILES}
+
+    def stats(self) -> dict:
+        with self._lock:
+            measurements = len(self._recent)
+        return {
+            "running": self._task is not None,
+            "measurements": measurements,
+            "blocks": EVENT_LOOP_BLOCKS.labels().get(),
+            **{f"p{quantile * 100:g}" if quantile < 1 else "max": round(lag, 6) for quantile, lag in self.percentiles().items()},
+        }
+
+    async def _measure(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+            lag = max(now - start - self.interval, 0.0)
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+            with self._lock:
+                self._recent.append(lag)
+
+    def _watch(self) -> None:
+        reported_beat = None
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked < self.threshold or beat == reported_beat:
+                continue
+            # Reported once per block, the stack is of the callback still holding the loop
+            reported_beat = beat
+            EVENT_LOOP_BLOCKS.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame, limit=STACK_LIMIT)) if frame is not None else "  unknown\n"
+            logger.warning("Event loop blocked for over %.3fs, running:\n%s", blocked, stack.rstrip())
+
+
+def _lag_percentiles() -> dict:
+    return {(f"{quantile:g}",): lag for quantile, lag in loop_watchdog.percentiles().items()}
+
+Gauge("event_loop_lag_recent_seconds", "Percentiles of recent event loop lag, quantile 1 is the maximum.", ("quantile",), callback=_lag_percentiles)
+
+loop_watchdog = LoopWatchdog(interval=LOOP_LAG_INTERVAL_SECONDS, threshold=LOOP_BLOCK_THRESHOLD_SECONDS)
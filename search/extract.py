@@ -0,0 +1,101 @@
+from dotenv import load_dotenv
+import asyncio
+import io
+import multiprocessing
+import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+load_dotenv()
+
+SEARCH_EXTRACTION_PROCESSES = max(int(os.getenv("SEARCH_EXTRACTION_PROCESSES", 2)), 1)
+SEARCH_MAX_TEXT_CHARS = int(os.getenv("SEARCH_MAX_TEXT_CHARS", 200_000))
+
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+# Largest uncompressed `word/document.xml` read from a DOCX file
+MAX_DOCX_XML_BYTES = 64 * 1024 * 1024
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+_pool = None
+
+
+class ExtractionError(Exception):
+    """The document's content can't be parsed, retrying won't help."""
+
+
+def _pdf_text(data: bytes) -> str:
+    # Imported here, so worker processes that never see a PDF don't load it
+    from pypdf import PdfReader
+
+    reader = PdfReader(io.BytesIO(data))
+    return "\n".join(page.extract_text() or "" for page in reader.pages)
+
+def _docx_text(data: bytes) -> str:
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        info = archive.getinfo("word/document.xml")
+        if info.file_size > MAX_DOCX_XML_BYTES:
+            raise ExtractionError(f"word/document.xml has {info.file_size} bytes")
+        root = ElementTree.fromstring(archive.read(info))
+    paragraphs = root.iter(f"{WORD_NAMESPACE}p")
+    return "\n".join("".join(node.text or "" for node in paragraph.iter(f"{WORD_NAMESPACE}t")) for paragraph in paragraphs)
+
+def _plain_text(data: bytes) -> str:
+    return data.decode("utf-8", errors="replace")
+
+
+# Extensions without an extractor, like images, are searchable by name only
+EXTRACTORS = {
+    ".pdf": _pdf_text,
+    ".docx": _docx_text,
+    ".txt": _plain_text,
+    ".md": _plain_text,
+    ".csv": _plain_text,
+}
+
+
+def extract_text(filename: str, data: bytes) -> str:
+    """Extracts plain text of a document, chosen by the extension of its name.
+
+    Runs in worker processes of the extraction pool, so parsing large files
+    never blocks the event loop or holds the GIL of the application.
+
+    Args:
+        filename (str): Name of the document.
+        data (bytes): Content of the document.
+
+    Returns:
+        str: Text with collapsed whitespace, at most `SEARCH_MAX_TEXT_CHARS` long,
+            empty for formats without an extractor.
+
+    Raises:
+        ExtractionError: If the content is damaged or not in the format its extension says.
+    """
+    extractor = EXTRACTORS.get(os.path.splitext(filename.lower())[1])
+    if extractor is None:
+        return ""
+    try:
+        text = extractor(data)
+    except ExtractionError:
+        raise
+    except Exception as e:
+        raise ExtractionError(f"{type(e).__name__}: {e}") from None
+    # Postgres text can't hold NUL characters
+    text = WHITESPACE_PATTERN.sub(" ", text.replace("\x00", " ")).strip()
+    return text[:SEARCH_MAX_TEXT_CHARS]
+
+async def extract_text_in_pool(filename: str, data: bytes) -> str:
+    """Runs `extract_text` in the extraction process pool."""
+    global _pool
+    if _pool is None:
+        # Worker processes are spawned, forking a process with running threads isn't safe
+        _pool = ProcessPoolExecutor(SEARCH_EXTRACTION_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    return await asyncio.get_running_loop().run_in_executor(_pool, extract_text, filename, data)
+
+def shutdown_extraction_pool() -> None:
+    """Stops worker processes of the extraction pool, it's started again when needed."""
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
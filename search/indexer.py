@@ -0,0 +1,113 @@
+from dotenv import load_dotenv
+import argparse
+import asyncio
+import logging
+import os
+
+from botocore.exceptions import ClientError
+
+from db.aio import get_async_db, select_document, select_document_text_etag, select_documents_without_text, upsert_document_text, shutdown_executors
+from db.db import open_pool, close_pool
+from search.extract import ExtractionError, extract_text_in_pool
+from storage.s3 import BUCKET_NAME, get_s3_client
+from tasks.queue import job_handler, enqueue_job, job_worker
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SEARCH_ENABLED = os.getenv("SEARCH_ENABLED", "true").lower() == "true"
+# Postgres text search configuration, changing it requires extracting all texts again
+SEARCH_CONFIG = os.getenv("SEARCH_CONFIG", "simple")
+SEARCH_MAX_DOCUMENT_BYTES = int(os.getenv("SEARCH_MAX_DOCUMENT_BYTES", 50 * 1024 * 1024))
+
+EXTRACT_DOCUMENT_TEXT = "extract_document_text"
+
+
+async def queue_text_extraction(conn, project_id: int, name: str, etag: str) -> int | None:
+    """Queues extraction of a document version's text in the caller's transaction.
+
+    Returns:
+        int: ID of the job, None when search is disabled.
+    """
+    if not SEARCH_ENABLED:
+        return None
+    return await enqueue_job(conn, EXTRACT_DOCUMENT_TEXT, {"project_id": int(project_id), "name": name, "etag": etag})
+
+@job_handler(EXTRACT_DOCUMENT_TEXT)
+async def extract_document_text(payload: dict) -> dict:
+    """Downloads a document version, extracts its text in the process pool and indexes it.
+
+    Versions that were replaced or removed meanwhile, or whose text is
+    already indexed, are skipped. Documents over `SEARCH_MAX_DOCUMENT_BYTES`
+    and ones that can't be parsed are searchable by name only.
+    """
+    project_id, name, etag = payload["project_id"], payload["name"], payload["etag"]
+    async with get_async_db() as conn:
+        document = await select_document(conn, project_id, name)
+        indexed_etag = await select_document_text_etag(conn, project_id, name)
+    if document is None or document["etag"] != etag:
+        return {"skipped": "document changed"}
+    if indexed_etag == etag:
+        return {"skipped": "already indexed"}
+
+    text = ""
+    result = {}
+    if document["size"] <= SEARCH_MAX_DOCUMENT_BYTES:
+        s3 = await get_s3_client()
+        try:
+            response = await s3.get_object(Bucket=BUCKET_NAME, Key=document["key"], IfMatch=etag)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404", "PreconditionFailed"):
+                return {"skipped": "object changed"}
+            raise
+        stream = response["Body"]
+        try:
+            data = await stream.read()
+        finally:
+            stream.close()
+
+        try:
+            text = await extract_text_in_pool(name, data)
+        except ExtractionError as e:
+            logger.warning("Failed to extract text of %s in project %s: %s", name, project_id, e)
+            result["error"] = str(e)
+    else:
+        result["error"] = "document too large"
+
+    async with get_async_db() as conn:
+        indexed = await upsert_document_text(conn, project_id, name, etag, text, SEARCH_CONFIG)
+    return {**result, "indexed": indexed, "characters": len(text)}
+
+async def queue_missing_texts(batch_size: int = 1000) -> int:
+    """Queues extraction of every document whose current version has no indexed text.
+
+    Returns:
+        int: Number of queued jobs.
+    """
+    async with get_async_db() as conn:
+        documents = await select_documents_without_text(conn)
+    queued = 0
+    for start in range(0, len(documents), batch_size):
+        async with get_async_db() as conn:
+            for document in documents[start:start + batch_size]:
+                if await queue_text_extraction(conn, document["project_id"], document["name"], document["etag"]) is not None:
+                    queued += 1
+        job_worker.wake()
+    return queued
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Queues text extraction of documents that aren't searchable yet")
+    parser.parse_args(argv)
+
+    open_pool()
+    try:
+        queued = asyncio.run(queue_missing_texts())
+    finally:
+        shutdown_executors()
+        close_pool()
+    print(f"Queued text extraction of {queued} documents")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+-- Remove duplicated memberships, keeping the strongest permission ('owner' sorts before 'participant')
+DELETE FROM user_project a
+USING user_project b
+WHERE a.user_id = b.user_id
+	AND a.project_id = b.project_id
+	AND (a.permission > b.permission OR (a.permission = b.permission AND a.ctid > b.ctid));
+
+-- One membership per user and project, also serves `check_permission` and listing of user's projects
+DO $$
+BEGIN
+	IF NOT EXISTS (
+		SELECT 1 FROM pg_constraint
+		WHERE conrelid = 'user_project'::regclass AND contype = 'p'
+	) THEN
+		ALTER TABLE user_project ADD PRIMARY KEY (user_id, project_id);
+	END IF;
+END
+$$;
+
+-- Lookups by project, used by cascade deletes from projects
+CREATE INDEX IF NOT EXISTS user_project_project_id_idx ON user_project (project_id);
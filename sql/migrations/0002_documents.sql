@@ -0,0 +1,12 @@
+-- Index of documents stored in S3, so listings don't need S3 ListObjects
+CREATE TABLE IF NOT EXISTS documents (
+	project_id INT NOT NULL REFERENCES projects(project_id) ON DELETE CASCADE,
+	name TEXT NOT NULL,
+	key TEXT NOT NULL,
+	size BIGINT NOT NULL,
+	content_type TEXT,
+	etag TEXT NOT NULL,
+	created_at TIMESTAMP NOT NULL DEFAULT now(),
+	modified_at TIMESTAMP NOT NULL DEFAULT now(),
+	PRIMARY KEY (project_id, name)
+);
@@ -0,0 +1,42 @@
+-- Content addressed storage: one S3 object per distinct content, shared by documents with a reference count
+CREATE TABLE IF NOT EXISTS blobs (
+	digest TEXT PRIMARY KEY,
+	key TEXT NOT NULL,
+	size BIGINT NOT NULL,
+	etag TEXT NOT NULL,
+	ref_count INT NOT NULL DEFAULT 0,
+	created_at TIMESTAMP NOT NULL DEFAULT now(),
+	unreferenced_at TIMESTAMP
+);
+
+-- SHA-256 of the content of a deduplicated document, NULL for documents stored under their own key
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS digest TEXT REFERENCES blobs(digest);
+CREATE INDEX IF NOT EXISTS documents_digest_idx ON documents (digest);
+
+-- Garbage collection looks for blobs nothing references
+CREATE INDEX IF NOT EXISTS blobs_unreferenced_idx ON blobs (unreferenced_at) WHERE ref_count = 0;
+
+CREATE OR REPLACE FUNCTION documents_blob_ref_count() RETURNS trigger AS $$
+BEGIN
+	IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.digest IS NOT NULL
+		AND (TG_OP = 'DELETE' OR OLD.digest IS DISTINCT FROM NEW.digest) THEN
+		UPDATE blobs
+		SET ref_count = ref_count - 1,
+			unreferenced_at = CASE WHEN ref_count = 1 THEN now() END
+		WHERE digest = OLD.digest;
+	END IF;
+	IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.digest IS NOT NULL
+		AND (TG_OP = 'INSERT' OR OLD.digest IS DISTINCT FROM NEW.digest) THEN
+		UPDATE blobs
+		SET ref_count = ref_count + 1,
+			unreferenced_at = NULL
+		WHERE digest = NEW.digest;
+	END IF;
+	RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS documents_blob_ref_count ON documents;
+CREATE TRIGGER documents_blob_ref_count
+AFTER INSERT OR UPDATE OF digest OR DELETE ON documents
+FOR EACH ROW EXECUTE FUNCTION documents_blob_ref_count();
@@ -0,0 +1,20 @@
+-- Queue of background jobs, processed by workers started with the application
+CREATE TABLE IF NOT EXISTS jobs (
+	job_id BIGSERIAL PRIMARY KEY,
+	kind TEXT NOT NULL,
+	payload JSONB NOT NULL DEFAULT '{}',
+	status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'succeeded', 'failed')),
+	attempts INT NOT NULL DEFAULT 0,
+	max_attempts INT NOT NULL DEFAULT 5,
+	run_at TIMESTAMP NOT NULL DEFAULT now(),
+	locked_until TIMESTAMP,
+	last_error TEXT,
+	result JSONB,
+	created_by VARCHAR(40),
+	created_at TIMESTAMP NOT NULL DEFAULT now(),
+	updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+-- Workers claim due queued jobs and running jobs whose worker stopped renewing the lease
+CREATE INDEX IF NOT EXISTS jobs_queued_idx ON jobs (run_at) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS jobs_running_idx ON jobs (locked_until) WHERE status = 'running';
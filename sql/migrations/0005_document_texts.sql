@@ -0,0 +1,14 @@
+-- Searchable text of indexed documents, extracted by background jobs
+CREATE TABLE IF NOT EXISTS document_texts (
+	project_id INT NOT NULL,
+	name TEXT NOT NULL,
+	-- ETag of the document version the text was extracted from
+	etag TEXT NOT NULL,
+	search TSVECTOR NOT NULL,
+	characters INT NOT NULL DEFAULT 0,
+	extracted_at TIMESTAMP NOT NULL DEFAULT now(),
+	PRIMARY KEY (project_id, name),
+	FOREIGN KEY (project_id, name) REFERENCES documents (project_id, name) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS document_texts_search_idx ON document_texts USING GIN (search);
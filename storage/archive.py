@@ -0,0 +1,107 @@
+from dotenv import load_dotenv
+import asyncio
+import logging
+import os
+import zipfile
+
+from botocore.exceptions import ClientError
+
+from storage.s3 import BUCKET_NAME
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_CHUNK_SIZE = int(os.getenv("ARCHIVE_CHUNK_SIZE", 1024 * 1024))
+ARCHIVE_PREFETCH = max(int(os.getenv("ARCHIVE_PREFETCH", 4)), 1)
+# Chunks of one object buffered ahead of the archive writer
+PREFETCH_QUEUE_SIZE = 2
+
+
+class _ArchiveOutput:
+    """Write-only file object collecting what `zipfile` writes until it's drained."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def archive_name(name: str) -> str:
+    """Turns a document name into a safe relative path inside an archive."""
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+    return "/".join(parts) or "document"
+
+async def _prefetch(s3, key: str, queue: asyncio.Queue) -> None:
+    try:
+        response = await s3.get_object(Bucket=BUCKET_NAME, Key=key)
+        stream = response["Body"]
+        try:
+            async for chunk in stream.iter_chunks(ARCHIVE_CHUNK_SIZE):
+                await queue.put(chunk)
+        finally:
+            stream.close()
+        await queue.put(None)
+    except Exception as e:
+        await queue.put(e)
+
+async def stream_zip(s3, documents: list[dict], prefetch: int | None = None):
+    """Yields a ZIP archive of documents, built while their objects are read from S3.
+
+    Up to `prefetch` objects are downloaded ahead of the one being written,
+    each buffering at most a couple of chunks, so memory stays bounded by
+    the chunk size however large the documents are. Entries are stored
+    uncompressed with data descriptors and ZIP64 where needed, so nothing
+    has to be known before the bytes pass through. Documents whose object is
+    gone are skipped.
+
+    Args:
+        s3 (S3.Client): aiobotocore S3 client.
+        documents (list): Index rows with `name`, `key`, `size` and `modified_at`.
+        prefetch (int, optional): Objects downloaded at once. Defaults to `ARCHIVE_PREFETCH`.
+
+    Yields:
+        bytes: Consecutive parts of the archive.
+    """
+    slots = asyncio.Semaphore(prefetch or ARCHIVE_PREFETCH)
+    queues = [asyncio.Queue(PREFETCH_QUEUE_SIZE) for _ in documents]
+
+    async def fetch(document: dict, queue: asyncio.Queue) -> None:
+        async with slots:
+            await _prefetch(s3, document["key"], queue)
+
+    tasks = [asyncio.create_task(fetch(document, queue)) for document, queue in zip(documents, queues)]
+    output = _ArchiveOutput()
+    try:
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for document, queue in zip(documents, queues):
+                chunk = await queue.get()
+                if isinstance(chunk, ClientError) and chunk.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                    logger.warning("Skipping %s in archive, its object %s is missing", document["name"], document["key"])
+                    continue
+
+                info = zipfile.ZipInfo(archive_name(document["name"]), document["modified_at"].timetuple()[:6])
+                info.file_size = document["size"]
+                with archive.open(info, "w", force_zip64=document["size"] > zipfile.ZIP64_LIMIT) as entry:
+                    while chunk is not None:
+                        if isinstance(chunk, Exception):
+                            raise chunk
+                        entry.write(chunk)
+                        if data := output.drain():
+                            yield data
+                        chunk = await queue.get()
+        # Data descriptors of the last entry and the central directory
+        yield output.drain()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
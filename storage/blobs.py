@@ -0,0 +1,93 @@
+from dotenv import load_dotenv
+import asyncio
+import hashlib
+import logging
+import os
+
+from db.aio import get_async_db, lock_blob, insert_blob, select_document, upsert_document
+from storage.multipart import upload_stream
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# `direct` stores every document under `{project_id}/{name}`, `dedup` stores each distinct content once
+DOCUMENT_STORAGE_MODE = os.getenv("DOCUMENT_STORAGE_MODE", "direct").lower()
+DEDUP_ENABLED = DOCUMENT_STORAGE_MODE == "dedup"
+
+BLOBS_PREFIX = "_blobs/"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def blob_key(digest: str) -> str:
+    return f"{BLOBS_PREFIX}{digest}"
+
+async def hash_upload(file) -> str:
+    """Computes SHA-256 of an uploaded file and rewinds it.
+
+    Starlette spools uploads to a temporary file, so the content is hashed
+    before anything is sent to S3. Hashing runs in a thread, `hashlib`
+    releases the GIL for large chunks.
+
+    Returns:
+        str: Hex digest of the file.
+    """
+    digest = hashlib.sha256()
+    await file.seek(0)
+    while chunk := await file.read(HASH_CHUNK_SIZE):
+        await asyncio.to_thread(digest.update, chunk)
+    await file.seek(0)
+    return digest.hexdigest()
+
+async def store_deduplicated(s3, bucket: str, project_id: int, name: str, file, content_type: str | None) -> dict:
+    """Stores a document as a reference to a blob, uploading the content only if no blob has it yet.
+
+    A re-upload of unchanged content doesn't touch S3 or the index. Content
+    already stored for another document only adds a reference. A document that
+    was stored under its own key before has that object removed.
+
+    Args:
+        s3 (S3.Client): aiobotocore S3 client.
+        bucket (str): Name of the bucket.
+        project_id (int): ID of a project the document belongs to.
+        name (str): Name of the document within the project.
+        file (UploadFile): Uploaded content.
+        content_type (str, optional): Content type of the document.
+
+    Returns:
+        dict: `key`, `size`, `etag` and `digest` of the stored content, `stored` tells if it was uploaded
+            and `changed` if the document's etag differs from the one it had before.
+    """
+    project_id = int(project_id)
+    digest = await hash_upload(file)
+
+    async with get_async_db() as conn:
+        current = await select_document(conn, project_id, name)
+        if current is not None and current["digest"] == digest:
+            return {"key": current["key"], "size": current["size"], "etag": current["etag"], "digest": digest, "stored": False, "changed": False}
+
+        previous_etag = current["etag"] if current is not None else None
+        replaced_key = current["key"] if current is not None and current["digest"] is None else None
+        blob = await lock_blob(conn, digest)
+        if blob is not None:
+            await upsert_document(conn, project_id, name, blob["key"], blob["size"], content_type, blob["etag"], digest)
+
+    stored = blob is None
+    if stored:
+        uploaded = await upload_stream(s3, bucket, blob_key(digest), file, content_type)
+        async with get_async_db() as conn:
+            await insert_blob(conn, digest, uploaded["key"], uploaded["size"], uploaded["etag"])
+            # A concurrent upload of the same content may have recorded the blob first
+            blob = await lock_blob(conn, digest)
+            await upsert_document(conn, project_id, name, blob["key"], blob["size"], content_type, blob["etag"], digest)
+
+    if replaced_key is not None:
+        try:
+            await s3.delete_object(Bucket=bucket, Key=replaced_key)
+        except Exception:
+            logger.exception("Failed to remove %s replaced by blob %s", replaced_key, digest)
+
+    return {
+        "key": blob["key"], "size": blob["size"], "etag": blob["etag"], "digest": digest,
+        "stored": stored, "changed": blob["etag"] != previous_etag,
+    }
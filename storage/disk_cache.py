@@ -0,0 +1,229 @@
+from dotenv import load_dotenv
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TEMP_PREFIX = ".tmp-"
+
+
+class CacheWriter:
+    """Fills one cache entry through a temporary file, renamed into place only when complete.
+
+    Args:
+        cache (DiskCache): Cache the entry is added to.
+        key (str): Object key.
+        etag (str): ETag of the object version being written.
+        last_modified (datetime, optional): Set as the file's mtime, so `Last-Modified` of a hit matches S3.
+    """
+
+    def __init__(self, cache: "DiskCache", key: str, etag: str, last_modified: datetime | None = None):
+        self.cache = cache
+        self.key = key
+        self.etag = etag
+        self.last_modified = last_modified
+        self.size = 0
+        self._file = tempfile.NamedTemporaryFile(dir=cache.path, prefix=TEMP_PREFIX, delete=False)
+
+    def write(self, chunk: bytes) -> None:
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self) -> None:
+        self._file.close()
+        if self.size > self.cache.max_bytes:
+            self.abort()
+            return
+        if self.last_modified is not None:
+            timestamp = self.last_modified.timestamp()
+            os.utime(self._file.name, (timestamp, timestamp))
+        self.cache._add(self.key, self.etag, Path(self._file.name), self.size)
+
+    def abort(self) -> None:
+        self._file.close()
+        Path(self._file.name).unlink(missing_ok=True)
+
+
+class DiskCache:
+    """Size capped LRU cache of S3 objects on a local disk, keyed by object key and ETag.
+
+    A lookup passes the ETag the caller expects, so a changed object is never
+    served from disk even if this process missed its invalidation. Files live
+    in a subdirectory per process, because the index of entries is kept in memory.
+
+    Args:
+        directory (str, optional): Directory for cached files, None disables the cache.
+        max_bytes (int): Maximum total size of cached files.
+    """
+
+    def __init__(self, directory: str | None, max_bytes: int = 1024 ** 3):
+        self.directory = Path(directory) if directory else None
+        self.max_bytes = max_bytes
+        self.path = None
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "bytes_saved": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def open(self) -> None:
+        """Creates the process' cache directory, removing ones left by processes that are gone."""
+        if self.directory is None or self.max_bytes <= 0 or self.enabled:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for child in self.directory.iterdir():
+            if child.is_dir() and child.name.isdigit() and not _process_exists(int(child.name)):
+                shutil.rmtree(child, ignore_errors=True)
+
+        path = self.directory / str(os.getpid())
+        shutil.rmtree(path, ignore_errors=True)
+        path.mkdir()
+        self.path = path
+
+    def close(self) -> None:
+        """Removes the process' cache directory."""
+        path, self.path = self.path, None
+        self.clear()
+        if path is not None:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def get(self, key: str, etag: str) -> Path | None:
+        """Returns path of the cached object if it's cached with the given ETag."""
+        return self._get(key, etag, lambda path: path)
+
+    def open_file(self, key: str, etag: str) -> BinaryIO | None:
+        """Opens the cached object if it's cached with the given ETag.
+
+        The file is opened under the lock evictions and invalidations take, so
+        it stays readable even when its entry is removed right after.
+        """
+        return self._get(key, etag, lambda path: open(path, "rb"))
+
+    def _get(self, key: str, etag: str, found):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == etag:
+                try:
+                    result = found(entry[1])
+                except OSError:
+                    # The file was removed behind the cache's back
+                    entry = None
+                    self._pop(key)
+                else:
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    self._counters["bytes_saved"] += entry[2]
+                    return result
+            self._counters["misses"] += 1
+            stale = self._pop(key) if entry is not None else None
+        _remove(stale)
+        return None
+
+    def writer(self, key: str, etag: str, last_modified: datetime | None = None) -> CacheWriter | None:
+        """Starts filling an entry, returns None when the cache is disabled."""
+        if not self.enabled:
+            return None
+        return CacheWriter(self, key, etag, last_modified)
+
+    def invalidate(self, key: str | None = None, prefix: str | None = None) -> None:
+        """Drops an entry by its key or all entries with keys starting with `prefix`."""
+        with self._lock:
+            if key is not None:
+                keys = [key] if key in self._entries else []
+            else:
+                keys = [k for k in self._entries if k.startswith(prefix or "")]
+            removed = [self._pop(k) for k in keys]
+            self._counters["invalidations"] += len(removed)
+        for path in removed:
+            _remove(path)
+
+    def clear(self) -> None:
+        with self._lock:
+            removed = [self._pop(key) for key in list(self._entries)]
+        for path in removed:
+            _remove(path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                "enabled": self.enabled,
+                "max_bytes": self.max_bytes,
+                "size_bytes": self._size,
+                "entries": len(self._entries),
+                "hit_ratio": self._counters["hits"] / lookups if lookups else 0.0,
+                **self._counters,
+            }
+
+    def _add(self, key: str, etag: str, temp_path: Path, size: int) -> None:
+        if not self.enabled:
+            temp_path.unlink(missing_ok=True)
+            return
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        path = self.path / f"{digest}-{hashlib.sha256(etag.encode()).hexdigest()[:16]}"
+        os.replace(temp_path, path)
+
+        removed = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous[2]
+                if previous[1] != path:
+                    removed.append(previous[1])
+            self._entries[key] = (etag, path, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                removed.append(self._pop(oldest))
+                self._counters["evictions"] += 1
+        for old_path in removed:
+            _remove(old_path)
+
+    def _pop(self, key: str) -> Path:
+        etag, path, size = self._entries.pop(key)
+        self._size -= size
+        return path
+
+
+def _remove(path: Path | None) -> None:
+    if path is not None:
+        try:
+            path.unlink(missing_ok=True)
+        except OSError:
+            logger.warning("Failed to remove cached file %s", path)
+
+def _process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+document_cache = DiskCache(
+    directory=os.getenv("DOCUMENT_CACHE_DIR"),
+    max_bytes=int(os.getenv("DOCUMENT_CACHE_MAX_BYTES", 1024 ** 3)),
+)
@@ -0,0 +1,212 @@
+from dotenv import load_dotenv
+import argparse
+import asyncio
+import os
+
+from db.aio import get_async_db, delete_unreferenced_blobs, select_dedup_stats, select_existing_project_ids, shutdown_executors
+from db.db import open_pool, close_pool
+from storage.s3 import BUCKET_NAME, open_s3_client, close_s3_client
+
+load_dotenv()
+
+BLOB_GC_GRACE_SECONDS = float(os.getenv("BLOB_GC_GRACE_SECONDS", 3600))
+# The most keys one `delete_objects` call accepts
+DELETE_BATCH_SIZE = 1000
+
+
+class RateLimiter:
+    """Spaces awaited calls so that at most `rate` of them start per second.
+
+    Args:
+        rate (float, optional): Calls per second, None or 0 disables the limit.
+    """
+
+    def __init__(self, rate: float | None = None):
+        self.interval = 1 / rate if rate else 0.0
+        self._next = 0.0
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        if self._next > now:
+            await asyncio.sleep(self._next - now)
+            now = self._next
+        self._next = now + self.interval
+
+
+async def collect_blobs(s3, grace_seconds: float | None = None, batch_size: int = DELETE_BATCH_SIZE) -> dict:
+    """Removes blobs no document has referenced for at least `grace_seconds`.
+
+    Each batch deletes blob records and their S3 objects in one transaction,
+    committed only after S3 confirmed the deletes. The grace period lets
+    downloads that already resolved a blob's key finish.
+
+    Args:
+        s3 (S3.Client): aiobotocore S3 client.
+        grace_seconds (float, optional): Defaults to `BLOB_GC_GRACE_SECONDS`.
+        batch_size (int): Blobs removed per transaction, at most 1000.
+
+    Returns:
+        dict: Numbers of `blobs_removed` and `bytes_freed`.
+
+    Raises:
+        RuntimeError: If S3 failed to delete some objects, their batch is kept.
+    """
+    grace_seconds = BLOB_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    result = {"blobs_removed": 0, "bytes_freed": 0}
+    while True:
+        async with get_async_db() as conn:
+            blobs = await delete_unreferenced_blobs(conn, grace_seconds, batch_size)
+            if blobs:
+                response = await s3.delete_objects(
+                    Bucket=BUCKET_NAME,
+                    Delete={"Objects": [{"Key": blob["key"]} for blob in blobs], "Quiet": True},
+                )
+                if response.get("Errors"):
+                    raise RuntimeError(f"Failed to delete blobs: {response['Errors']}")
+
+        result["blobs_removed"] += len(blobs)
+        result["bytes_freed"] += sum(blob["size"] for blob in blobs)
+        if len(blobs) < batch_size:
+            return result
+
+async def iter_project_prefixes(s3, limiter: RateLimiter):
+    """Yields project IDs of the bucket's top level `{project_id}/` prefixes, one listing page at a time.
+
+    Other top level prefixes, like deduplicated blobs, are skipped.
+    """
+    arguments = {"Bucket": BUCKET_NAME, "Delimiter": "/"}
+    while True:
+        await limiter.wait()
+        page = await s3.list_objects_v2(**arguments)
+        for common_prefix in page.get("CommonPrefixes", []):
+            name = common_prefix["Prefix"][:-1]
+            if name.isdigit():
+                yield int(name)
+        if not page.get("IsTruncated"):
+            return
+        arguments["ContinuationToken"] = page["NextContinuationToken"]
+
+async def delete_prefix(s3, prefix: str, limiter: RateLimiter, dry_run: bool = False) -> tuple[int, int]:
+    """Deletes objects under a prefix with batched multi-object deletes, rate limiting every S3 call.
+
+    Returns:
+        tuple: Number and total size of deleted objects, or of objects that would be deleted in a dry run.
+    """
+    arguments = {"Bucket": BUCKET_NAME, "Prefix": prefix}
+    count = size = 0
+    while True:
+        await limiter.wait()
+        page = await s3.list_objects_v2(**arguments)
+        objects = page.get("Contents", [])
+        if objects and not dry_run:
+            await limiter.wait()
+            response = await s3.delete_objects(
+                Bucket=BUCKET_NAME,
+                Delete={"Objects": [{"Key": obj["Key"]} for obj in objects], "Quiet": True},
+            )
+            if response.get("Errors"):
+                raise RuntimeError(f"Failed to delete {len(response['Errors'])} objects under {prefix}: {response['Errors'][0]}")
+        count += len(objects)
+        size += sum(obj["Size"] for obj in objects)
+        if not page.get("IsTruncated"):
+            return count, size
+        arguments["ContinuationToken"] = page["NextContinuationToken"]
+
+async def collect_orphaned_prefixes(s3, dry_run: bool = False, rate: float | None = None,
+                                    batch_size: int = DELETE_BATCH_SIZE, progress=None) -> dict:
+    """Removes `{project_id}/` prefixes of projects that no longer exist.
+
+    Prefixes are streamed from the bucket listing and checked against
+    `projects` in batches, so memory use doesn't grow with the bucket.
+
+    Args:
+        s3 (S3.Client): aiobotocore S3 client.
+        dry_run (bool): Only count what would be deleted.
+        rate (float, optional): Maximum S3 requests per second.
+        batch_size (int): Prefixes checked with one query.
+        progress (callable, optional): Called with the running totals after every batch and orphaned prefix.
+
+    Returns:
+        dict: `prefixes_scanned`, `orphaned_prefixes`, `objects_deleted` and `bytes_deleted`.
+    """
+    limiter = RateLimiter(rate)
+    result = {"prefixes_scanned": 0, "orphaned_prefixes": 0, "objects_deleted": 0, "bytes_deleted": 0}
+
+    async def process(batch: list[int]) -> None:
+        async with get_async_db() as conn:
+            existing = await select_existing_project_ids(conn, batch)
+        result["prefixes_scanned"] += len(batch)
+        for project_id in batch:
+            if project_id in existing:
+                continue
+            count, size = await delete_prefix(s3, f"{project_id}/", limiter, dry_run)
+            result["orphaned_prefixes"] += 1
+            result["objects_deleted"] += count
+            result["bytes_deleted"] += size
+            if progress is not None:
+                progress(dict(result, prefix=f"{project_id}/"))
+        if progress is not None:
+            progress(dict(result))
+
+    batch = []
+    async for project_id in iter_project_prefixes(s3, limiter):
+        batch.append(project_id)
+        if len(batch) >= batch_size:
+            await process(batch)
+            batch = []
+    if batch:
+        await process(batch)
+    return result
+
+def _print_progress(dry_run: bool):
+    verb = "would delete" if dry_run else "deleted"
+
+    def report(totals: dict) -> None:
+        if "prefix" in totals:
+            print(f"  {totals['prefix']} orphaned")
+        else:
+            print(f"Scanned {totals['prefixes_scanned']} prefixes, {totals['orphaned_prefixes']} orphaned, "
+                  f"{verb} {totals['objects_deleted']} objects ({totals['bytes_deleted']} bytes)")
+    return report
+
+async def _run(args) -> dict:
+    open_pool()
+    try:
+        s3 = await open_s3_client()
+        if args.command == "orphans":
+            return await collect_orphaned_prefixes(s3, args.dry_run, args.rate, args.batch_size, _print_progress(args.dry_run))
+
+        result = await collect_blobs(s3, args.grace_seconds)
+        async with get_async_db() as conn:
+            result["dedup"] = await select_dedup_stats(conn)
+        return result
+    finally:
+        await close_s3_client()
+        shutdown_executors()
+        close_pool()
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Removes unused objects from the documents bucket")
+    commands = parser.add_subparsers(dest="command", required=True)
+    blobs = commands.add_parser("blobs", help="remove deduplicated blobs no document references")
+    blobs.add_argument("--grace-seconds", type=float, default=None, help=f"how long a blob has to be unreferenced, defaults to {BLOB_GC_GRACE_SECONDS:g}")
+    orphans = commands.add_parser("orphans", help="remove prefixes of projects that no longer exist")
+    orphans.add_argument("--dry-run", action="store_true", help="only report what would be deleted")
+    orphans.add_argument("--rate", type=float, default=None, help="maximum S3 requests per second")
+    orphans.add_argument("--batch-size", type=int, default=DELETE_BATCH_SIZE, help="prefixes checked against the database at once")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(_run(args))
+    if args.command == "orphans":
+        return
+
+    dedup = result["dedup"]
+    print(f"Removed {result['blobs_removed']} blobs, freed {result['bytes_freed']} bytes")
+    print(f"{dedup['documents']} deduplicated documents ({dedup['logical_bytes']} bytes) stored in "
+          f"{dedup['blobs']} blobs ({dedup['stored_bytes']} bytes), dedup ratio {dedup['dedup_ratio']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+from dotenv import load_dotenv
+import asyncio
+import logging
+import math
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# S3 limits: every part but the last one has at least 5 MiB, at most 10000 parts per upload
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10_000
+
+S3_MULTIPART_PART_SIZE = max(int(os.getenv("S3_MULTIPART_PART_SIZE", 8 * 1024 * 1024)), MIN_PART_SIZE)
+S3_MULTIPART_CONCURRENCY = max(int(os.getenv("S3_MULTIPART_CONCURRENCY", 4)), 1)
+
+
+async def upload_stream(s3, bucket: str, key: str, file, content_type: str | None = None, part_size: int = None, concurrency: int = None) -> dict:
+    """Streams a file to S3 without holding it in memory.
+
+    Files smaller than one part are sent with a single `put_object`. Bigger
+    files are sent as a multipart upload, reading the next part only when one
+    of `concurrency` upload slots is free, so memory used by one upload stays
+    around `part_size * concurrency` whatever the file size. A failed or
+    cancelled upload is aborted, so no parts are left behind in the bucket.
+
+    Args:
+        s3 (S3.Client): aiobotocore S3 client.
+        bucket (str): Name of the bucket.
+        key (str): Key of the uploaded object.
+        file (UploadFile): Source with an awaitable `read(size)`.
+        content_type (str, optional): Content type stored with the object.
+        part_size (int, optional): Bytes per part. Defaults to `S3_MULTIPART_PART_SIZE`.
+        concurrency (int, optional): Parts uploaded at once. Defaults to `S3_MULTIPART_CONCURRENCY`.
+
+    Returns:
+        dict: `key`, `size` and `etag` of the uploaded object.
+    """
+    part_size = part_size or S3_MULTIPART_PART_SIZE
+    concurrency = concurrency or S3_MULTIPART_CONCURRENCY
+    extra_args = {"ContentType": content_type} if content_type else {}
+
+    file_size = getattr(file, "size", None)
+    if file_size and math.ceil(file_size / part_size) > MAX_PARTS:
+        part_size = math.ceil(file_size / MAX_PARTS)
+
+    slots = asyncio.Semaphore(concurrency)
+    await slots.acquire()
+    chunk = await file.read(part_size)
+    if len(chunk) < part_size:
+        slots.release()
+        response = await s3.put_object(Bucket=bucket, Key=key, Body=chunk, **extra_args)
+        return {"key": key, "size": len(chunk), "etag": response["ETag"]}
+
+    upload_id = (await s3.create_multipart_upload(Bucket=bucket, Key=key, **extra_args))["UploadId"]
+    tasks = []
+    errors = []
+    size = 0
+
+    async def upload_part(part_number: int, body: bytes) -> dict:
+        try:
+            response = await s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=body)
+            return {"PartNumber": part_number, "ETag": response["ETag"]}
+        except Exception as e:
+            errors.append(e)
+            raise
+        finally:
+            slots.release()
+
+    try:
+        part_number = 1
+        while chunk:
+            size += len(chunk)
+            tasks.append(asyncio.create_task(upload_part(part_number, chunk)))
+            chunk = None
+
+            await slots.acquire()
+            if errors:
+                raise errors[0]
+            chunk = await file.read(part_size)
+            part_number += 1
+        slots.release()
+
+        parts = await asyncio.gather(*tasks)
+        response = await s3.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            await s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        except Exception:
+            logger.exception("Failed to abort multipart upload %s of %s", upload_id, key)
+        raise
+
+    return {"key": key, "size": size, "etag": response["ETag"]}
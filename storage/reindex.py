@@ -0,0 +1,92 @@
+import argparse
+import asyncio
+
+from db.aio import get_async_db, select_documents, select_project_ids, upsert_document, delete_document, shutdown_executors
+from db.db import open_pool, close_pool
+from storage.s3 import BUCKET_NAME, open_s3_client, close_s3_client
+
+
+async def reconcile_project(s3, conn, project_id: int) -> dict:
+    """Brings the documents index of a project in line with the objects under its S3 prefix.
+
+    Objects missing from the index or with a different ETag or size are
+    upserted, `head_object` is called only for them because listings don't
+    carry the content type. Index rows without an object are removed.
+    Deduplicated documents don't live under the prefix and are left as they are.
+
+    Args:
+        s3 (S3.Client): aiobotocore S3 client.
+        conn (psycopg2.connect): Connection to database.
+        project_id (int): ID of the reconciled project.
+
+    Returns:
+        dict: Numbers of `added`, `updated`, `removed` and `unchanged` documents.
+    """
+    prefix = f"{project_id}/"
+    documents = await select_documents(conn, project_id)
+    indexed = {row["name"]: row for row in documents if row["digest"] is None}
+    deduplicated = {row["name"] for row in documents if row["digest"] is not None}
+    counts = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+    seen = set()
+
+    paginator = s3.get_paginator("list_objects_v2")
+    async for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            name = obj["Key"][len(prefix):]
+            if name in deduplicated:
+                continue
+            seen.add(name)
+            row = indexed.get(name)
+            if row is not None and row["etag"] == obj["ETag"] and row["size"] == obj["Size"]:
+                counts["unchanged"] += 1
+                continue
+
+            head = await s3.head_object(Bucket=BUCKET_NAME, Key=obj["Key"])
+            await upsert_document(conn, project_id, name, obj["Key"], obj["Size"], head.get("ContentType"), obj["ETag"])
+            counts["updated" if row is not None else "added"] += 1
+
+    for name in indexed.keys() - seen:
+        await delete_document(conn, project_id, name)
+        counts["removed"] += 1
+    return counts
+
+async def reindex(project_ids: list[int] | None = None) -> dict:
+    """Reconciles the documents index of the given or all projects, one transaction per project.
+
+    Returns:
+        dict: Counts returned by `reconcile_project` for every project ID.
+    """
+    s3 = await open_s3_client()
+    if not project_ids:
+        async with get_async_db() as conn:
+            project_ids = await select_project_ids(conn)
+
+    results = {}
+    for project_id in project_ids:
+        async with get_async_db() as conn:
+            results[project_id] = await reconcile_project(s3, conn, project_id)
+    return results
+
+async def _run(project_ids: list[int] | None) -> dict:
+    open_pool()
+    try:
+        return await reindex(project_ids)
+    finally:
+        await close_s3_client()
+        shutdown_executors()
+        close_pool()
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Rebuilds the documents index from objects stored in S3")
+    parser.add_argument("--project", type=int, action="append", dest="projects", help="project to reconcile, can be repeated, defaults to all projects")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(_run(args.projects))
+    for project_id, counts in results.items():
+        print(f"Project {project_id}: " + ", ".join(f"{value} {name}" for name, value in counts.items()))
+    if not results:
+        print("No projects to reindex")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+from dotenv import load_dotenv
+import os
+
+import aioboto3
+from aiobotocore.config import AioConfig
+
+from observability.metrics import instrument_s3_client
+
+load_dotenv()
+
+BUCKET_NAME = os.getenv("BUCKET_NAME")
+
+S3_CONFIG = AioConfig(
+    max_pool_connections=int(os.getenv("S3_MAX_POOL_CONNECTIONS", 50)),
+    tcp_keepalive=os.getenv("S3_TCP_KEEPALIVE", "true").lower() == "true",
+    connector_args={"keepalive_timeout": float(os.getenv("S3_KEEPALIVE_TIMEOUT_SECONDS", 30))},
+)
+# Lets the application talk to an S3 compatible service, e.g. a local stand-in
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+
+session = aioboto3.Session()
+
+_client = None
+_client_context = None
+
+
+async def open_s3_client():
+    """Creates the shared S3 client, used on application startup.
+
+    The client owns a pool of keep-alive HTTP connections reused by every S3 call.
+
+    Returns:
+        S3.Client: aiobotocore S3 client.
+    """
+    global _client, _client_context
+    if _client is None:
+        context = session.client("s3", config=S3_CONFIG, endpoint_url=S3_ENDPOINT_URL)
+        client = await context.__aenter__()
+        if _client is not None:
+            # Another task opened the client in the meantime
+            await context.__aexit__(None, None, None)
+        else:
+            instrument_s3_client(client)
+            _client, _client_context = client, context
+    return _client
+
+async def close_s3_client() -> None:
+    """Closes the shared S3 client and its connections, used on application shutdown."""
+    global _client, _client_context
+    context, _client, _client_context = _client_context, None, None
+    if context is not None:
+        await context.__aexit__(None, None, None)
+
+async def get_s3_client():
+    """Returns the shared S3 client, opening it on first use."""
+    if _client is not None:
+        return _client
+    return await open_s3_client()
@@ -0,0 +1,11 @@
+from tasks.queue import job_handler
+from views.document import delete_s3_folder
+
+DELETE_PROJECT_OBJECTS = "delete_project_objects"
+
+
+@job_handler(DELETE_PROJECT_OBJECTS)
+async def delete_project_objects(payload: dict) -> dict:
+    """Removes S3 objects of a deleted project, safe to repeat."""
+    deleted = await delete_s3_folder(payload["project_id"])
+    return {"objects_deleted": deleted}
@@ -0,0 +1,148 @@
+from dotenv import load_dotenv
+import asyncio
+import logging
+import os
+import random
+
+from db.aio import get_async_db, insert_job, claim_job, extend_job_lease, complete_job, fail_job
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 1))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", 1))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 300))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+JOB_RETRY_BACKOFF_SECONDS = float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", 5))
+JOB_RETRY_BACKOFF_MAX_SECONDS = float(os.getenv("JOB_RETRY_BACKOFF_MAX_SECONDS", 600))
+
+JOB_HANDLERS = {}
+
+
+def job_handler(kind: str):
+    """Registers an async function `handler(payload: dict) -> dict | None` for jobs of a kind.
+
+    Handlers may run more than once for the same job, after a crash or a retry,
+    so they have to be idempotent.
+    """
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+async def enqueue_job(conn, kind: str, payload: dict, created_by: str | None = None) -> int:
+    """Adds a job in the caller's transaction, so it only runs if the transaction commits.
+
+    Workers can't see the job before the commit, the caller should call
+    `job_worker.wake()` after it rather than leave the job to the next poll.
+
+    Returns:
+        int: ID of the job.
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"No handler registered for job kind '{kind}'")
+    return await insert_job(conn, kind, payload, created_by, JOB_MAX_ATTEMPTS)
+
+def retry_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter, capped at `JOB_RETRY_BACKOFF_MAX_SECONDS`."""
+    ceiling = min(JOB_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1), JOB_RETRY_BACKOFF_MAX_SECONDS)
+    return random.uniform(ceiling / 2, ceiling)
+
+
+class JobWorker:
+    """Runs queued jobs in asyncio tasks of the current process.
+
+    Jobs are claimed from Postgres with `SKIP LOCKED`, so any number of
+    processes can run workers. A running job holds a lease renewed while its
+    handler runs; a job whose worker died is claimed again once it expires.
+
+    Args:
+        concurrency (int): Jobs run at once, 0 disables the worker.
+        poll_interval (float): Seconds between checks for due jobs when idle.
+        lease_seconds (float): Lease of a claimed job, renewed every third of it.
+    """
+
+    def __init__(self, concurrency: int = 1, poll_interval: float = 1.0, lease_seconds: float = 300.0):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._tasks = []
+        self._wakeup = None
+
+    def start(self) -> None:
+        if self._tasks or self.concurrency <= 0:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run(), name=f"job-worker-{i}") for i in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        """Cancels the workers, interrupted jobs are retried once their lease expires."""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def wake(self) -> None:
+        """Makes idle workers look for due jobs right away."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run_once(self) -> bool:
+        """Claims and runs one due job.
+
+        Returns:
+            bool: False if no job was due.
+        """
+        async with get_async_db() as conn:
+            job = await claim_job(conn, self.lease_seconds)
+        if job is None:
+            return False
+
+        job_id, attempt = job["job_id"], job["attempts"]
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, attempt))
+        try:
+            handler = JOB_HANDLERS[job["kind"]]
+            result = await handler(job["payload"])
+        except Exception as e:
+            retry_in = retry_delay(attempt) if attempt < job["max_attempts"] else None
+            logger.warning("Job %s (%s) attempt %s failed: %r", job_id, job["kind"], attempt, e)
+            async with get_async_db() as conn:
+                await fail_job(conn, job_id, attempt, repr(e), retry_in)
+        else:
+            async with get_async_db() as conn:
+                await complete_job(conn, job_id, attempt, result)
+        finally:
+            heartbeat.cancel()
+        return True
+
+    async def _heartbeat(self, job_id: int, attempt: int) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                async with get_async_db() as conn:
+                    if not await extend_job_lease(conn, job_id, attempt, self.lease_seconds):
+                        return
+            except Exception:
+                logger.exception("Failed to extend the lease of job %s", job_id)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await self.run_once():
+                    continue
+            except Exception:
+                logger.exception("Job worker failed to claim a job")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+job_worker = JobWorker(
+    concurrency=JOB_WORKERS,
+    poll_interval=JOB_POLL_INTERVAL_SECONDS,
+    lease_seconds=JOB_LEASE_SECONDS,
+)
@@ -1,7 +1,9 @@
 import pytest
 from fastapi.testclient import TestClient
 from main import app
-from db.db import get_db
+from db.db import get_db, permission_cache, close_pool
+from db.migrations import migrate
+from tests.fake_s3 import FakeS3Client
 
 import psycopg2
 from psycopg2.extras import RealDictCursor
@@ -36,8 +38,16 @@ for env_var, config_key in REQUIRED_ENV_VARIABLES.items():
         raise ValueError(f"Environment variable '{env_var}' is not set.")
     DB_CONFIG[config_key] = value
 
+@pytest.fixture(autouse=True, scope="session")
+def migrated_database():
+    conn = psycopg2.connect(**DB_CONFIG, cursor_factory=RealDictCursor)
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+
 @pytest.fixture(autouse=True, scope="function")
-def db_connection():
+def db_connection(migrated_database):
     conn = psycopg2.connect(**DB_CONFIG, cursor_factory=RealDictCursor)
     try:
         yield conn        
@@ -48,9 +58,12 @@ def db_connection():
                 cur.execute("DELETE FROM user_project;")
                 cur.execute("DELETE FROM users;")
                 cur.execute("DELETE FROM projects;")
+                cur.execute("DELETE FROM blobs;")
+                cur.execute("DELETE FROM jobs;")
         finally:
             cleanup_conn.close()
             conn.close()
+            permission_cache.clear()
 
 @pytest.fixture(scope="function")
 def client(db_connection):
@@ -59,4 +72,18 @@ def client(db_connection):
 
     app.dependency_overrides[get_db] = override_get_db
     yield TestClient(app)
-    app.dependency_overrides.clear()
\ No newline at end of file
+    app.dependency_overrides.clear()
+
+@pytest.fixture(scope="function")
+def fake_s3(mocker):
+    s3 = FakeS3Client()
+    mocker.patch("storage.s3._client", s3)
+    return s3
+
+@pytest.fixture(scope="function")
+def test_pool(mocker, db_connection):
+    """Points the shared connection pool, used by `db.aio` and request contexts, at the test database."""
+    close_pool()
+    mocker.patch.dict("db.db.DB_CONFIG", DB_CONFIG)
+    yield
+    close_pool()
@@ -0,0 +1,255 @@
+import hashlib
+import uuid
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+
+def client_error(code: str, status_code: int, operation: str) -> ClientError:
+    return ClientError(
+        {"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": status_code}},
+        operation,
+    )
+
+
+class FakeStreamingBody:
+    def __init__(self, data: bytes):
+        self._data = data
+        self._position = 0
+        self.closed = False
+
+    async def read(self, amt: int | None = None) -> bytes:
+        end = len(self._data) if amt is None else self._position + amt
+        chunk = self._data[self._position:end]
+        self._position += len(chunk)
+        return chunk
+
+    async def iter_chunks(self, chunk_size: int = 1024):
+        while True:
+            chunk = await self.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class FakePaginator:
+    def __init__(self, client, operation: str):
+        self.client = client
+        self.operation = operation
+
+    async def paginate(self, **kwargs):
+        token = None
+        while True:
+            if token is not None:
+                kwargs["ContinuationToken"] = token
+            page = await getattr(self.client, self.operation)(**kwargs)
+            yield page
+            token = page.get("NextContinuationToken")
+            if not page.get("IsTruncated"):
+                break
+
+
+class FakeS3Client:
+    """In memory stand-in for the subset of aiobotocore's S3 client used by the application.
+
+    Args:
+        page_size (int): Keys returned by one `list_objects_v2` call.
+    """
+
+    endpoint_url = "https://fake-s3.test"
+
+    def __init__(self, page_size: int = 1000):
+        self.page_size = page_size
+        self.objects = {}
+        self.multipart_uploads = {}
+        self.calls = []
+
+    def _record(self, operation: str, **kwargs) -> None:
+        self.calls.append((operation, kwargs))
+
+    def calls_of(self, operation: str) -> list[dict]:
+        return [kwargs for name, kwargs in self.calls if name == operation]
+
+    def get_paginator(self, operation: str) -> FakePaginator:
+        return FakePaginator(self, operation)
+
+    async def generate_presigned_url(self, ClientMethod: str, Params: dict, ExpiresIn: int = 3600, **kwargs) -> str:
+        self._record("generate_presigned_url", ClientMethod=ClientMethod, Params=Params, ExpiresIn=ExpiresIn)
+        return f"{self.endpoint_url}/{Params['Bucket']}/{Params['Key']}?X-Amz-Expires={ExpiresIn}&X-Amz-Signature=fake"
+
+    async def generate_presigned_post(self, Bucket: str, Key: str, Fields: dict | None = None,
+                                      Conditions: list | None = None, ExpiresIn: int = 3600, **kwargs) -> dict:
+        self._record("generate_presigned_post", Bucket=Bucket, Key=Key, Fields=Fields, Conditions=Conditions, ExpiresIn=ExpiresIn)
+        return {"url": f"{self.endpoint_url}/{Bucket}", "fields": {**(Fields or {}), "key": Key, "policy": "fake", "x-amz-signature": "fake"}}
+
+    async def put_object(self, Bucket: str, Key: str, Body=b"", ContentType: str = "binary/octet-stream", **kwargs) -> dict:
+        self._record("put_object", Bucket=Bucket, Key=Key, ContentType=ContentType, **kwargs)
+        data = Body if isinstance(Body, bytes) else Body.read()
+        return self.store(Bucket, Key, data, ContentType)
+
+    def store(self, bucket: str, key: str, data: bytes = b"", content_type: str = "binary/octet-stream", etag: str | None = None) -> dict:
+        etag = etag or f'"{hashlib.md5(data).hexdigest()}"'
+        self.objects[(bucket, key)] = {
+            "Body": data,
+            "ContentType": content_type,
+            "ETag": etag,
+            "LastModified": datetime.now(timezone.utc).replace(microsecond=0),
+        }
+        return {"ETag": etag}
+
+    def _get(self, bucket: str, key: str, operation: str) -> dict:
+        obj = self.objects.get((bucket, key))
+        if obj is None:
+            raise client_error("NoSuchKey" if operation == "GetObject" else "404", 404, operation)
+        return obj
+
+    async def head_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._record("head_object", Bucket=Bucket, Key=Key, **kwargs)
+        obj = self._get(Bucket, Key, "HeadObject")
+        return {
+            "ContentLength": len(obj["Body"]),
+            "ContentType": obj["ContentType"],
+            "ETag": obj["ETag"],
+            "LastModified": obj["LastModified"],
+        }
+
+    async def get_object(self, Bucket: str, Key: str, Range: str | None = None, IfMatch: str | None = None,
+                         IfNoneMatch: str | None = None, IfModifiedSince: datetime | None = None,
+                         IfUnmodifiedSince: datetime | None = None, **kwargs) -> dict:
+        self._record("get_object", Bucket=Bucket, Key=Key, Range=Range, IfMatch=IfMatch, IfNoneMatch=IfNoneMatch,
+                     IfModifiedSince=IfModifiedSince, IfUnmodifiedSince=IfUnmodifiedSince, **kwargs)
+        obj = self._get(Bucket, Key, "GetObject")
+        data = obj["Body"]
+
+        if IfMatch is not None and IfMatch != obj["ETag"]:
+            raise client_error("PreconditionFailed", 412, "GetObject")
+        if IfUnmodifiedSince is not None and obj["LastModified"] > IfUnmodifiedSince:
+            raise client_error("PreconditionFailed", 412, "GetObject")
+        if IfNoneMatch is not None and IfNoneMatch == obj["ETag"]:
+            raise client_error("304", 304, "GetObject")
+        if IfModifiedSince is not None and obj["LastModified"] <= IfModifiedSince:
+            raise client_error("304", 304, "GetObject")
+
+        response = {
+            "ContentType": obj["ContentType"],
+            "ETag": obj["ETag"],
+            "LastModified": obj["LastModified"],
+            "AcceptRanges": "bytes",
+            "ResponseMetadata": {"HTTPStatusCode": 200},
+        }
+        if Range is not None:
+            start, end = self._parse_range(Range, len(data))
+            response["ContentRange"] = f"bytes {start}-{end}/{len(data)}"
+            response["ResponseMetadata"]["HTTPStatusCode"] = 206
+            data = data[start:end + 1]
+
+        response["Body"] = FakeStreamingBody(data)
+        response["ContentLength"] = len(data)
+        return response
+
+    @staticmethod
+    def _parse_range(header: str, size: int) -> tuple[int, int]:
+        start, end = header.removeprefix("bytes=").split("-")
+        if start == "":
+            start, end = max(size - int(end), 0), size - 1
+        else:
+            start, end = int(start), min(int(end), size - 1) if end else size - 1
+        if start >= size or start > end:
+            raise client_error("InvalidRange", 416, "GetObject")
+        return start, end
+
+    async def delete_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._record("delete_object", Bucket=Bucket, Key=Key)
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+    async def delete_objects(self, Bucket: str, Delete: dict, **kwargs) -> dict:
+        self._record("delete_objects", Bucket=Bucket, Delete=Delete)
+        if len(Delete["Objects"]) > 1000:
+            raise client_error("MalformedXML", 400, "DeleteObjects")
+        for obj in Delete["Objects"]:
+            self.objects.pop((Bucket, obj["Key"]), None)
+        return {"Deleted": [{"Key": obj["Key"]} for obj in Delete["Objects"]]}
+
+    async def copy_object(self, Bucket: str, Key: str, CopySource: dict, **kwargs) -> dict:
+        self._record("copy_object", Bucket=Bucket, Key=Key, CopySource=CopySource)
+        source = self._get(CopySource["Bucket"], CopySource["Key"], "CopyObject")
+        etag = self.store(Bucket, Key, source["Body"], source["ContentType"], source["ETag"])["ETag"]
+        return {"CopyObjectResult": {"ETag": etag}}
+
+    async def list_objects_v2(self, Bucket: str, Prefix: str = "", Delimiter: str | None = None,
+                              ContinuationToken: str | None = None, **kwargs) -> dict:
+        self._record("list_objects_v2", Bucket=Bucket, Prefix=Prefix, Delimiter=Delimiter)
+        entries = []
+        for bucket, key in sorted(self.objects):
+            if bucket != Bucket or not key.startswith(Prefix):
+                continue
+            if Delimiter and Delimiter in key[len(Prefix):]:
+                common_prefix = key[:key.index(Delimiter, len(Prefix)) + len(Delimiter)]
+                if not entries or entries[-1] != ("prefix", common_prefix):
+                    entries.append(("prefix", common_prefix))
+            else:
+                entries.append(("key", key))
+
+        # Like S3, the token points after the last returned key, so deleting listed keys skips nothing
+        if ContinuationToken is not None:
+            entries = [entry for entry in entries if entry[1] > ContinuationToken]
+        page = entries[:self.page_size]
+        response = {
+            "KeyCount": len(page),
+            "IsTruncated": self.page_size < len(entries),
+            "Contents": [],
+            "CommonPrefixes": [],
+        }
+        for kind, value in page:
+            if kind == "prefix":
+                response["CommonPrefixes"].append({"Prefix": value})
+            else:
+                obj = self.objects[(Bucket, value)]
+                response["Contents"].append({
+                    "Key": value,
+                    "Size": len(obj["Body"]),
+                    "ETag": obj["ETag"],
+                    "LastModified": obj["LastModified"],
+                })
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = page[-1][1]
+        return response
+
+    async def create_multipart_upload(self, Bucket: str, Key: str, ContentType: str = "binary/octet-stream", **kwargs) -> dict:
+        self._record("create_multipart_upload", Bucket=Bucket, Key=Key, ContentType=ContentType)
+        upload_id = uuid.uuid4().hex
+        self.multipart_uploads[upload_id] = {"Bucket": Bucket, "Key": Key, "ContentType": ContentType, "Parts": {}}
+        return {"UploadId": upload_id}
+
+    async def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body, **kwargs) -> dict:
+        self._record("upload_part", Bucket=Bucket, Key=Key, UploadId=UploadId, PartNumber=PartNumber)
+        upload = self.multipart_uploads.get(UploadId)
+        if upload is None:
+            raise client_error("NoSuchUpload", 404, "UploadPart")
+        data = Body if isinstance(Body, bytes) else Body.read()
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        upload["Parts"][PartNumber] = (etag, data)
+        return {"ETag": etag}
+
+    async def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict, **kwargs) -> dict:
+        self._record("complete_multipart_upload", Bucket=Bucket, Key=Key, UploadId=UploadId)
+        upload = self.multipart_uploads.pop(UploadId, None)
+        if upload is None:
+            raise client_error("NoSuchUpload", 404, "CompleteMultipartUpload")
+        parts = MultipartUpload["Parts"]
+        if [part["PartNumber"] for part in parts] != sorted(upload["Parts"]):
+            raise client_error("InvalidPart", 400, "CompleteMultipartUpload")
+        data = b"".join(upload["Parts"][part["PartNumber"]][1] for part in parts)
+        digest = hashlib.md5(b"".join(bytes.fromhex(part["ETag"].strip('"')) for part in parts)).hexdigest()
+        etag = f'"{digest}-{len(parts)}"'
+        self.store(Bucket, Key, data, upload["ContentType"], etag)
+        return {"ETag": etag}
+
+    async def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> dict:
+        self._record("abort_multipart_upload", Bucket=Bucket, Key=Key, UploadId=UploadId)
+        self.multipart_uploads.pop(UploadId, None)
+        return {}
@@ -0,0 +1,76 @@
+import pytest
+
+import asyncio
+import threading
+import time
+
+from tests.test_data import users_test_data
+from db import aio, db
+from db.models import User
+
+
+@pytest.mark.parametrize("user_id, password", users_test_data)
+def test_awaitable_functions(user_id, password):
+    async def scenario():
+        async with aio.get_async_db() as conn:
+            await aio.insert_user(conn, User(user_id=user_id, password=password))
+
+        async with aio.get_async_db() as conn:
+            user = await aio.select_user(conn, user_id)
+            await aio.delete_user(conn, user_id)
+        return user
+
+    user = asyncio.run(scenario())
+
+    assert user.user_id == user_id
+    assert user.password == password
+
+def test_get_async_db_rolls_back_on_error():
+    async def scenario():
+        with pytest.raises(ValueError):
+            async with aio.get_async_db() as conn:
+                await aio.insert_user(conn, User(user_id="rollback", password="rollback"))
+                raise ValueError()
+
+        async with aio.get_async_db() as conn:
+            return await aio.select_user(conn, "rollback")
+
+    assert asyncio.run(scenario()) is None
+
+def test_run_sync_runs_off_event_loop():
+    async def scenario():
+        return await aio.run_sync(threading.get_ident)
+
+    assert asyncio.run(scenario()) != threading.get_ident()
+
+def test_get_async_db_returns_connection_checked_out_after_cancel(test_pool, mocker):
+    pool = db.open_pool()
+    getconn = pool.getconn
+
+    def slow_getconn(*args, **kwargs):
+        time.sleep(0.2)
+        return getconn(*args, **kwargs)
+
+    mocker.patch.object(pool, "getconn", side_effect=slow_getconn)
+    # Kept referenced, so the connection isn't given back by garbage collection of the abandoned context manager
+    context_managers = []
+    get_db = db.get_db
+    mocker.patch("db.db.get_db", side_effect=lambda: context_managers.append(get_db()) or context_managers[-1])
+
+    async def checkout():
+        async with aio.get_async_db():
+            pass
+
+    async def scenario():
+        task = asyncio.create_task(checkout())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # Past the end of the slow checkout
+        await asyncio.sleep(0.3)
+
+    asyncio.run(scenario())
+
+    assert pool.getconn.call_count == 1
+    assert db.pool_stats()["in_use"] == 0
@@ -0,0 +1,42 @@
+import asyncio
+import zipfile
+from datetime import datetime
+from io import BytesIO
+
+from storage.archive import stream_zip, archive_name
+from storage.s3 import BUCKET_NAME
+
+
+def document(name, key, size):
+    return {"name": name, "key": key, "size": size, "modified_at": datetime(2024, 5, 1, 12, 30)}
+
+def collect(generator):
+    async def scenario():
+        return [part async for part in generator]
+    return asyncio.run(scenario())
+
+def test_stream_zip(fake_s3, mocker):
+    mocker.patch("storage.archive.ARCHIVE_CHUNK_SIZE", 1000)
+    big = bytes(range(251)) * 40
+    fake_s3.store(BUCKET_NAME, "5/big.pdf", big)
+    fake_s3.store(BUCKET_NAME, "_blobs/digest", b"shared")
+    documents = [
+        document("big.pdf", "5/big.pdf", len(big)),
+        document("missing.pdf", "5/missing.pdf", 3),
+        document("../shared.pdf", "_blobs/digest", 6),
+    ]
+
+    parts = collect(stream_zip(fake_s3, documents, prefetch=2))
+
+    assert max(len(part) for part in parts) < 2000
+    with zipfile.ZipFile(BytesIO(b"".join(parts))) as archive:
+        assert archive.namelist() == ["big.pdf", "shared.pdf"]
+        assert archive.read("big.pdf") == big
+        assert archive.read("shared.pdf") == b"shared"
+        assert archive.getinfo("big.pdf").date_time == (2024, 5, 1, 12, 30, 0)
+        assert archive.testzip() is None
+
+def test_archive_name():
+    assert archive_name("../../etc/passwd") == "etc/passwd"
+    assert archive_name("/abs\\\\path.pdf") == "abs/path.pdf"
+    assert archive_name("..") == "document"
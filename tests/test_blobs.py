@@ -0,0 +1,65 @@
+import asyncio
+import hashlib
+from io import BytesIO
+
+from fastapi import UploadFile
+
+from db.db import lock_blob, select_document, upsert_document
+from storage.blobs import store_deduplicated, blob_key
+from storage.gc import collect_blobs
+from storage.s3 import BUCKET_NAME
+from tests.test_db import create_project_in_db
+
+
+def upload(fake_s3, project_id, name, data):
+    file = UploadFile(BytesIO(data), filename=name)
+    return asyncio.run(store_deduplicated(fake_s3, BUCKET_NAME, project_id, name, file, "application/pdf"))
+
+def test_store_deduplicated(db_connection, test_pool, fake_s3):
+    with db_connection.cursor() as cur:
+        first = create_project_in_db(cur, name="First", description="").project_id
+        second = create_project_in_db(cur, name="Second", description="").project_id
+    db_connection.commit()
+    digest = hashlib.sha256(b"template").hexdigest()
+
+    assert upload(fake_s3, first, "template.pdf", b"template")["stored"] is True
+    copied = upload(fake_s3, second, "copy.pdf", b"template")
+    assert (copied["stored"], copied["changed"]) == (False, True)
+    calls = len(fake_s3.calls)
+    assert upload(fake_s3, second, "copy.pdf", b"template") == {
+        "key": blob_key(digest), "size": 8, "etag": fake_s3.objects[(BUCKET_NAME, blob_key(digest))]["ETag"],
+        "digest": digest, "stored": False, "changed": False,
+    }
+
+    assert len(fake_s3.calls) == calls
+    assert list(fake_s3.objects) == [(BUCKET_NAME, blob_key(digest))]
+    assert lock_blob(db_connection, digest)["ref_count"] == 2
+    db_connection.rollback()
+
+def test_store_deduplicated_replaces_direct_document(db_connection, test_pool, fake_s3):
+    with db_connection.cursor() as cur:
+        project_id = create_project_in_db(cur, name="Direct", description="").project_id
+    etag = fake_s3.store(BUCKET_NAME, f"{project_id}/spec.pdf", b"old")["ETag"]
+    upsert_document(db_connection, project_id, "spec.pdf", f"{project_id}/spec.pdf", 3, None, etag)
+    db_connection.commit()
+
+    result = upload(fake_s3, project_id, "spec.pdf", b"new content")
+
+    assert list(fake_s3.objects) == [(BUCKET_NAME, result["key"])]
+    document = select_document(db_connection, project_id, "spec.pdf")
+    assert (document["key"], document["digest"], document["size"]) == (result["key"], result["digest"], 11)
+    db_connection.rollback()
+
+def test_collect_blobs(db_connection, test_pool, fake_s3):
+    with db_connection.cursor() as cur:
+        project_id = create_project_in_db(cur, name="Collected", description="").project_id
+    db_connection.commit()
+    kept = upload(fake_s3, project_id, "kept.pdf", b"kept")
+    removed = upload(fake_s3, project_id, "removed.pdf", b"removed")
+    upload(fake_s3, project_id, "removed.pdf", b"kept")
+
+    assert asyncio.run(collect_blobs(fake_s3, grace_seconds=3600)) == {"blobs_removed": 0, "bytes_freed": 0}
+    assert asyncio.run(collect_blobs(fake_s3, grace_seconds=0)) == {"blobs_removed": 1, "bytes_freed": 7}
+    assert list(fake_s3.objects) == [(BUCKET_NAME, kept["key"])]
+    assert lock_blob(db_connection, removed["digest"]) is None
+    db_connection.rollback()
@@ -0,0 +1,74 @@
+import pytest
+
+import json
+import time
+
+import psycopg2
+
+from db.cache import PermissionCache, PermissionInvalidationListener, PERMISSION_CHANNEL
+from tests.conftest import DB_CONFIG
+
+
+def test_permission_cache_lru_eviction():
+    cache = PermissionCache(max_size=2, ttl=60)
+    cache.set("mike", 1, "owner")
+    cache.set("mike", 2, "owner")
+    cache.get("mike", 1)
+    cache.set("mike", 3, "participant")
+
+    assert cache.get("mike", 2) is None
+    assert cache.get("mike", 1) == "owner"
+    assert cache.get("mike", "3") == "participant"
+
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+
+def test_permission_cache_ttl():
+    cache = PermissionCache(max_size=10, ttl=0.01)
+    cache.set("mike", 1, "owner")
+    time.sleep(0.02)
+
+    assert cache.get("mike", 1) is None
+    assert cache.stats()["expirations"] == 1
+
+def test_permission_cache_invalidate():
+    cache = PermissionCache(max_size=10, ttl=60)
+    for user_id in ("mike", "james"):
+        for project_id in (1, 2):
+            cache.set(user_id, project_id, "participant")
+
+    cache.invalidate("mike", 1)
+    assert cache.get("mike", 1) is None
+
+    cache.invalidate(project_id=2)
+    assert cache.get("mike", 2) is None
+    assert cache.get("james", 2) is None
+
+    cache.invalidate(user_id="james")
+    assert cache.stats()["size"] == 0
+
+def test_permission_invalidation_listener():
+    cache = PermissionCache(max_size=10, ttl=60)
+    cache.set("mike", 1, "owner")
+    cache.set("james", 1, "participant")
+
+    listener = PermissionInvalidationListener(cache, poll_interval=0.05, **DB_CONFIG)
+    listener.start()
+    try:
+        time.sleep(0.2)
+        conn = psycopg2.connect(**DB_CONFIG)
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT pg_notify(%s, %s)", (PERMISSION_CHANNEL, json.dumps({"user_id": "mike", "project_id": 1})))
+        conn.close()
+
+        for _ in range(50):
+            if cache.stats()["size"] == 1:
+                break
+            time.sleep(0.02)
+    finally:
+        listener.stop()
+
+    assert cache.get("mike", 1) is None
+    assert cache.get("james", 1) == "participant"
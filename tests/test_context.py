@@ -0,0 +1,46 @@
+import pytest
+
+import asyncio
+
+from db.context import RequestContext
+from db.db import pool_stats
+from db.models import User
+from db import aio
+
+
+def test_permission_is_resolved_once(mocker):
+    check_permission = mocker.patch("db.context.check_permission", return_value="owner")
+
+    async def scenario():
+        async with RequestContext("mike") as context:
+            first = await context.permission(12)
+            second = await context.permission("12")
+        return first, second
+
+    assert asyncio.run(scenario()) == ("owner", "owner")
+    assert check_permission.await_count == 1
+
+def test_connection_is_shared_and_released():
+    async def scenario():
+        async with RequestContext("mike") as context:
+            first = await context.connection()
+            second = await context.connection()
+            in_use = pool_stats()["in_use"]
+            await context.release()
+            return first is second, in_use, pool_stats()["in_use"]
+
+    shared, in_use, in_use_after_release = asyncio.run(scenario())
+    assert shared
+    assert in_use_after_release == in_use - 1
+
+def test_transaction_rolled_back_on_error():
+    async def scenario():
+        with pytest.raises(ValueError):
+            async with RequestContext("rollback") as context:
+                await aio.insert_user(await context.connection(), User(user_id="rollback", password="rollback"))
+                raise ValueError()
+
+        async with RequestContext("rollback") as context:
+            return await aio.select_user(await context.connection(), "rollback")
+
+    assert asyncio.run(scenario()) is None
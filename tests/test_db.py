@@ -1,6 +1,6 @@
 import pytest
 
-from datetime import datetime
+from datetime import datetime, timezone
 
 from tests.test_data import users_test_data, projects_test_data, user_project_test_data
 from db.db import *
@@ -215,3 +215,124 @@ def test_delete_project(db_connection, user_owner, user_participant):
     assert result is None
 
 
+def test_select_project_info_pagination(db_connection):
+    with db_connection.cursor() as cur:
+        test_user = create_user_in_db(cur, user_id="mike", password="wazowski")
+        project_ids = []
+        for name, description in projects_test_data * 3:
+            test_project = create_project_in_db(cur, name=name, description=description)
+            create_relation_in_db(cur, test_user.user_id, test_project.project_id, permission="owner")
+            project_ids.append(test_project.project_id)
+
+    first_page = select_project_info(db_connection, test_user.user_id, limit=4)
+    assert list(first_page) == project_ids[:4]
+
+    second_page = select_project_info(db_connection, test_user.user_id, limit=4, after=project_ids[3])
+    assert list(second_page) == project_ids[4:]
+
+    descending = select_project_info(db_connection, test_user.user_id, limit=2, after=project_ids[3], order=SortOrder.desc)
+    assert list(descending) == [project_ids[2], project_ids[1]]
+
+@pytest.mark.parametrize("user_owner, user_participant", user_project_test_data)
+def test_check_permission_cache(db_connection, user_owner, user_participant):
+    with db_connection.cursor() as cur:
+        test_user_owner = create_user_in_db(cur, user_id=user_owner["user_id"], password=user_owner["password"])
+        test_user_participant = create_user_in_db(cur, user_id=user_participant["user_id"], password=user_participant["password"])
+        test_project = create_project_in_db(cur, name=user_owner["name"], description=user_owner["description"])
+        create_relation_in_db(cur, test_user_owner.user_id, test_project.project_id, permission="owner")
+
+    insert_permission(db_connection, test_user_participant.user_id, test_project.project_id, "participant")
+    assert check_permission(db_connection, test_user_participant.user_id, test_project.project_id) == "participant"
+    hits = permission_cache.stats()["hits"]
+    assert check_permission(db_connection, test_user_participant.user_id, test_project.project_id) == "participant"
+    assert permission_cache.stats()["hits"] == hits + 1
+
+    delete_permission(db_connection, test_user_owner.user_id, test_user_participant.user_id, test_project.project_id)
+    with pytest.raises(HTTPException) as exc_info:
+        check_permission(db_connection, test_user_participant.user_id, test_project.project_id)
+    assert exc_info.value.status_code == status.HTTP_404_NOT_FOUND
+
+def test_documents_index(db_connection):
+    with db_connection.cursor() as cur:
+        test_project = create_project_in_db(cur, name="Docs", description="Indexed documents")
+    project_id = test_project.project_id
+
+    upsert_document(db_connection, project_id, "b.pdf", f"{project_id}/b.pdf", 10, "application/pdf", '"etag-b"')
+    upsert_document(db_connection, project_id, "a.png", f"{project_id}/a.png", 20, "image/png", '"etag-a"')
+    upsert_document(db_connection, project_id, "b.pdf", f"{project_id}/b.pdf", 30, "application/pdf", '"etag-b2"')
+
+    assert select_document_names(db_connection, project_id) == ["a.png", "b.pdf"]
+    document = select_documents(db_connection, project_id)[1]
+    assert (document["size"], document["etag"]) == (30, '"etag-b2"')
+    assert document["modified_at"] >= document["created_at"]
+
+    assert delete_document(db_connection, project_id, "a.png") is True
+    assert delete_document(db_connection, project_id, "a.png") is False
+
+    with db_connection.cursor() as cur:
+        cur.execute("DELETE FROM projects WHERE project_id = %s", (project_id,))
+    assert select_documents(db_connection, project_id) == []
+
+def test_select_document_names_by_project(db_connection):
+    with db_connection.cursor() as cur:
+        first = create_project_in_db(cur, name="First", description="").project_id
+        second = create_project_in_db(cur, name="Second", description="").project_id
+    upsert_document(db_connection, first, "b.pdf", f"{first}/b.pdf", 1, None, '"b"')
+    upsert_document(db_connection, first, "a.pdf", f"{first}/a.pdf", 1, None, '"a"')
+
+    assert select_document_names_by_project(db_connection, [first, second], timeout=1) == {first: ["a.pdf", "b.pdf"], second: []}
+
+    with pytest.raises(psycopg2.errors.QueryCanceled):
+        with db_connection.cursor() as cur:
+            select_document_names_by_project(db_connection, [first], timeout=0.01)
+            cur.execute("SELECT pg_sleep(1);")
+    db_connection.rollback()
+
+def test_blob_ref_count(db_connection):
+    with db_connection.cursor() as cur:
+        first = create_project_in_db(cur, name="First", description="").project_id
+        second = create_project_in_db(cur, name="Second", description="").project_id
+    insert_blob(db_connection, "aaa", "_blobs/aaa", 10, '"a"')
+    insert_blob(db_connection, "bbb", "_blobs/bbb", 30, '"b"')
+    insert_blob(db_connection, "aaa", "_blobs/other", 10, '"a"')
+
+    upsert_document(db_connection, first, "a.pdf", "_blobs/aaa", 10, None, '"a"', "aaa")
+    upsert_document(db_connection, second, "a.pdf", "_blobs/aaa", 10, None, '"a"', "aaa")
+    upsert_document(db_connection, second, "a.pdf", "_blobs/aaa", 10, "application/pdf", '"a"', "aaa")
+    upsert_document(db_connection, second, "b.pdf", "_blobs/aaa", 10, None, '"a"', "aaa")
+    assert lock_blob(db_connection, "aaa")["ref_count"] == 3
+    assert lock_blob(db_connection, "aaa")["key"] == "_blobs/aaa"
+
+    upsert_document(db_connection, second, "b.pdf", "_blobs/bbb", 30, None, '"b"', "bbb")
+    stats = select_dedup_stats(db_connection)
+    assert (stats["documents"], stats["logical_bytes"], stats["stored_bytes"]) == (3, 50, 40)
+    assert stats["dedup_ratio"] == 1.25
+
+    with db_connection.cursor() as cur:
+        cur.execute("DELETE FROM projects WHERE project_id = %s", (second,))
+    assert lock_blob(db_connection, "aaa")["ref_count"] == 1
+    assert lock_blob(db_connection, "bbb")["ref_count"] == 0
+
+    assert delete_unreferenced_blobs(db_connection, grace_seconds=3600) == []
+    removed = delete_unreferenced_blobs(db_connection, grace_seconds=0)
+    assert [blob["digest"] for blob in removed] == ["bbb"]
+    assert lock_blob(db_connection, "bbb") is None
+    db_connection.rollback()
+
+def test_select_project_version(db_connection):
+    with db_connection.cursor() as cur:
+        project_id = create_project_in_db(cur, name="Versioned", description="").project_id
+
+    empty = select_project_version(db_connection, project_id)
+    assert (empty["documents"], empty["documents_modified_at"]) == (0, None)
+
+    upsert_document(db_connection, project_id, "a.pdf", f"{project_id}/a.pdf", 1, None, '"a"')
+    first = select_project_version(db_connection, project_id)
+    upsert_document(db_connection, project_id, "a.pdf", f"{project_id}/a.pdf", 1, None, '"a2"')
+    second = select_project_version(db_connection, project_id)
+
+    assert first["documents"] == second["documents"] == 1
+    assert len({empty["listing_digest"], first["listing_digest"], second["listing_digest"]}) == 3
+    assert abs((second["documents_modified_at"] - datetime.now(timezone.utc)).total_seconds()) < 60
+    assert select_project_version(db_connection, -1) is None
+    db_connection.rollback()
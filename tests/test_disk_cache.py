@@ -0,0 +1,96 @@
+import pytest
+
+import os
+from datetime import datetime, timezone
+
+from storage.disk_cache import DiskCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = DiskCache(tmp_path, max_bytes=10)
+    cache.open()
+    yield cache
+    cache.close()
+
+def fill(cache, key, etag, data, last_modified = None):
+    writer = cache.writer(key, etag, last_modified)
+    writer.write(data)
+    writer.commit()
+
+def test_disabled_without_directory():
+    cache = DiskCache(None)
+    cache.open()
+
+    assert not cache.enabled
+    assert cache.writer("1/a.pdf", '"a"') is None
+    assert cache.get("1/a.pdf", '"a"') is None
+
+def test_get_matches_etag(cache):
+    modified = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    fill(cache, "1/a.pdf", '"v1"', b"abcd", modified)
+
+    path = cache.get("1/a.pdf", '"v1"')
+    assert path.read_bytes() == b"abcd"
+    assert os.stat(path).st_mtime == modified.timestamp()
+
+    assert cache.get("1/a.pdf", '"v2"') is None
+    assert not path.exists()
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["bytes_saved"], stats["entries"]) == (1, 1, 4, 0)
+
+def test_lru_eviction(cache):
+    fill(cache, "1/a.pdf", '"a"', b"aaaa")
+    fill(cache, "1/b.pdf", '"b"', b"bbbb")
+    cache.get("1/a.pdf", '"a"')
+    fill(cache, "1/c.pdf", '"c"', b"cccc")
+
+    assert cache.get("1/b.pdf", '"b"') is None
+    assert cache.get("1/a.pdf", '"a"') is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size_bytes"] == 8
+
+def test_oversized_and_aborted_writes_leave_nothing(cache):
+    fill(cache, "1/big.pdf", '"big"', b"x" * 11)
+    writer = cache.writer("1/a.pdf", '"a"')
+    writer.write(b"partial")
+    writer.abort()
+
+    assert cache.stats()["entries"] == 0
+    assert list(cache.path.iterdir()) == []
+
+def test_invalidate(cache):
+    fill(cache, "1/a.pdf", '"a"', b"a")
+    fill(cache, "1/b.pdf", '"b"', b"b")
+    fill(cache, "12/c.pdf", '"c"', b"c")
+
+    cache.invalidate("1/a.pdf")
+    assert cache.get("1/a.pdf", '"a"') is None
+
+    cache.invalidate(prefix="1/")
+    assert cache.get("1/b.pdf", '"b"') is None
+    assert cache.get("12/c.pdf", '"c"') is not None
+    assert cache.stats()["invalidations"] == 2
+
+def test_open_removes_directories_of_dead_processes(tmp_path):
+    (tmp_path / "999999999").mkdir()
+    (tmp_path / "999999999" / "stale").write_bytes(b"stale")
+    cache = DiskCache(tmp_path)
+    cache.open()
+
+    assert [child.name for child in tmp_path.iterdir()] == [str(os.getpid())]
+    cache.close()
+    assert list(tmp_path.iterdir()) == []
+
+def test_open_file_outlives_its_entry(cache):
+    fill(cache, "1/a.pdf", '"v1"', b"abcd")
+
+    with cache.open_file("1/a.pdf", '"v1"') as file:
+        cache.invalidate("1/a.pdf")
+        assert file.read() == b"abcd"
+    assert cache.open_file("1/a.pdf", '"v1"') is None
+
+    fill(cache, "1/b.pdf", '"v1"', b"efgh")
+    cache.get("1/b.pdf", '"v1"').unlink()
+    assert cache.open_file("1/b.pdf", '"v1"') is None
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,276 @@
+import pytest
+
+import asyncio
+from io import BytesIO
+from datetime import datetime
+import zipfile
+
+from fastapi import UploadFile
+
+from storage.s3 import BUCKET_NAME
+from storage.disk_cache import DiskCache
+from views.document import delete_s3_folder, store_deduplicated_document
+from tests.test_db import create_project_in_db
+from tests.test_project import create_test_token
+from tests.test_data import user_project_test_data
+
+
+def test_delete_s3_folder(fake_s3):
+    for i in range(2500):
+        fake_s3.store(BUCKET_NAME, f"7/file_{i}.pdf")
+    fake_s3.store(BUCKET_NAME, "70/other.pdf")
+
+    assert asyncio.run(delete_s3_folder(7)) == 2500
+
+    assert list(fake_s3.objects) == [(BUCKET_NAME, "70/other.pdf")]
+    batches = fake_s3.calls_of("delete_objects")
+    assert [len(batch["Delete"]["Objects"]) for batch in batches] == [1000, 1000, 500]
+
+def test_delete_s3_folder_errors(fake_s3, mocker):
+    fake_s3.store(BUCKET_NAME, "7/file.pdf")
+    mocker.patch.object(fake_s3, "delete_objects", return_value = {"Errors": [{"Key": "7/file.pdf", "Code": "InternalError"}]})
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(delete_s3_folder(7))
+
+def test_store_deduplicated_document_queues_extraction_of_changed_content(db_connection, test_pool, fake_s3, mocker):
+    mocker.patch("search.indexer.SEARCH_ENABLED", True)
+    with db_connection.cursor() as cur:
+        project_id = create_project_in_db(cur, name="Dedup", description="").project_id
+    db_connection.commit()
+
+    for data in (b"first", b"first", b"second"):
+        file = UploadFile(BytesIO(data), filename="spec.pdf")
+        asyncio.run(store_deduplicated_document(fake_s3, project_id, file, "spec.pdf"))
+
+    with db_connection.cursor() as cur:
+        cur.execute("SELECT payload->>'etag' AS etag FROM jobs WHERE kind = 'extract_document_text' ORDER BY job_id")
+        etags = [row["etag"] for row in cur.fetchall()]
+    assert len(etags) == 2 and etags[0] != etags[1]
+    db_connection.rollback()
+
+@pytest.mark.parametrize("user_owner, user_participant", user_project_test_data)
+def test_get_s3_document(client, mocker, fake_s3, secrets, user_owner, user_participant):
+    mocker.patch("db.context.check_permission", return_value = "participant")
+    fake_s3.store(BUCKET_NAME, "5/spec.pdf", b"%PDF-content")
+    token = create_test_token(secrets, user_owner["user_id"])
+
+    for download_web in ("", "true"):
+        response = client.get(
+            f"/projects/5/documents/spec.pdf?download_web={download_web}",
+            headers = {"Authorization": f"Bearer {token}"}
+        )
+
+        assert response.status_code == 200
+        assert response.content == b"%PDF-content"
+
+@pytest.mark.parametrize("range_header, if_range, status_code, content_range, content", [
+    ("bytes=0-3", None, 206, "bytes 0-3/12", b"%PDF"),
+    ("bytes=-7", None, 206, "bytes 5-11/12", b"content"),
+    ("bytes=5-", "match", 206, "bytes 5-11/12", b"content"),
+    ("bytes=5-", '"stale"', 200, None, b"%PDF-content"),
+    ("bytes=5-", "Mon, 01 Jan 2001 00:00:00 GMT", 200, None, b"%PDF-content"),
+    ("bytes=0-1,4-5", None, 200, None, b"%PDF-content"),
+])
+def test_get_s3_document_range(client, mocker, fake_s3, secrets, range_header, if_range, status_code, content_range, content):
+    mocker.patch("db.context.check_permission", return_value = "participant")
+    etag = fake_s3.store(BUCKET_NAME, "5/spec.pdf", b"%PDF-content", "application/pdf")["ETag"]
+    token = create_test_token(secrets, "mike")
+    headers = {"Authorization": f"Bearer {token}", "Range": range_header}
+    if if_range:
+        headers["If-Range"] = etag if if_range == "match" else if_range
+
+    response = client.get("/projects/5/documents/spec.pdf", headers = headers)
+
+    assert response.status_code == status_code
+    assert response.content == content
+    assert response.headers.get("Content-Range") == content_range
+    assert response.headers["Content-Length"] == str(len(content))
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.headers["ETag"] == etag
+
+def test_get_s3_document_errors(client, mocker, fake_s3, secrets):
+    mocker.patch("db.context.check_permission", return_value = "participant")
+    fake_s3.store(BUCKET_NAME, "5/spec.pdf", b"%PDF-content")
+    headers = {"Authorization": f"Bearer {create_test_token(secrets, 'mike')}"}
+
+    response = client.get("/projects/5/documents/spec.pdf", headers = {**headers, "Range": "bytes=100-"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == "bytes */12"
+
+    response = client.get("/projects/5/documents/missing.pdf", headers = headers)
+    assert response.status_code == 404
+
+def test_get_s3_document_conditional(client, mocker, fake_s3, secrets):
+    mocker.patch("db.context.check_permission", return_value = "participant")
+    etag = fake_s3.store(BUCKET_NAME, "5/spec.pdf", b"%PDF-content")["ETag"]
+    headers = {"Authorization": f"Bearer {create_test_token(secrets, 'mike')}"}
+
+    response = client.get("/projects/5/documents/spec.pdf", headers = headers)
+    assert response.headers["ETag"] == etag
+    last_modified = response.headers["Last-Modified"]
+
+    response = client.get("/projects/5/documents/spec.pdf", headers = {**headers, "If-None-Match": etag})
+    assert (response.status_code, response.content) == (304, b"")
+    response = client.get("/projects/5/documents/spec.pdf", headers = {**headers, "If-Modified-Since": last_modified})
+    assert response.status_code == 304
+    response = client.get("/projects/5/documents/spec.pdf", headers = {**headers, "If-None-Match": '"stale"', "If-Modified-Since": last_modified})
+    assert (response.status_code, response.content) == (200, b"%PDF-content")
+
+    # An indexed ETag is checked without calling S3
+    requests = len(fake_s3.calls_of("get_object"))
+    mocker.patch("views.document.select_document", return_value = {"key": "5/spec.pdf", "etag": etag, "content_type": None, "digest": None})
+    response = client.get("/projects/5/documents/spec.pdf", headers = {**headers, "If-None-Match": f'W/{etag}, "other"'})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert len(fake_s3.calls_of("get_object")) == requests
+
+def test_update_s3_file_indexes_document(client, mocker, fake_s3, secrets):
+    mocker.patch("db.context.check_permission", return_value = "participant")
+    index_document = mocker.patch("views.document.index_document")
+    headers = {"Authorization": f"Bearer {create_test_token(secrets, 'mike')}"}
+
+    response = client.post(
+        "/projects/5/documents/spec.pdf",
+        headers = headers,
+        files = {"file": ("spec.pdf", BytesIO(b"%PDF-content"), "application/pdf")}
+    )
+
+    assert response.status_code == 200
+    project_id, name, uploaded, content_type = index_document.call_args.args
+    assert (project_id, name, content_type) == ("5", "spec.pdf", "application/pdf")
+    assert uploaded["size"] == 12
+    assert uploaded["etag"] == fake_s3.objects[(BUCKET_NAME, "5/spec.pdf")]["ETag"]
+
+def test_delete_s3_document(client, mocker, fake_s3, secrets):
+    check_permission = mocker.patch("db.context.check_permission", return_value = None)
+    delete_document = mocker.patch("views.document.delete_document", return_value = True)
+    fake_s3.store(BUCKET_NAME, "5/spec.pdf", b"%PDF-content")
+    headers = {"Authorization": f"Bearer {create_test_token(secrets, 'mike')}"}
+
+    response = client.delete("/projects/5/documents/spec.pdf", headers = headers)
+    assert response.status_code == 401
+    assert (BUCKET_NAME, "5/spec.pdf") in fake_s3.objects
+
+    check_permission.return_value = "participant"
+    response = client.delete("/projects/5/documents/spec.pdf", headers = headers)
+    assert response.status_code == 200
+    assert fake_s3.objects == {}
+    assert delete_document.call_args.args[1:] == (5, "spec.pdf")
+
+def test_get_s3_document_disk_cache(client, mocker, fake_s3, secrets, tmp_path):
+    cache = DiskCache(tmp_path, max_bytes=1024)
+    cache.open()
+    mocker.patch("views.document.document_cache", cache)
+    mocker.patch("db.context.check_permission", return_value = "participant")
+    etag = fake_s3.store(BUCKET_NAME, "5/spec.pdf", b"%PDF-content", "application/pdf")["ETag"]
+    mocker.patch("views.document.select_document", return_value = {"key": "5/spec.pdf", "etag": etag, "content_type": "application/pdf", "digest": None})
+    headers = {"Authorization": f"Bearer {create_test_token(secrets, 'mike')}"}
+
+    first = client.get("/projects/5/documents/spec.pdf", headers = headers)
+    second = client.get("/projects/5/documents/spec.pdf", headers = headers)
+    ranged = client.get("/projects/5/documents/spec.pdf", headers = {**headers, "Range": "bytes=0-3"})
+
+    assert first.content == second.content == b"%PDF-content"
+    assert second.headers["ETag"] == etag
+    assert (ranged.status_code, ranged.content) == (206, b"%PDF")
+    assert len(fake_s3.calls_of("get_object")) == 1
+    assert cache.stats()["hits"] == 2
+
+    stale_range = client.get("/projects/5/documents/spec.pdf", headers = {**headers, "Range": "bytes=0-3", "If-Range": '"stale"'})
+    assert (stale_range.status_code, stale_range.content) == (200, b"%PDF-content")
+    outside = client.get("/projects/5/documents/spec.pdf", headers = {**headers, "Range": "bytes=20-"})
+    assert (outside.status_code, outside.headers["Content-Range"]) == (416, "bytes */12")
+
+    # Evicted by another request while this one is being sent
+    open_file = cache.open_file
+    def open_and_evict(key, etag):
+        file = open_file(key, etag)
+        cache.invalidate(key)
+        return file
+    mocker.patch.object(cache, "open_file", side_effect = open_and_evict)
+    evicted = client.get("/projects/5/documents/spec.pdf", headers = headers)
+    assert (evicted.status_code, evicted.content) == (200, b"%PDF-content")
+    assert len(fake_s3.calls_of("get_object")) == 1
+
+    mocker.patch("db.context.check_permission", return_value = "owner")
+    mocker.patch("views.document.delete_document", return_value = True)
+    client.delete("/projects/5/documents/spec.pdf", headers = headers)
+    assert cache.stats()["entries"] == 0
+    cache.close()
+
+def test_get_s3_document_url(client, mocker, fake_s3, secrets):
+    mocker.patch("db.context.check_permission", return_value = "participant")
+    select_document = mocker.patch("views.document.select_document", return_value = None)
+    headers = {"Authorization": f"Bearer {create_test_token(secrets, 'mike')}"}
+
+    response = client.get("/projects/5/documents/spec.pdf/url", headers = headers)
+    assert response.status_code == 404
+    assert fake_s3.calls_of("generate_presigned_url") == []
+
+    select_document.return_value = {"key": "5/spec.pdf"}
+    response = client.get("/projects/5/documents/spec.pdf/url", headers = headers)
+    assert response.status_code == 200
+    assert response.json()["url"].startswith(f"{fake_s3.endpoint_url}/{BUCKET_NAME}/5/spec.pdf?")
+    params = fake_s3.calls_of("generate_presigned_url")[0]["Params"]
+    assert params["ResponseContentDisposition"] == "attachment; filename=spec.pdf"
+
+    response = client.get("/projects/5/documents/spec.pdf/url?redirect=true", headers = headers, follow_redirects = False)
+    assert response.status_code == 307
+    assert response.headers["Location"].startswith(fake_s3.endpoint_url)
+    assert fake_s3.calls_of("get_object") == []
+
+def test_presigned_upload_and_confirm(client, mocker, fake_s3, secrets):
+    mocker.patch("db.context.check_permission", return_value = "participant")
+    index_document = mocker.patch("views.document.index_document")
+    headers = {"Authorization": f"Bearer {create_test_token(secrets, 'mike')}"}
+
+    response = client.post("/projects/5/uploads", headers = headers, json = {"files": [{"name": "script.exe"}]})
+    assert response.status_code == 406
+
+    response = client.post("/projects/5/uploads", headers = headers, json = {"files": [{"name": "spec.pdf", "content_type": "application/pdf"}]})
+    assert response.status_code == 200
+    form = response.json()["uploads"]["spec.pdf"]
+    assert form["fields"]["key"] == "5/spec.pdf"
+    assert {"Content-Type": "application/pdf"} in fake_s3.calls_of("generate_presigned_post")[0]["Conditions"]
+
+    response = client.post("/projects/5/uploads/confirm", headers = headers, json = {"names": ["spec.pdf"]})
+    assert response.status_code == 404
+
+    # The client uploads straight to S3 with the form
+    etag = fake_s3.store(BUCKET_NAME, form["fields"]["key"], b"%PDF-content", "application/pdf")["ETag"]
+
+    response = client.post("/projects/5/uploads/confirm", headers = headers, json = {"names": ["spec.pdf"]})
+    assert response.status_code == 201
+    assert response.json()["documents"]["spec.pdf"] == {"key": "5/spec.pdf", "size": 12, "etag": etag}
+    assert index_document.call_args.args == (5, "spec.pdf", {"key": "5/spec.pdf", "size": 12, "etag": etag}, "application/pdf")
+
+    response = client.post("/projects/5/uploads/confirm", headers = headers, json = {"names": ["script.exe"]})
+    assert response.status_code == 406
+
+    mocker.patch("views.document.DEDUP_ENABLED", True)
+    for path, body in (("/projects/5/uploads", {"files": [{"name": "spec.pdf"}]}), ("/projects/5/uploads/confirm", {"names": ["spec.pdf"]})):
+        assert client.post(path, headers = headers, json = body).status_code == 501
+
+def test_get_project_archive(client, mocker, fake_s3, secrets):
+    mocker.patch("db.context.check_permission", return_value = "participant")
+    mocker.patch("views.document.select_documents", return_value = [
+        {"name": name, "key": f"5/{name}", "size": 4, "modified_at": datetime(2024, 5, 1)} for name in ("a.pdf", "b.pdf")
+    ])
+    for name in ("a.pdf", "b.pdf"):
+        fake_s3.store(BUCKET_NAME, f"5/{name}", name[0].encode() * 4)
+    headers = {"Authorization": f"Bearer {create_test_token(secrets, 'mike')}"}
+
+    response = client.get("/projects/5/archive?documents=b.pdf", headers = headers)
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/zip"
+    with zipfile.ZipFile(BytesIO(response.content)) as archive:
+        assert archive.namelist() == ["b.pdf"]
+        assert archive.read("b.pdf") == b"bbbb"
+
+    response = client.get("/projects/5/archive", headers = headers)
+    with zipfile.ZipFile(BytesIO(response.content)) as archive:
+        assert archive.namelist() == ["a.pdf", "b.pdf"]
+
+    response = client.get("/projects/5/archive?documents=c.pdf", headers = headers)
+    assert response.status_code == 404
@@ -0,0 +1,47 @@
+import asyncio
+
+from storage.gc import RateLimiter, collect_orphaned_prefixes
+from storage.s3 import BUCKET_NAME
+from tests.test_db import create_project_in_db
+
+
+def fill_bucket(fake_s3, project_id):
+    for i in range(3):
+        fake_s3.store(BUCKET_NAME, f"{project_id}/kept_{i}.pdf", b"kept")
+    for orphan in (project_id + 1000, project_id + 2000):
+        for i in range(5):
+            fake_s3.store(BUCKET_NAME, f"{orphan}/file_{i}.pdf", b"orphan")
+    fake_s3.store(BUCKET_NAME, "_blobs/digest", b"blob")
+
+def test_collect_orphaned_prefixes(db_connection, test_pool, fake_s3):
+    with db_connection.cursor() as cur:
+        project_id = create_project_in_db(cur, name="Kept", description="").project_id
+    db_connection.commit()
+    fill_bucket(fake_s3, project_id)
+    fake_s3.page_size = 2
+    reports = []
+
+    dry_run = asyncio.run(collect_orphaned_prefixes(fake_s3, dry_run=True, batch_size=2, progress=reports.append))
+
+    assert dry_run == {"prefixes_scanned": 3, "orphaned_prefixes": 2, "objects_deleted": 10, "bytes_deleted": 60}
+    assert len(fake_s3.objects) == 14
+    assert fake_s3.calls_of("delete_objects") == []
+    assert [report["prefix"] for report in reports if "prefix" in report] == [f"{project_id + 1000}/", f"{project_id + 2000}/"]
+    assert reports[-1]["prefixes_scanned"] == 3
+
+    result = asyncio.run(collect_orphaned_prefixes(fake_s3, batch_size=2))
+
+    assert result == dry_run
+    assert sorted(key for bucket, key in fake_s3.objects) == sorted(["_blobs/digest"] + [f"{project_id}/kept_{i}.pdf" for i in range(3)])
+    assert all(len(call["Delete"]["Objects"]) <= 2 for call in fake_s3.calls_of("delete_objects"))
+
+def test_rate_limiter_spaces_calls():
+    async def scenario():
+        limiter = RateLimiter(rate=50)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for _ in range(5):
+            await limiter.wait()
+        return loop.time() - started
+
+    assert asyncio.run(scenario()) >= 4 / 50 - 0.005
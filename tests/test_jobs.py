@@ -0,0 +1,111 @@
+import pytest
+
+import asyncio
+
+from db.db import claim_job, select_job
+from tasks.queue import JobWorker, enqueue_job, job_handler, retry_delay
+from db.aio import get_async_db
+from tests.test_project import create_test_token
+from views.document import index_document
+
+calls = []
+
+@job_handler("test_succeeds")
+async def succeeding_job(payload):
+    calls.append(payload)
+    return {"echo": payload["value"]}
+
+@job_handler("test_fails")
+async def failing_job(payload):
+    raise ValueError("boom")
+
+
+def enqueue(kind, payload, created_by = "mike"):
+    async def scenario():
+        async with get_async_db() as conn:
+            return await enqueue_job(conn, kind, payload, created_by)
+    return asyncio.run(scenario())
+
+@pytest.fixture
+def worker(test_pool):
+    return JobWorker(concurrency=1, poll_interval=0.01, lease_seconds=30)
+
+def test_job_succeeds(db_connection, worker, mocker):
+    job_id = enqueue("test_succeeds", {"value": 3})
+
+    assert asyncio.run(worker.run_once()) is True
+    assert asyncio.run(worker.run_once()) is False
+
+    job = select_job(db_connection, job_id)
+    assert (job["status"], job["attempts"], job["result"]) == ("succeeded", 1, {"echo": 3})
+    assert calls[-1] == {"value": 3}
+
+def test_job_retries_with_backoff_then_fails(db_connection, worker, mocker):
+    mocker.patch("tasks.queue.JOB_MAX_ATTEMPTS", 2)
+    mocker.patch("tasks.queue.retry_delay", return_value = 0)
+    job_id = enqueue("test_fails", {})
+
+    asyncio.run(worker.run_once())
+    job = select_job(db_connection, job_id)
+    assert (job["status"], job["attempts"], job["last_error"]) == ("queued", 1, "ValueError('boom')")
+    db_connection.rollback()
+
+    asyncio.run(worker.run_once())
+    job = select_job(db_connection, job_id)
+    assert (job["status"], job["attempts"]) == ("failed", 2)
+
+def test_expired_lease_is_claimed_again(db_connection, worker):
+    job_id = enqueue("test_succeeds", {"value": 1})
+
+    assert claim_job(db_connection, lease_seconds=0)["job_id"] == job_id
+    db_connection.commit()
+    assert asyncio.run(worker.run_once()) is True
+    assert select_job(db_connection, job_id)["attempts"] == 2
+
+def test_expired_lease_of_last_attempt_fails_the_job(db_connection, worker, mocker):
+    mocker.patch("tasks.queue.JOB_MAX_ATTEMPTS", 1)
+    job_id = enqueue("test_succeeds", {"value": 1})
+
+    assert claim_job(db_connection, lease_seconds=0)["job_id"] == job_id
+    db_connection.commit()
+    assert asyncio.run(worker.run_once()) is False
+    job = select_job(db_connection, job_id)
+    assert (job["status"], job["attempts"], job["last_error"]) == ("failed", 1, "Lease expired")
+
+def test_worker_is_woken_after_the_job_commits(db_connection, test_pool, mocker):
+    mocker.patch("search.indexer.SEARCH_ENABLED", True)
+    mocker.patch("views.document.upsert_document", return_value = None)
+    visible = []
+
+    def wake():
+        with db_connection.cursor() as cur:
+            cur.execute("SELECT count(*) FROM jobs WHERE kind = 'extract_document_text'")
+            visible.append(cur.fetchone()["count"])
+        db_connection.rollback()
+
+    mocker.patch("views.document.job_worker.wake", side_effect = wake)
+    asyncio.run(index_document(1, "a.pdf", {"key": "1/a.pdf", "size": 1, "etag": "e1"}, "application/pdf"))
+
+    assert visible == [1]
+
+def test_retry_delay_grows_and_is_capped(mocker):
+    mocker.patch("tasks.queue.JOB_RETRY_BACKOFF_SECONDS", 5)
+    mocker.patch("tasks.queue.JOB_RETRY_BACKOFF_MAX_SECONDS", 60)
+
+    assert 2.5 <= retry_delay(1) <= 5
+    assert 10 <= retry_delay(3) <= 20
+    assert 30 <= retry_delay(10) <= 60
+
+def test_enqueue_unknown_kind(test_pool):
+    with pytest.raises(ValueError):
+        enqueue("unknown", {})
+
+def test_get_job(client, test_pool, secrets):
+    job_id = enqueue("test_succeeds", {"value": 1})
+
+    response = client.get(f"/jobs/{job_id}", headers = {"Authorization": f"Bearer {create_test_token(secrets, 'mike')}"})
+    assert response.status_code == 200
+    assert (response.json()["status"], response.json()["kind"]) == ("queued", "test_succeeds")
+
+    response = client.get(f"/jobs/{job_id}", headers = {"Authorization": f"Bearer {create_test_token(secrets, 'other')}"})
+    assert response.status_code == 404
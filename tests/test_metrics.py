@@ -0,0 +1,109 @@
+import pytest
+
+import asyncio
+
+from db.db import get_db, instrumented, select_document_names
+from observability.metrics import Registry, Counter, Gauge, Histogram, DB_QUERY_SECONDS, HTTP_RESPONSE_BYTES, S3_REQUEST_SECONDS, MetricsMiddleware, instrument_s3_client
+from tests.fake_s3 import client_error
+from tests.test_project import create_test_token
+
+
+def test_registry_render():
+    registry = Registry()
+    requests = Counter("requests_total", "Requests.", ("method",), registry=registry)
+    Gauge("queue_depth", "Depth.", ("queue",), callback=lambda: {("jobs",): 3}, registry=registry)
+    latency = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1), registry=registry)
+
+    requests.labels('GE"T').inc(2)
+    for value in (0.05, 0.1, 5):
+        latency.observe(value)
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{method="GE\\"T"} 2',
+        "# HELP queue_depth Depth.",
+        "# TYPE queue_depth gauge",
+        'queue_depth{queue="jobs"} 3',
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.15",
+        "latency_seconds_count 3",
+    ]
+    with pytest.raises(ValueError):
+        requests.labels()
+    with pytest.raises(ValueError):
+        Counter("requests_total", "Again.", registry=registry)
+
+def test_metrics_endpoint(client, mocker, fake_s3, secrets):
+    mocker.patch("db.context.check_permission", return_value = "participant")
+    headers = {"Authorization": f"Bearer {create_test_token(secrets, 'mike')}"}
+    client.get("/projects/5/documents/missing.pdf", headers = headers)
+    client.get("/no/such/path")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'http_request_duration_seconds_count{method="GET",route="/projects/{project_id}/documents/{document_id}",status="404"}' in response.text
+    assert 'route="unmatched"' in response.text
+    assert 'db_pool_connections{state="idle"}' in response.text
+
+def test_db_query_duration_by_function(db_connection, test_pool):
+    before = DB_QUERY_SECONDS.labels("select_document_names").get()[0]
+
+    with get_db() as conn:
+        select_document_names(conn, 1)
+
+    assert sum(DB_QUERY_SECONDS.labels("select_document_names").get()[0]) == sum(before) + 1
+
+def test_db_query_duration_of_nested_statements(db_connection, test_pool):
+    @instrumented
+    def select_numbers(conn):
+        def select(number):
+            with conn.cursor() as cur:
+                cur.execute("SELECT %s AS number", (number,))
+                return cur.fetchone()["number"]
+        return [select(number) for number in range(2)]
+
+    with get_db() as conn:
+        other = sum(DB_QUERY_SECONDS.labels("other").get()[0])
+        assert select_numbers(conn) == [0, 1]
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+
+    assert sum(DB_QUERY_SECONDS.labels("select_numbers").get()[0]) == 2
+    assert sum(DB_QUERY_SECONDS.labels("other").get()[0]) == other + 1
+
+def test_instrument_s3_client():
+    class Client:
+        async def _make_api_call(self, operation_name, api_params):
+            if api_params["Key"] == "missing":
+                raise client_error("NoSuchKey", 404, operation_name)
+            return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+    client = Client()
+    instrument_s3_client(client)
+    asyncio.run(client._make_api_call("HeadObject", {"Key": "found"}))
+    with pytest.raises(Exception):
+        asyncio.run(client._make_api_call("HeadObject", {"Key": "missing"}))
+
+    assert sum(S3_REQUEST_SECONDS.labels("HeadObject", "200").get()[0]) >= 1
+    assert sum(S3_REQUEST_SECONDS.labels("HeadObject", "404").get()[0]) >= 1
+
+def test_middleware_counts_pathsend_without_the_file():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-length", b"12")]})
+        # The file was removed after the response started
+        await send({"type": "http.response.pathsend", "path": "/nonexistent/cached-document"})
+
+    async def send(message):
+        pass
+
+    sent = HTTP_RESPONSE_BYTES.labels("unmatched")
+    before = sent.get()
+    asyncio.run(MetricsMiddleware(app)({"type": "http", "method": "GET"}, None, send))
+    assert sent.get() - before == 12
@@ -0,0 +1,40 @@
+import pytest
+
+from psycopg2.errors import UniqueViolation
+
+from db.migrations import load_migrations, migrate, applied_versions
+
+
+def test_load_migrations_sorted(tmp_path):
+    (tmp_path / "0010_second.sql").write_text("SELECT 1;")
+    (tmp_path / "0002_first.sql").write_text("SELECT 1;")
+    (tmp_path / "notes.txt").write_text("")
+
+    migrations = load_migrations(tmp_path)
+
+    assert [(version, name) for version, name, path in migrations] == [(2, "first"), (10, "second")]
+
+def test_load_migrations_duplicated_version(tmp_path):
+    (tmp_path / "0001_first.sql").write_text("SELECT 1;")
+    (tmp_path / "001_other.sql").write_text("SELECT 1;")
+
+    with pytest.raises(ValueError):
+        load_migrations(tmp_path)
+
+def test_migrate_is_idempotent(db_connection):
+    assert migrate(db_connection) == []
+
+    versions = applied_versions(db_connection)
+    assert {version for version, name, path in load_migrations()} <= versions
+
+def test_user_project_rejects_duplicates(db_connection):
+    with db_connection.cursor() as cur:
+        cur.execute("INSERT INTO users VALUES ('mike', 'wazowski')")
+        cur.execute("INSERT INTO projects (name, created_at, modified_at) VALUES ('Cars', now(), now()) RETURNING project_id")
+        project_id = cur.fetchone()["project_id"]
+        cur.execute("INSERT INTO user_project VALUES ('mike', %s, 'owner')", (project_id,))
+        db_connection.commit()
+
+        with pytest.raises(UniqueViolation):
+            cur.execute("INSERT INTO user_project VALUES ('mike', %s, 'participant')", (project_id,))
+    db_connection.rollback()
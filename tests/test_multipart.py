@@ -0,0 +1,77 @@
+import pytest
+
+import asyncio
+from io import BytesIO
+
+from botocore.exceptions import ClientError
+from starlette.datastructures import UploadFile
+
+from storage.multipart import upload_stream
+from tests.fake_s3 import FakeS3Client, client_error
+
+BUCKET = "bucket"
+PART_SIZE = 5 * 1024 * 1024
+
+
+def make_file(size: int) -> UploadFile:
+    data = (bytes(range(251)) * (size // 251 + 1))[:size]
+    return UploadFile(BytesIO(data), size=size, filename="file.pdf")
+
+
+def test_small_file_single_put():
+    s3 = FakeS3Client()
+    result = asyncio.run(upload_stream(s3, BUCKET, "1/file.pdf", make_file(1024), "application/pdf"))
+
+    assert result["size"] == 1024
+    assert s3.objects[(BUCKET, "1/file.pdf")]["ContentType"] == "application/pdf"
+    assert s3.calls_of("create_multipart_upload") == []
+
+def test_large_file_multipart():
+    s3 = FakeS3Client()
+    size = PART_SIZE * 3 + 100
+    file = make_file(size)
+
+    result = asyncio.run(upload_stream(s3, BUCKET, "1/file.pdf", file, part_size=PART_SIZE, concurrency=2))
+
+    file.file.seek(0)
+    assert s3.objects[(BUCKET, "1/file.pdf")]["Body"] == file.file.read()
+    assert result["size"] == size
+    assert result["etag"].endswith('-4"')
+    assert len(s3.calls_of("upload_part")) == 4
+
+def test_multipart_concurrency_is_bounded():
+    s3 = FakeS3Client()
+    in_flight = 0
+    max_in_flight = 0
+    upload_part = s3.upload_part
+
+    async def slow_upload_part(**kwargs):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return await upload_part(**kwargs)
+
+    s3.upload_part = slow_upload_part
+    asyncio.run(upload_stream(s3, BUCKET, "1/file.pdf", make_file(PART_SIZE * 6), part_size=PART_SIZE, concurrency=2))
+
+    assert max_in_flight == 2
+
+def test_failed_multipart_is_aborted():
+    s3 = FakeS3Client()
+    upload_part = s3.upload_part
+
+    async def failing_upload_part(**kwargs):
+        if kwargs["PartNumber"] == 2:
+            raise client_error("InternalError", 500, "UploadPart")
+        return await upload_part(**kwargs)
+
+    s3.upload_part = failing_upload_part
+
+    with pytest.raises(ClientError):
+        asyncio.run(upload_stream(s3, BUCKET, "1/file.pdf", make_file(PART_SIZE * 4), part_size=PART_SIZE, concurrency=1))
+
+    assert len(s3.calls_of("abort_multipart_upload")) == 1
+    assert s3.multipart_uploads == {}
+    assert (BUCKET, "1/file.pdf") not in s3.objects
@@ -0,0 +1,75 @@
+import pytest
+
+from psycopg2.extras import RealDictCursor
+
+from db.pool import ConnectionPool, PoolTimeout, PoolClosed
+from tests.conftest import DB_CONFIG
+
+
+@pytest.fixture
+def pool():
+    pool = ConnectionPool(min_size=1, max_size=2, timeout=0.2, **DB_CONFIG, cursor_factory=RealDictCursor)
+    pool.open()
+    yield pool
+    pool.close()
+
+
+def test_pool_reuses_connections(pool):
+    conn = pool.getconn()
+    pool.putconn(conn)
+
+    assert pool.getconn() is conn
+    assert pool.stats()["connections_created"] == 1
+
+def test_pool_timeout(pool):
+    first = pool.getconn()
+    second = pool.getconn()
+
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+
+    stats = pool.stats()
+    assert stats["in_use"] == 2
+    assert stats["timeouts"] == 1
+
+    pool.putconn(first)
+    pool.putconn(second)
+    assert pool.stats()["idle"] == 2
+
+def test_pool_discards_broken_connection(pool):
+    conn = pool.getconn()
+    conn.close()
+    pool.putconn(conn)
+
+    new_conn = pool.getconn()
+    assert new_conn is not conn
+    assert not new_conn.closed
+    assert pool.stats()["connections_discarded"] == 1
+
+def test_pool_health_check_on_checkout(pool):
+    pool.health_check_after = 0
+    conn = pool.getconn()
+    killer = pool.getconn()
+    with killer.cursor() as cur:
+        cur.execute("SELECT pg_terminate_backend(%s)", (conn.get_backend_pid(),))
+    pool.putconn(killer)
+    pool.putconn(conn)
+
+    checked = pool.getconn()
+    assert checked is not conn
+    assert pool.stats()["health_checks_failed"] == 1
+    pool.putconn(checked)
+
+def test_pool_rolls_back_returned_transaction(pool):
+    conn = pool.getconn()
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1")
+    pool.putconn(conn)
+
+    assert conn.info.transaction_status == 0
+
+def test_pool_closed(pool):
+    pool.close()
+
+    with pytest.raises(PoolClosed):
+        pool.getconn()
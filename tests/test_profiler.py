@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+from observability.profiler import RequestProfile, RequestProfiler, record_span
+
+
+def test_slow_request_is_sampled_and_kept():
+    profiler = RequestProfiler(interval=0.001, buffer_size=2, slow_seconds=0.1)
+
+    async def request(duration):
+        profile = RequestProfile("GET", "/projects/1")
+        token = profiler.begin(profile)
+        record_span("db", 0.01, "check_permission")
+        await asyncio.sleep(duration / 2)
+        deadline = time.perf_counter() + duration / 2
+        while time.perf_counter() < deadline:
+            pass
+        return profiler.end(profile, token, "/projects/{project_id}", 200)
+
+    profiler.start()
+    try:
+        fast = asyncio.run(request(0.01))
+        slow = asyncio.run(request(0.3))
+    finally:
+        profiler.stop()
+
+    assert fast is None
+    assert slow["reason"] == "slow"
+    assert slow["time_split"]["db"] == {"seconds": 0.01, "calls": 1}
+    assert slow["time_by_call"] == {"db:check_permission": 0.01}
+    stacks = list(slow["samples"])
+    assert any(stack.endswith("[running]") and "request" in stack for stack in stacks)
+    assert any("[waiting for" in stack for stack in stacks)
+    assert [profile["profile_id"] for profile in profiler.summaries()] == [slow["profile_id"]]
+    assert "samples" not in profiler.summaries()[0]
+
+def test_requested_profile_download(client, mocker):
+    mocker.patch("observability.profiler.ADMIN_TOKEN", "secret")
+    mocker.patch("views.admin.ADMIN_TOKEN", "secret")
+
+    response = client.get("/metrics", headers = {"X-Profile-Token": "secret"})
+    profile_id = response.headers["X-Profile-Id"]
+    assert "X-Profile-Id" not in client.get("/metrics", headers = {"X-Profile-Token": "wrong"}).headers
+
+    response = client.get("/admin/profiles", headers = {"X-Admin-Token": "secret"})
+    assert response.json()["profiles"][0]["profile_id"] == profile_id
+    assert response.json()["profiles"][0]["reason"] == "requested"
+
+    response = client.get(f"/admin/profiles/{profile_id}?format=collapsed", headers = {"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+    assert client.get(f"/admin/profiles/{profile_id}", headers = {"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/admin/profiles/unknown", headers = {"X-Admin-Token": "secret"}).status_code == 404
+    mocker.patch("views.admin.ADMIN_TOKEN", None)
+    assert client.get("/admin/profiles", headers = {"X-Admin-Token": "secret"}).status_code == 404
@@ -1,11 +1,18 @@
 import pytest
 
+import asyncio
+import time
+from contextlib import asynccontextmanager
 from io import BytesIO
 from datetime import datetime, timedelta
 import jwt
+from psycopg2.errors import QueryCanceled
 
+from db.db import upsert_document, delete_document
 from db.models import Permission
+from views.project import get_documents_lists
 from tests.test_data import user_project_test_data
+from tests.test_db import create_user_in_db, create_project_in_db, create_relation_in_db
 
 
 def create_test_token(secrets, subject, expiration_minutes = None):
@@ -55,7 +62,7 @@ def test_get_all_projects(client, mocker, secrets, user_owner, user_participant)
                 "name": user_owner["name"], 
                 "description": user_owner["description"]
             }})
-    mocker.patch("views.project.get_s3_documents_list", return_value = ["file.pdf"])
+    mocker.patch("views.project.select_document_names_by_project", return_value = {"project_id": ["file.pdf"]})
 
     token = create_test_token(secrets, user_owner["user_id"])
 
@@ -68,6 +75,65 @@ def test_get_all_projects(client, mocker, secrets, user_owner, user_participant)
     assert isinstance(response.json(), dict)
     assert 0 < len(response.json()) < 2
 
+@pytest.mark.parametrize("user_owner, user_participant", user_project_test_data)
+def test_get_all_projects_pagination(client, mocker, secrets, user_owner, user_participant):
+    select_project_info = mocker.patch(
+        "views.project.select_project_info",
+        return_value = {project_id: {"name": user_owner["name"]} for project_id in (11, 12, 13)})
+    mocker.patch("views.project.select_document_names_by_project", side_effect = lambda conn, ids, timeout: {i: [] for i in ids})
+    token = create_test_token(secrets, user_owner["user_id"])
+
+    response = client.get(
+        "/projects?limit=2&after=10&order=desc",
+        headers = {"Authorization": f"Bearer {token}"}
+    )
+
+    assert response.status_code == 200
+    assert list(response.json()) == ["11", "12"]
+    assert response.headers["X-Next-Cursor"] == "12"
+    assert select_project_info.call_args.kwargs == {"limit": 3, "after": 10, "order": "desc"}
+
+def test_get_all_projects_documents_fan_out(client, mocker, secrets):
+    mocker.patch("views.project.select_project_info", side_effect = lambda *args, **kwargs: {project_id: {"name": "p"} for project_id in range(1, 6)})
+    mocker.patch("views.project.DOCUMENT_LISTING_BATCH_SIZE", 2)
+
+    def select_document_names_by_project(conn, project_ids, timeout):
+        if 3 in project_ids:
+            raise QueryCanceled("canceling statement due to statement timeout")
+        return {project_id: [f"{project_id}.pdf"] for project_id in project_ids}
+
+    select_documents = mocker.patch("views.project.select_document_names_by_project", side_effect = select_document_names_by_project)
+    headers = {"Authorization": f"Bearer {create_test_token(secrets, 'mike')}"}
+
+    response = client.get("/projects", headers = headers)
+
+    assert response.status_code == 200
+    assert sorted(call.args[1] for call in select_documents.call_args_list) == [[1, 2], [3, 4], [5]]
+    assert response.json()["1"]["documents"] == ["1.pdf"]
+    assert response.json()["4"] == {"name": "p", "documents": None, "documents_error": "timeout"}
+    assert response.json()["5"]["documents"] == ["5.pdf"]
+
+    select_documents.reset_mock()
+    response = client.get("/projects?include=", headers = headers)
+
+    assert response.status_code == 200
+    assert response.json()["1"] == {"name": "p"}
+    assert select_documents.call_count == 0
+
+def test_get_documents_lists_times_out_waiting_for_connection(mocker):
+    mocker.patch("views.project.DOCUMENT_LISTING_TIMEOUT_SECONDS", 0.05)
+
+    @asynccontextmanager
+    async def busy_pool():
+        await asyncio.sleep(1)
+        yield None
+
+    mocker.patch("views.project.get_async_db", busy_pool)
+
+    started = time.perf_counter()
+    assert asyncio.run(get_documents_lists([1])) == {1: {"documents": None, "documents_error": "timeout"}}
+    assert time.perf_counter() - started < 0.5
+
 @pytest.mark.parametrize("user_owner, user_participant", user_project_test_data)
 def test_get_project(client, mocker, secrets, user_owner, user_participant):
     project = {
@@ -79,8 +145,8 @@ def test_get_project(client, mocker, secrets, user_owner, user_participant):
             "documents": ["doc.pdf"]
             }
     mocker.patch("views.project.select_project_info", return_value = project)    
-    mocker.patch("views.project.check_permission", return_value = "owner")
-    mocker.patch("views.project.get_s3_documents_list", return_value = ["doc.pdf"])
+    mocker.patch("db.context.check_permission", return_value = "owner")
+    mocker.patch("views.project.select_document_names", return_value = ["doc.pdf"])
     token = create_test_token(secrets=secrets, subject=user_owner["user_id"])
 
     response = client.get(
@@ -93,6 +159,52 @@ def test_get_project(client, mocker, secrets, user_owner, user_participant):
     assert response_project == project
 
 
+def test_get_project_conditional(client, mocker, secrets):
+    version = {"modified_at": datetime(2024, 5, 1, 12), "documents": 1, "listing_digest": "abc", "documents_modified_at": None}
+    mocker.patch("views.project.select_project_version", return_value = version)
+    select_project_info = mocker.patch("views.project.select_project_info", return_value = {
+        "project_id": 121, "name": "Project", "description": "", "created_at": "", "modified_at": "",
+    })
+    mocker.patch("views.project.select_document_names", return_value = ["doc.pdf"])
+    mocker.patch("db.context.check_permission", return_value = "owner")
+    headers = {"Authorization": f"Bearer {create_test_token(secrets, 'mike')}"}
+
+    response = client.get("/projects/121", headers = headers)
+    etag, last_modified = response.headers["ETag"], response.headers["Last-Modified"]
+    assert etag.startswith('W/"')
+
+    response = client.get("/projects/121", headers = {**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    response = client.get("/projects/121", headers = {**headers, "If-Modified-Since": last_modified})
+    assert response.status_code == 304
+    assert select_project_info.call_count == 1
+
+    version["listing_digest"] = "changed"
+    response = client.get("/projects/121", headers = {**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+def test_get_project_modified_since_document_deleted(client, db_connection, test_pool, secrets):
+    with db_connection.cursor() as cur:
+        create_user_in_db(cur, "mike", "password")
+        project_id = create_project_in_db(cur, name="Project", description="").project_id
+        create_relation_in_db(cur, "mike", project_id, "owner")
+        for name in ("a.pdf", "b.pdf"):
+            upsert_document(db_connection, project_id, name, f"{project_id}/{name}", 1, None, name)
+        cur.execute("UPDATE projects SET modified_at = '2024-05-01 12:00:00' WHERE project_id = %s", (project_id,))
+        cur.execute("UPDATE documents SET modified_at = '2024-05-01 12:00:00' WHERE project_id = %s", (project_id,))
+    db_connection.commit()
+    headers = {"Authorization": f"Bearer {create_test_token(secrets, 'mike')}"}
+    last_modified = client.get(f"/projects/{project_id}", headers = headers).headers["Last-Modified"]
+
+    assert delete_document(db_connection, project_id, "a.pdf") is True
+    db_connection.commit()
+    response = client.get(f"/projects/{project_id}", headers = {**headers, "If-Modified-Since": last_modified})
+
+    assert response.status_code == 200
+    assert response.headers["Last-Modified"] != last_modified
+    assert response.json()[str(project_id)]["documents"] == ["b.pdf"]
+
 @pytest.mark.parametrize("user_owner, user_participant", user_project_test_data)
 def test_update_projects_details(client, mocker, user_owner, user_participant, secrets):
     project_id = 121
@@ -116,9 +228,10 @@ def test_update_projects_details(client, mocker, user_owner, user_participant, s
 @pytest.mark.parametrize("user_owner, user_participant", user_project_test_data)
 def test_remove_project(client, mocker, secrets, user_owner, user_participant):
     token = create_test_token(secrets=secrets, subject=user_owner["user_id"])
-    mocker.patch("views.project.delete_project", return_value = None)
-    mocker.patch("views.project.delete_s3_folder", return_value = None)
-    mocker.patch("views.project.check_permission", return_value = "owner")
+    delete_project = mocker.patch("views.project.delete_project", return_value = None)
+    enqueue_job = mocker.patch("views.project.enqueue_job", return_value = 7)
+    wake = mocker.patch("views.project.job_worker.wake")
+    check_permission = mocker.patch("db.context.check_permission", return_value = "owner")
     
     project_id = 111
 
@@ -128,12 +241,18 @@ def test_remove_project(client, mocker, secrets, user_owner, user_participant):
     )
 
     assert response is not None
-    assert response.status_code == 204
+    assert response.status_code == 202
+    assert response.json()["job_id"] == 7
+    assert response.headers["Location"] == "/jobs/7"
+    assert enqueue_job.call_args.args[1:] == ("delete_project_objects", {"project_id": project_id})
+    assert wake.call_count == 1
+    assert check_permission.await_count == 1
+    assert delete_project.call_args.kwargs == {"permission": "owner"}
 
 @pytest.mark.parametrize("user_owner, user_participant", user_project_test_data)
 def test_get_project_documents_success(client, mocker, secrets, user_owner, user_participant):
-    mocker.patch("views.project.check_permission", return_value = "owner")
-    mocker.patch("views.project.get_s3_documents_list", return_value = ["test_file.pdf"])
+    mocker.patch("db.context.check_permission", return_value = "owner")
+    mocker.patch("views.project.select_document_names", return_value = ["test_file.pdf"])
     token = create_test_token(secrets=secrets, subject=user_owner["user_id"])
     project_id = 111
 
@@ -148,7 +267,7 @@ def test_get_project_documents_success(client, mocker, secrets, user_owner, user
 
 @pytest.mark.parametrize("user_owner, user_participant", user_project_test_data)
 def test_get_project_documents_fail(client, mocker, secrets, user_owner, user_participant):
-    mocker.patch("views.project.check_permission", return_value = None)
+    mocker.patch("db.context.check_permission", return_value = None)
     token = create_test_token(secrets=secrets, subject=user_owner["user_id"])
     project_id = 111
 
@@ -162,27 +281,48 @@ def test_get_project_documents_fail(client, mocker, secrets, user_owner, user_pa
     assert response.json()['detail'] == "Unauthorized"
 
 
-@pytest.mark.parametrize("user_owner, user_participant", user_project_test_data)
-def test_upload_project_documents_success(client, mocker, secrets, user_owner, user_participant):
-    mocker.patch("views.project.check_permission", return_value = None)  
-    mocker.patch("views.project.upload_s3_file", return_value = None)
-    token = create_test_token(secrets=secrets, subject=user_owner["user_id"])
-    upload_files = ["test_file.pdf", "test_image.png"]
-    project_id = 111
+def test_upload_project_documents_results(client, mocker, secrets):
+    mocker.patch("db.context.check_permission", return_value = "owner")
+    mocker.patch("views.project.UPLOAD_CONCURRENCY", 1)
 
-    response = client.post(
-        f"/projects/{project_id}/documents",
-        headers = {"Authorization": f"Bearer {token}"},
-        json = upload_files
-    )
+    async def upload_s3_file(file, project_id):
+        if file.filename == "broken.pdf":
+            raise RuntimeError("S3 is down")
+        return {"key": f"{project_id}/{file.filename}", "size": 7, "etag": '"etag"'}
+
+    mocker.patch("views.project.upload_s3_file", side_effect = upload_s3_file)
+    token = create_test_token(secrets, "mike")
+    files = [("files", (name, BytesIO(b"content"), "application/pdf")) for name in ("a.pdf", "broken.pdf", "c.pdf")]
+
+    response = client.post("/projects/111/documents", headers = {"Authorization": f"Bearer {token}"}, files = files)
+
+    assert response.status_code == 207
+    body = response.json()
+    assert (body["uploaded"], body["failed"], body["skipped"]) == (1, 1, 1)
+    assert [result["status"] for result in body["results"]] == ["uploaded", "failed", "skipped"]
+    assert body["results"][0]["key"] == "111/a.pdf"
+    assert body["results"][1]["error"] == "S3 is down"
+
+    files = [("files", (name, BytesIO(b"content"), "application/pdf")) for name in ("a.pdf", "broken.pdf", "c.pdf")]
+    response = client.post("/projects/111/documents?continue_on_error=true", headers = {"Authorization": f"Bearer {token}"}, files = files)
+
+    assert [result["status"] for result in response.json()["results"]] == ["uploaded", "failed", "uploaded"]
+
+    files = [("files", (name, BytesIO(b"content"), "application/pdf")) for name in ("broken.pdf", "c.pdf")]
+    response = client.post("/projects/111/documents", headers = {"Authorization": f"Bearer {token}"}, files = files)
+
+    assert response.status_code == 500
+    assert [result["status"] for result in response.json()["results"]] == ["failed", "skipped"]
+
+    files = [("files", ("a.pdf", BytesIO(b"content"), "application/pdf"))]
+    response = client.post("/projects/111/documents", headers = {"Authorization": f"Bearer {token}"}, files = files)
 
-    assert response is not None
     assert response.status_code == 200
-    assert response.json() == f"Files uploaded successfully: {upload_files}"
+    assert response.json()["results"][0]["etag"] == '"etag"'
 
 @pytest.mark.parametrize("user_owner, user_participant", user_project_test_data)
 def test_upload_project_documents_success(client, mocker, secrets, user_owner, user_participant):
-    mocker.patch("views.project.check_permission", return_value = None)
+    mocker.patch("db.context.check_permission", return_value = None)
     token = create_test_token(secrets=secrets, subject=user_owner["user_id"])
     project_id = 111
     files = {"files": ("test.pdf", BytesIO(b"file_content"), "text/plain")}
@@ -211,7 +351,7 @@ def test_upload_project_documents_success(client, mocker, secrets, user_owner, u
 
 @pytest.mark.parametrize("user_owner, user_participant", user_project_test_data)
 def test_invite_user_success(db_connection, client, mocker, user_owner, secrets, user_participant):
-    mocker.patch("views.project.check_permission", return_value = Permission.owner.value)
+    mocker.patch("db.context.check_permission", return_value = Permission.owner.value)
     mocker.patch("views.project.select_user", return_value = "user")
     mocker.patch("views.project.insert_permission", return_value = None)
 
@@ -231,7 +371,7 @@ def test_invite_user_success(db_connection, client, mocker, user_owner, secrets,
 
 @pytest.mark.parametrize("user_owner, user_participant", user_project_test_data)
 def test_invite_user_fail(client, mocker, user_owner, secrets, user_participant):
-    mocker.patch("views.project.check_permission", return_value = Permission.participant.value)
+    mocker.patch("db.context.check_permission", return_value = Permission.participant.value)
     mocker.patch("views.project.select_user", return_value = "user")
     mocker.patch("views.project.insert_permission", return_value = None)
     project_id = 101
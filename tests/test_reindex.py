@@ -0,0 +1,29 @@
+import asyncio
+
+from db.db import select_documents, upsert_document, insert_blob
+from storage.reindex import reconcile_project
+from storage.s3 import BUCKET_NAME
+from tests.test_db import create_project_in_db
+
+
+def test_reconcile_project(db_connection, fake_s3):
+    with db_connection.cursor() as cur:
+        project_id = create_project_in_db(cur, name="Reindexed", description="").project_id
+
+    unchanged = fake_s3.store(BUCKET_NAME, f"{project_id}/same.pdf", b"same", "application/pdf")["ETag"]
+    fake_s3.store(BUCKET_NAME, f"{project_id}/changed.pdf", b"new content", "application/pdf")
+    fake_s3.store(BUCKET_NAME, f"{project_id}/new.png", b"png", "image/png")
+    upsert_document(db_connection, project_id, "same.pdf", f"{project_id}/same.pdf", 4, "application/pdf", unchanged)
+    upsert_document(db_connection, project_id, "changed.pdf", f"{project_id}/changed.pdf", 3, "application/pdf", '"old"')
+    upsert_document(db_connection, project_id, "gone.pdf", f"{project_id}/gone.pdf", 3, "application/pdf", '"gone"')
+    insert_blob(db_connection, "digest", "_blobs/digest", 5, '"blob"')
+    upsert_document(db_connection, project_id, "shared.pdf", "_blobs/digest", 5, "application/pdf", '"blob"', "digest")
+
+    counts = asyncio.run(reconcile_project(fake_s3, db_connection, project_id))
+
+    assert counts == {"added": 1, "updated": 1, "removed": 1, "unchanged": 1}
+    documents = {row["name"]: row for row in select_documents(db_connection, project_id)}
+    assert list(documents) == ["changed.pdf", "new.png", "same.pdf", "shared.pdf"]
+    assert documents["new.png"]["content_type"] == "image/png"
+    assert documents["changed.pdf"]["size"] == 11
+    assert [call["Key"] for call in fake_s3.calls_of("head_object")] == [f"{project_id}/changed.pdf", f"{project_id}/new.png"]
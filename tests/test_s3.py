@@ -0,0 +1,17 @@
+import asyncio
+
+from storage import s3
+
+
+def test_shared_s3_client():
+    async def scenario():
+        first = await s3.get_s3_client()
+        second = await s3.get_s3_client()
+        await s3.close_s3_client()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert first is second
+    assert first.meta.config.max_pool_connections == s3.S3_CONFIG.max_pool_connections
+    assert s3._client is None
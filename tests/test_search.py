@@ -0,0 +1,78 @@
+import pytest
+
+import asyncio
+
+from db.db import upsert_document, search_documents, select_document_text_etag
+from search.extract import ExtractionError, extract_text, extract_text_in_pool, shutdown_extraction_pool
+from search.indexer import extract_document_text
+from storage.s3 import BUCKET_NAME
+from tests.sample_documents import make_docx, make_pdf
+from tests.test_db import create_user_in_db, create_project_in_db, create_relation_in_db
+from tests.test_project import create_test_token
+
+
+def test_extract_text(mocker):
+    assert extract_text("Spec.DOCX", make_docx("Quarterly  report", "budget")) == "Quarterly report budget"
+    assert extract_text("spec.pdf", make_pdf("Hello invoice")) == "Hello invoice"
+    assert extract_text("notes.txt", b"line\x00one\n\nline two") == "line one line two"
+    assert extract_text("scan.png", b"\x89PNG") == ""
+
+    mocker.patch("search.extract.SEARCH_MAX_TEXT_CHARS", 4)
+    assert extract_text("notes.txt", b"truncated") == "trun"
+
+    with pytest.raises(ExtractionError):
+        extract_text("broken.docx", b"not a zip")
+
+def test_extract_text_in_pool():
+    try:
+        assert asyncio.run(extract_text_in_pool("spec.docx", make_docx("pooled"))) == "pooled"
+        with pytest.raises(ExtractionError):
+            asyncio.run(extract_text_in_pool("broken.pdf", b"%PDF-broken"))
+    finally:
+        shutdown_extraction_pool()
+
+def test_extract_document_text(db_connection, test_pool, fake_s3, mocker):
+    async def extract_in_process(filename, data):
+        return extract_text(filename, data)
+    mocker.patch("search.indexer.extract_text_in_pool", side_effect = extract_in_process)
+
+    with db_connection.cursor() as cur:
+        create_user_in_db(cur, "reader", "password")
+        create_user_in_db(cur, "outsider", "password")
+        project_id = create_project_in_db(cur, name="Reports", description="").project_id
+        create_relation_in_db(cur, "reader", project_id, "participant")
+    etag = fake_s3.store(BUCKET_NAME, f"{project_id}/q3_report.docx", make_docx("Revenue grew in the northern region"))["ETag"]
+    upsert_document(db_connection, project_id, "q3_report.docx", f"{project_id}/q3_report.docx", 100, None, etag)
+    upsert_document(db_connection, project_id, "revenue.png", f"{project_id}/revenue.png", 100, None, '"png"')
+    db_connection.commit()
+    fake_s3.store(BUCKET_NAME, f"{project_id}/revenue.png", b"\x89PNG", etag='"png"')
+
+    payload = {"project_id": project_id, "name": "q3_report.docx", "etag": etag}
+    assert asyncio.run(extract_document_text(payload)) == {"indexed": True, "characters": 35}
+    assert asyncio.run(extract_document_text(payload)) == {"skipped": "already indexed"}
+    assert asyncio.run(extract_document_text({**payload, "etag": '"old"'})) == {"skipped": "document changed"}
+    asyncio.run(extract_document_text({"project_id": project_id, "name": "revenue.png", "etag": '"png"'}))
+    assert select_document_text_etag(db_connection, project_id, "q3_report.docx") == etag
+
+    results = search_documents(db_connection, "reader", "revenue")
+    # A match in the name ranks above a match in the text
+    assert [row["name"] for row in results] == ["revenue.png", "q3_report.docx"]
+    assert results[0]["project_name"] == "Reports"
+    assert [row["name"] for row in search_documents(db_connection, "reader", '"northern region" -southern')] == ["q3_report.docx"]
+    assert search_documents(db_connection, "reader", "revenue", offset=1)[0]["name"] == "q3_report.docx"
+    assert search_documents(db_connection, "outsider", "revenue") == []
+    db_connection.rollback()
+
+def test_search(client, mocker, secrets):
+    rows = [{"project_id": 1, "project_name": "Reports", "name": f"{i}.pdf", "rank": 0.5} for i in range(3)]
+    search_documents = mocker.patch("views.search.search_documents", return_value = rows)
+    headers = {"Authorization": f"Bearer {create_test_token(secrets, 'mike')}"}
+
+    response = client.get("/search?q=budget&limit=2&offset=4", headers = headers)
+
+    assert response.status_code == 200
+    assert [result["name"] for result in response.json()["results"]] == ["0.pdf", "1.pdf"]
+    assert response.headers["X-Next-Offset"] == "6"
+    assert search_documents.call_args.args[1:] == ("mike", "budget", "simple", 3, 4)
+
+    assert client.get("/search?q=", headers = headers).status_code == 422
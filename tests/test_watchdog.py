@@ -0,0 +1,33 @@
+import asyncio
+import logging
+import time
+
+from observability.watchdog import LoopWatchdog
+
+
+def block_the_loop(seconds):
+    time.sleep(seconds)
+
+def test_watchdog_reports_blocking_callback(caplog):
+    watchdog = LoopWatchdog(interval=0.01, threshold=0.05)
+
+    async def scenario():
+        watchdog.start()
+        await asyncio.sleep(0.05)
+        block_the_loop(0.3)
+        await asyncio.sleep(0.05)
+        await watchdog.stop()
+
+    with caplog.at_level(logging.WARNING, logger="observability.watchdog"):
+        asyncio.run(scenario())
+
+    blocked = [record for record in caplog.records if "Event loop blocked" in record.getMessage()]
+    assert len(blocked) == 1
+    assert "block_the_loop" in blocked[0].getMessage()
+
+    percentiles = watchdog.percentiles()
+    assert percentiles[1.0] >= 0.25
+    assert percentiles[0.5] < 0.05
+    stats = watchdog.stats()
+    assert stats["running"] is False
+    assert stats["max"] == round(percentiles[1.0], 6)
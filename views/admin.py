@@ -0,0 +1,43 @@
+from fastapi import HTTPException, APIRouter, Depends, Header, status
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from observability.profiler import ADMIN_TOKEN, is_admin_token, request_profiler
+
+router = APIRouter(prefix="/admin", tags=["Admin"], include_in_schema=False)
+
+def admin_required(x_admin_token: str | None = Header(None)) -> None:
+    """Checks the `X-Admin-Token` header against `ADMIN_TOKEN`.
+
+    Raises:
+        HTTPException 404: If `ADMIN_TOKEN` isn't set, the admin endpoints don't exist then.
+        HTTPException 403: If the token is missing or wrong.
+    """
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Not Found")
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status.HTTP_403_FORBIDDEN, "Forbidden")
+
+@router.get("/profiles", dependencies=[Depends(admin_required)])
+def get_profiles() -> JSONResponse:
+    """Lists kept request profiles without their stack samples, newest first."""
+    return JSONResponse({"profiles": request_profiler.summaries()}, status.HTTP_200_OK)
+
+@router.get("/profiles/{profile_id}", dependencies=[Depends(admin_required)])
+def get_profile(profile_id: str, format: str = "json"):
+    """Returns one request profile.
+
+    Args:
+        format (str): `json`, or `collapsed` for stack samples in the folded format
+            flame graph tools like speedscope and `flamegraph.pl` read.
+
+    Raises:
+        HTTPException 404: If the profile isn't kept any more.
+    """
+    profile = request_profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Profile not found")
+
+    if format == "collapsed":
+        lines = [f"{stack} {count}" for stack, count in profile["samples"].items()]
+        return PlainTextResponse("\n".join(lines) + "\n", headers={"Content-Disposition": f"attachment; filename=profile_{profile_id}.folded"})
+    return JSONResponse(profile, status.HTTP_200_OK, headers={"Content-Disposition": f"attachment; filename=profile_{profile_id}.json"})
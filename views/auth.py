@@ -7,6 +7,7 @@ from dotenv import load_dotenv
 from datetime import datetime, timedelta
 
 from db.db import select_user, get_db, insert_user, TokenResponse
+from db.context import RequestContext
 from db.models import *
 
 import jwt
@@ -57,6 +58,21 @@ def auth_requierd(credentials: HTTPAuthorizationCredentials = Depends(auth_schem
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Invalid token")
 
 
+async def request_context(user_payload: dict = Depends(auth_requierd)):
+    """Provides a `RequestContext` of the logged in user for the duration of a request.
+
+    The request's transaction is committed when the endpoint returns and rolled back if it raises.
+
+    Args:
+        user_payload (dict): Decoded JWT payload from `auth_requierd`.
+
+    Yields:
+        RequestContext: Shared connection and memoized permissions of the request.
+    """
+    async with RequestContext(user_payload["sub"]) as context:
+        yield context
+
+
 def create_token(user_id: dict, expire: timedelta = timedelta(minutes=TOKEN_EXPIRE_IN_MINUTES)) -> str:
     """Creates token for user session from it's user_id and encodes it by using choosen algorithm and secret key using JWT
 
@@ -1,51 +1,90 @@
-from fastapi import HTTPException, APIRouter, UploadFile, File, status, Path, Depends, Response
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import HTTPException, APIRouter, UploadFile, File, status, Path, Depends, Response, Request, Query
+from fastapi.responses import JSONResponse, StreamingResponse, RedirectResponse
 
 from dotenv import load_dotenv
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime, format_datetime
+import asyncio
 import os
+import re
+from typing import BinaryIO
 
-from views.auth import auth_requierd
-from db.db import check_permission, get_db
+from views.auth import request_context
+from db.context import RequestContext
+from db.models import PresignedUploadRequest, UploadConfirmation
+from db.aio import get_async_db, upsert_document, delete_document, select_document, select_documents
 
-import aioboto3
+from storage.s3 import BUCKET_NAME, get_s3_client
+from storage.multipart import upload_stream
+from storage.disk_cache import document_cache
+from storage.blobs import DEDUP_ENABLED, store_deduplicated
+from storage.archive import stream_zip
+from search.indexer import queue_text_extraction
+from tasks.queue import job_worker
 from botocore.exceptions import NoCredentialsError, ClientError
 
 router = APIRouter(tags=["Documents"])
 
 load_dotenv()
 
-BUCKET_NAME = os.getenv("BUCKET_NAME")
 ALLOWED_EXTENSIONS = os.getenv("ALLOWED_EXTENSIONS").split(",")
 
-session = aioboto3.Session()
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+PRESIGNED_URL_EXPIRES_SECONDS = int(os.getenv("S3_PRESIGNED_URL_EXPIRES_SECONDS", 300))
+PRESIGNED_UPLOAD_MAX_BYTES = int(os.getenv("S3_PRESIGNED_UPLOAD_MAX_BYTES", 5 * 1024 ** 3))
+SINGLE_RANGE_PATTERN = re.compile(r"bytes=(\d+-\d*|-\d+)")
+# Responses depend on the user's permissions and clients have to revalidate them
+PRIVATE_CACHE_CONTROL = "private, no-cache"
 
-async def delete_s3_folder(project_id: int) -> None:
-    prefix = f"{project_id}/"
-    async with session.resource("s3") as s3:
-        bucket = await s3.Bucket(BUCKET_NAME)
-        await bucket.objects.filter(Prefix=prefix).delete()
+async def delete_s3_folder(project_id: int) -> int:
+    """Deletes all objects under a project's prefix with batched multi-object deletes.
+
+    Returns:
+        int: Number of deleted objects.
 
-async def get_s3_documents_list(project_id: int) -> list:
+    Raises:
+        RuntimeError: If S3 failed to delete some objects.
+    """
     prefix = f"{project_id}/"
-    prefix_len = len(prefix)
-    result = []
-
-    async with session.resource("s3") as s3:
-        bucket = await s3.Bucket(BUCKET_NAME)
-        async for obj in bucket.objects.filter(Prefix=prefix):
-            result.append(obj.key[prefix_len:])
-    return result
-
-async def upload_s3_file(file: UploadFile, project_id: int):
-    async with session.resource("s3") as s3:
-        bucket = await s3.Bucket(BUCKET_NAME)
-        contents = await file.read()
-        key = f"{project_id}/{file.filename}"
-        await bucket.put_object(
-            Key=key,
-            Body=contents,
-            ContentType=file.content_type
-        )
+    deleted = 0
+    s3 = await get_s3_client()
+    paginator = s3.get_paginator("list_objects_v2")
+    # Pages hold up to 1000 keys, the most one `delete_objects` call accepts
+    async for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+        objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+        if objects:
+            response = await s3.delete_objects(Bucket=BUCKET_NAME, Delete={"Objects": objects, "Quiet": True})
+            if response.get("Errors"):
+                raise RuntimeError(f"Failed to delete {len(response['Errors'])} objects under {prefix}: {response['Errors'][0]}")
+            deleted += len(objects)
+    document_cache.invalidate(prefix=prefix)
+    return deleted
+
+async def index_document(project_id: int, name: str, uploaded: dict, content_type: str | None) -> None:
+    """Records an uploaded object in the documents index and queues extraction of its text."""
+    async with get_async_db() as conn:
+        await upsert_document(conn, int(project_id), name, uploaded["key"], uploaded["size"], content_type, uploaded["etag"])
+        await queue_text_extraction(conn, project_id, name, uploaded["etag"])
+    job_worker.wake()
+
+async def store_deduplicated_document(s3, project_id: int, file: UploadFile, name: str) -> dict:
+    """Stores a document as a reference to a blob and queues extraction of its text if its content changed."""
+    stored = await store_deduplicated(s3, BUCKET_NAME, project_id, name, file, file.content_type)
+    if stored["changed"]:
+        async with get_async_db() as conn:
+            await queue_text_extraction(conn, project_id, name, stored["etag"])
+        job_worker.wake()
+    return stored
+
+async def upload_s3_file(file: UploadFile, project_id: int) -> dict:
+    s3 = await get_s3_client()
+    if DEDUP_ENABLED:
+        return await store_deduplicated_document(s3, project_id, file, file.filename)
+
+    key = f"{project_id}/{file.filename}"
+    uploaded = await upload_stream(s3, BUCKET_NAME, key, file, file.content_type)
+    await index_document(project_id, file.filename, uploaded, file.content_type)
+    return uploaded
 
 async def check_file_extension(files: list[UploadFile]) -> bool:
     if not isinstance(files, list):
@@ -54,81 +93,496 @@ async def check_file_extension(files: list[UploadFile]) -> bool:
         )
 
     for file in files:
-        # Safely get extension with dot
-        parts = file.filename.lower().rsplit(".", 1)
-        if len(parts) != 2:
+        check_filename_extension(file.filename)
+
+    return True
+
+def check_filename_extension(filename: str) -> None:
+    # Safely get extension with dot
+    parts = filename.lower().rsplit(".", 1)
+    if len(parts) != 2:
+        raise HTTPException(
+            status.HTTP_406_NOT_ACCEPTABLE,
+            detail=f"File '{filename}' has no extension"
+        )
+    ext = "." + parts[1]
+
+    if ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status.HTTP_406_NOT_ACCEPTABLE,
+            detail=f"Only {', '.join(ALLOWED_EXTENSIONS)} files are allowed"
+        )
+
+def check_presigned_uploads_available() -> None:
+    # Deduplicated documents are stored under the hash of their content, which
+    # the API never reads when clients upload straight to S3
+    if DEDUP_ENABLED:
+        raise HTTPException(
+            status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Presigned uploads aren't available with deduplicated storage"
+        )
+
+def parse_range_request(range_header: str | None, if_range: str | None) -> dict:
+    """Translates `Range` and `If-Range` request headers to `get_object` arguments.
+
+    Only a single byte range is passed to S3, which doesn't support multiple ranges.
+    Other ranges are ignored and the whole object is sent, as RFC 9110 allows.
+    `If-Range` becomes a precondition of the ranged request, which S3 rejects
+    when the object has changed.
+
+    Args:
+        range_header (str, optional): Value of the `Range` header.
+        if_range (str, optional): Value of the `If-Range` header, ETag or HTTP date.
+
+    Returns:
+        dict: `Range` and optionally `IfMatch` or `IfUnmodifiedSince` arguments, empty for a full download.
+    """
+    if not range_header or not SINGLE_RANGE_PATTERN.fullmatch(range_header.strip()):
+        return {}
+
+    arguments = {"Range": range_header.strip()}
+    if if_range:
+        if_range = if_range.strip()
+        if if_range.startswith('"'):
+            arguments["IfMatch"] = if_range
+        else:
+            try:
+                arguments["IfUnmodifiedSince"] = parsedate_to_datetime(if_range)
+            except (TypeError, ValueError):
+                # Weak ETags and invalid dates never allow a partial response
+                return {}
+    return arguments
+
+def http_date(value: datetime) -> str:
+    """Formats a datetime as an HTTP date, a naive datetime is taken as local time."""
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+def validator_headers(etag: str | None, last_modified: datetime | None = None) -> dict:
+    """Returns `ETag`, `Last-Modified` and `Cache-Control` headers of a response clients may revalidate."""
+    headers = {"Cache-Control": PRIVATE_CACHE_CONTROL}
+    if etag is not None:
+        headers["ETag"] = etag
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+def is_not_modified(request: Request, etag: str | None, last_modified: datetime | None = None) -> bool:
+    """Evaluates `If-None-Match` and `If-Modified-Since` request headers against the current validators.
+
+    As RFC 9110 requires, ETags are compared weakly and `If-Modified-Since`
+    is only considered when the request has no `If-None-Match`.
+
+    Args:
+        request (Request): Request with the conditional headers.
+        etag (str, optional): Current ETag of the resource.
+        last_modified (datetime, optional): Time of the last change of the resource.
+
+    Returns:
+        bool: True if the client's copy is current and `304 Not Modified` can be sent.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or (etag is not None and etag.removeprefix("W/") in tags)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have a resolution of one second
+        return since.tzinfo is not None and last_modified.astimezone(timezone.utc).replace(microsecond=0) <= since
+    return False
+
+def not_modified_response(etag: str | None, last_modified: datetime | None = None) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validator_headers(etag, last_modified))
+
+def parse_conditional_request(if_none_match: str | None, if_modified_since: str | None) -> dict:
+    """Translates `If-None-Match` and `If-Modified-Since` request headers to `get_object` arguments.
+
+    Returns:
+        dict: `IfNoneMatch` or `IfModifiedSince` argument, empty for an unconditional request.
+    """
+    if if_none_match:
+        return {"IfNoneMatch": if_none_match.strip()}
+    if if_modified_since:
+        try:
+            return {"IfModifiedSince": parsedate_to_datetime(if_modified_since)}
+        except (TypeError, ValueError):
+            pass
+    return {}
+
+def parse_byte_range(range_header: str, size: int) -> tuple[int, int] | None:
+    """Resolves a single byte range of `parse_range_request` against the size of a document.
+
+    Returns:
+        tuple: First and last byte of the range, None if the range isn't satisfiable.
+    """
+    first, last = range_header.removeprefix("bytes=").split("-")
+    if first == "":
+        suffix = int(last)
+        return (max(size - suffix, 0), size - 1) if suffix and size else None
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    return (start, end) if start < size and start <= end else None
+
+def cached_file_response(request: Request, file: BinaryIO, etag: str, content_type: str | None, headers: dict) -> Response:
+    """Sends a document from a file opened by the document cache, with `Range` and `If-Range` handled as S3 does.
+
+    The open file stays readable even if its cache entry is evicted or
+    invalidated while it's sent. It's closed once sent.
+
+    Raises:
+        HTTPException 416: If the requested range is outside of the document.
+    """
+    stat = os.fstat(file.fileno())
+    # The cached file's mtime is the object's `LastModified`
+    last_modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+    if is_not_modified(request, etag, last_modified):
+        file.close()
+        return not_modified_response(etag, last_modified)
+
+    headers = {**headers, "Accept-Ranges": "bytes", "ETag": etag, "Last-Modified": http_date(last_modified)}
+    start, end, status_code = 0, stat.st_size - 1, status.HTTP_200_OK
+    range_arguments = parse_range_request(request.headers.get("range"), request.headers.get("if-range"))
+    if_unmodified_since = range_arguments.get("IfUnmodifiedSince")
+    range_applies = bool(range_arguments) and range_arguments.get("IfMatch", etag) == etag and (
+        if_unmodified_since is None or last_modified.replace(microsecond=0) <= if_unmodified_since
+    )
+    if range_applies:
+        byte_range = parse_byte_range(range_arguments["Range"], stat.st_size)
+        if byte_range is None:
+            file.close()
             raise HTTPException(
-                status.HTTP_406_NOT_ACCEPTABLE,
-                detail=f"File '{file.filename}' has no extension"
+                status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                "Requested range not satisfiable",
+                headers={"Content-Range": f"bytes */{stat.st_size}"},
             )
-        ext = "." + parts[1]
+        start, end = byte_range
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    async def file_iterator():
+        try:
+            await asyncio.to_thread(file.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await asyncio.to_thread(file.read, min(DOWNLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            file.close()
+
+    return StreamingResponse(
+        file_iterator(),
+        status_code=status_code,
+        media_type=content_type or "application/octet-stream",
+        headers=headers,
+    )
 
-        if ext not in ALLOWED_EXTENSIONS:
+async def stream_s3_object(s3, key: str, get_arguments: dict, headers: dict, cache_misses: bool = False) -> StreamingResponse:
+    """Streams an object from S3, with status 206 when S3 returned a range of it
+    and 304 when a condition of `get_arguments` found the client's copy current.
+
+    With `cache_misses` a full response small enough for the document cache is
+    also written to it while streaming, an interrupted stream leaves nothing behind.
+
+    Raises:
+        HTTPException 404: If the object doesn't exist.
+        HTTPException 416: If the requested range is outside of the object.
+    """
+    try:
+        response = await s3.get_object(Bucket=BUCKET_NAME, Key=key, **get_arguments)
+    except ClientError as e:
+        code = e.response["Error"]["Code"]
+        if code == "PreconditionFailed" and "Range" in get_arguments:
+            # `If-Range` didn't match, the client gets the current object in full
+            conditions = {name: value for name, value in get_arguments.items() if name in ("IfNoneMatch", "IfModifiedSince")}
+            return await stream_s3_object(s3, key, conditions, headers, cache_misses)
+        if code in ("304", "NotModified"):
+            http_headers = e.response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+            last_modified = http_headers.get("last-modified")
+            return not_modified_response(
+                http_headers.get("etag") or get_arguments.get("IfNoneMatch"),
+                parsedate_to_datetime(last_modified) if last_modified else None,
+            )
+        if code == "InvalidRange":
+            size = e.response["Error"].get("ActualObjectSize")
+            if size is None:
+                size = (await s3.head_object(Bucket=BUCKET_NAME, Key=key))["ContentLength"]
             raise HTTPException(
-                status.HTTP_406_NOT_ACCEPTABLE,
-                detail=f"Only {', '.join(ALLOWED_EXTENSIONS)} files are allowed"
+                status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                "Requested range not satisfiable",
+                headers={"Content-Range": f"bytes */{size}"},
             )
+        if code in ("NoSuchKey", "404"):
+            raise HTTPException(status.HTTP_404_NOT_FOUND, "Document not found")
+        raise
 
-    return True
+    stream = response["Body"]
+    headers = {
+        **headers,
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(response["ContentLength"]),
+        "ETag": response["ETag"],
+    }
+    if response.get("LastModified") is not None:
+        headers["Last-Modified"] = http_date(response["LastModified"])
+    status_code = status.HTTP_200_OK
+    if "ContentRange" in response:
+        headers["Content-Range"] = response["ContentRange"]
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+
+    writer = None
+    if cache_misses and status_code == status.HTTP_200_OK and response["ContentLength"] <= document_cache.max_bytes:
+        writer = document_cache.writer(key, response["ETag"], response.get("LastModified"))
+
+    async def file_iterator():
+        committed = False
+        try:
+            async for chunk in stream.iter_chunks(DOWNLOAD_CHUNK_SIZE):
+                if writer is not None:
+                    await asyncio.to_thread(writer.write, chunk)
+                yield chunk
+            if writer is not None:
+                await asyncio.to_thread(writer.commit)
+                committed = True
+        finally:
+            stream.close()
+            if writer is not None and not committed:
+                writer.abort()
+
+    return StreamingResponse(
+        file_iterator(),
+        status_code=status_code,
+        media_type=response.get("ContentType") or "application/octet-stream",
+        headers=headers,
+    )
 
-# TODO: Exception for file not found
 @router.get("/projects/{project_id}/documents/{document_id}")
-async def get_s3_document(project_id: str, download_web: str = False , document_id: str = Path(...), user_payload: dict = Depends(auth_requierd)) -> None:
-    key = f"{project_id}/{document_id}"
-    with get_db() as conn:
-        user_perm = check_permission(conn, user_payload["sub"], int(project_id))
+async def get_s3_document(request: Request, project_id: str, download_web: str | None = None, document_id: str = Path(...), context: RequestContext = Depends(request_context)) -> StreamingResponse:
+    """Streams a document from S3, supports `Range` and `If-Range` requests.
 
+    `download_web` only changes the suggested file name, both modes stream the document.
+    Responses carry the object's `ETag` and `Last-Modified`, a request with
+    `If-None-Match` or `If-Modified-Since` matching them gets `304 Not Modified`,
+    answered from the index without calling S3 when the ETag is indexed.
+    The object is found through the documents index, deduplicated documents
+    share objects stored under their content digest. With the document cache
+    enabled, a document whose indexed ETag is cached is sent from the local
+    file, and full downloads of other documents fill the cache.
+
+    Raises:
+        HTTPException 401: If user has no permission to the project.
+        HTTPException 404: If the document doesn't exist.
+        HTTPException 416: If the requested range is outside of the document.
+    """
+    user_perm = await context.permission(project_id)
+    document = None
     if user_perm is not None:
-        async with session.resource("s3") as s3:
-            obj = await s3.Object(BUCKET_NAME, key)
-            response = await obj.get()
-            # if you want to download file trough web explorer 
-            if download_web:
-                stream = response["Body"]
-
-                async def file_iterator(chunk_size=1024*1024):
-                    async for chunk in stream.iter_chunks(chunk_size):
-                        yield chunk
-                
-                return StreamingResponse(
-                    file_iterator(),
-                    media_type="application/octet-stream",
-                    headers={"Content-Disposition": f"attachment; filename={document_id.split('-')[-1]}"}
-            )
-            # If you want to include file in json response
-            else:
-                content = await response["Body"].read()
-
-                return Response(
-                    content=content,
-                    media_type="application/octet-stream",
-                    headers={"Content-Disposition": f"attachment; filename={document_id.split('/')[-1]}"}
-                )
-    else:
+        document = await select_document(await context.connection(), int(project_id), document_id)
+    await context.release()
+
+    if user_perm is None:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Unauthorized")
+
+    # Documents uploaded before the index existed are still found under their own key
+    key = document["key"] if document is not None else f"{project_id}/{document_id}"
+    filename = document_id.split('-')[-1] if download_web else document_id.split('/')[-1]
+    headers = {"Content-Disposition": f"attachment; filename={filename}", "Cache-Control": PRIVATE_CACHE_CONTROL}
+
+    if document is not None:
+        if is_not_modified(request, document["etag"]):
+            return not_modified_response(document["etag"])
+
+        cached_file = document_cache.open_file(key, document["etag"])
+        if cached_file is not None:
+            return cached_file_response(request, cached_file, document["etag"], document["content_type"], headers)
+
+    range_arguments = parse_range_request(request.headers.get("range"), request.headers.get("if-range"))
+    get_arguments = {
+        **range_arguments,
+        **parse_conditional_request(request.headers.get("if-none-match"), request.headers.get("if-modified-since")),
+    }
+
+    s3 = await get_s3_client()
+    return await stream_s3_object(s3, key, get_arguments, headers, cache_misses=document_cache.enabled and document is not None and not range_arguments)
+
+@router.get("/projects/{project_id}/archive")
+async def get_project_archive(project_id: int, documents: list[str] | None = Query(None, description="Names of documents to include, all when omitted"), context: RequestContext = Depends(request_context)) -> StreamingResponse:
+    """Streams a ZIP archive of project's documents, built on the fly from S3.
+
+    Raises:
+        HTTPException 401: If user has no permission to the project.
+        HTTPException 404: If some of the requested documents don't exist.
+    """
+    user_perm = await context.permission(project_id)
+    if user_perm is None:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Unauthorized")
 
+    indexed = await select_documents(await context.connection(), project_id)
+    await context.release()
+
+    if documents:
+        by_name = {document["name"]: document for document in indexed}
+        missing = [name for name in documents if name not in by_name]
+        if missing:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, f"Documents not found: {', '.join(missing)}")
+        indexed = [by_name[name] for name in dict.fromkeys(documents)]
+
+    s3 = await get_s3_client()
+    return StreamingResponse(
+        stream_zip(s3, indexed),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=project_{project_id}.zip"},
+    )
+
+@router.get("/projects/{project_id}/documents/{document_id}/url")
+async def get_s3_document_url(project_id: str, redirect: bool = False, download_web: str | None = None, document_id: str = Path(...), context: RequestContext = Depends(request_context)):
+    """Returns a short-lived presigned URL, so S3 sends the document to the client directly.
+
+    Args:
+        redirect (bool): Redirect to the URL with status 307 instead of returning it.
+
+    Raises:
+        HTTPException 401: If user has no permission to the project.
+        HTTPException 404: If the document isn't in the project.
+    """
+    user_perm = await context.permission(project_id)
+    document = None
+    if user_perm is not None:
+        document = await select_document(await context.connection(), int(project_id), document_id)
+    await context.release()
+
+    if user_perm is None:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Unauthorized")
+    if document is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Document not found")
+
+    filename = document_id.split('-')[-1] if download_web else document_id.split('/')[-1]
+    s3 = await get_s3_client()
+    url = await s3.generate_presigned_url(
+        "get_object",
+        Params={
+            "Bucket": BUCKET_NAME,
+            "Key": document["key"],
+            "ResponseContentDisposition": f"attachment; filename={filename}",
+        },
+        ExpiresIn=PRESIGNED_URL_EXPIRES_SECONDS,
+    )
+
+    if redirect:
+        return RedirectResponse(url, status.HTTP_307_TEMPORARY_REDIRECT)
+    return JSONResponse({"url": url, "expires_in": PRESIGNED_URL_EXPIRES_SECONDS}, status.HTTP_200_OK)
+
+@router.post("/projects/{project_id}/uploads")
+async def create_presigned_uploads(upload: PresignedUploadRequest, project_id: int, context: RequestContext = Depends(request_context)) -> JSONResponse:
+    """Returns presigned POST forms the client uses to upload documents straight to S3.
+
+    Each form only accepts its key, content type and at most `S3_PRESIGNED_UPLOAD_MAX_BYTES`.
+    Uploaded documents appear in the project after `POST /projects/{project_id}/uploads/confirm`.
+
+    Raises:
+        HTTPException 401: If user has no permission to the project.
+        HTTPException 406: If a file has a not allowed extension.
+        HTTPException 501: If documents are stored deduplicated.
+    """
+    check_presigned_uploads_available()
+    for file in upload.files:
+        check_filename_extension(file.name)
+
+    user_perm = await context.permission(project_id)
+    await context.release()
+
+    if user_perm is None:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Unauthorized")
+
+    s3 = await get_s3_client()
+    forms = {}
+    for file in upload.files:
+        fields = {}
+        conditions = [["content-length-range", 0, PRESIGNED_UPLOAD_MAX_BYTES]]
+        if file.content_type:
+            fields["Content-Type"] = file.content_type
+            conditions.append({"Content-Type": file.content_type})
+        forms[file.name] = await s3.generate_presigned_post(
+            BUCKET_NAME,
+            f"{project_id}/{file.name}",
+            Fields=fields,
+            Conditions=conditions,
+            ExpiresIn=PRESIGNED_URL_EXPIRES_SECONDS,
+        )
+
+    return JSONResponse({"uploads": forms, "expires_in": PRESIGNED_URL_EXPIRES_SECONDS}, status.HTTP_200_OK)
+
+@router.post("/projects/{project_id}/uploads/confirm")
+async def confirm_presigned_uploads(confirmation: UploadConfirmation, project_id: int, context: RequestContext = Depends(request_context)) -> JSONResponse:
+    """Records documents uploaded with presigned forms in the documents index.
+
+    Raises:
+        HTTPException 401: If user has no permission to the project.
+        HTTPException 404: If some of the documents weren't uploaded, the others are recorded.
+        HTTPException 406: If a file has a not allowed extension.
+        HTTPException 501: If documents are stored deduplicated.
+    """
+    check_presigned_uploads_available()
+    for name in confirmation.names:
+        check_filename_extension(name)
+
+    user_perm = await context.permission(project_id)
+    await context.release()
+
+    if user_perm is None:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Unauthorized")
+
+    s3 = await get_s3_client()
+
+    async def confirm(name: str) -> dict | None:
+        key = f"{project_id}/{name}"
+        try:
+            head = await s3.head_object(Bucket=BUCKET_NAME, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        uploaded = {"key": key, "size": head["ContentLength"], "etag": head["ETag"]}
+        document_cache.invalidate(key)
+        await index_document(project_id, name, uploaded, head.get("ContentType"))
+        return uploaded
+
+    results = await asyncio.gather(*(confirm(name) for name in confirmation.names))
+    missing = [name for name, result in zip(confirmation.names, results) if result is None]
+    if missing:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, f"Uploads not found: {', '.join(missing)}")
+
+    return JSONResponse({"documents": dict(zip(confirmation.names, results))}, status.HTTP_201_CREATED)
+
 
 @router.post("/projects/{project_id}/documents/{document_id}")
-async def update_s3_file(file: UploadFile = File(...),project_id: str = Path(...), document_id: str = Path(...), user_payload: dict = Depends(auth_requierd)):
+async def update_s3_file(file: UploadFile = File(...),project_id: str = Path(...), document_id: str = Path(...), context: RequestContext = Depends(request_context)):
     key = f"{project_id}/{document_id}"
 
     await check_file_extension([file])
 
-    with get_db() as conn:
-        user_perm = check_permission(conn, user_payload["sub"], project_id)
+    user_perm = await context.permission(project_id)
+    await context.release()
 
     if user_perm is not None:
         try:
-            async with session.resource("s3") as s3:
-                contents = await file.read()
-                bucket = await s3.Bucket(BUCKET_NAME)
-                await bucket.put_object(
-                    Key=key,
-                    Body=contents,
-                    ContentType=file.content_type
-                )
-                
-                return JSONResponse(f"File saved with name: {document_id}", status.HTTP_200_OK)
+            s3 = await get_s3_client()
+            if DEDUP_ENABLED:
+                # Blobs never change, so cached copies of them stay valid
+                await store_deduplicated_document(s3, project_id, file, document_id)
+            else:
+                uploaded = await upload_stream(s3, BUCKET_NAME, key, file, file.content_type)
+                document_cache.invalidate(key)
+                await index_document(project_id, document_id, uploaded, file.content_type)
+
+            return JSONResponse(f"File saved with name: {document_id}", status.HTTP_200_OK)
     
         except NoCredentialsError:
             raise HTTPException(status_code=500, detail="AWS credentials not found")
@@ -136,19 +590,37 @@ async def update_s3_file(file: UploadFile = File(...),project_id: str = Path(...
             raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/projects/{project_id}/documents/{document_id}")
-async def delete_s3_document(project_id: str = Path(...), document_id: str = Path(...)) -> JSONResponse:
+async def delete_s3_document(project_id: str = Path(...), document_id: str = Path(...), context: RequestContext = Depends(request_context)) -> JSONResponse:
     key = f"{project_id}/{document_id}"
+
+    user_perm = await context.permission(project_id)
+    if user_perm is None:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Unauthorized")
+
+    conn = await context.connection()
+    document = await select_document(conn, int(project_id), document_id)
+    if document is not None and document["digest"] is not None:
+        # The blob may be shared, garbage collection removes it once nothing references it
+        await delete_document(conn, int(project_id), document_id)
+        return
+    await context.release()
+
     try:
-        async with session.resource("s3") as s3:
-            bucket = await s3.Bucket(BUCKET_NAME)
-            await bucket.delete_objects(
-                Delete={
-                    'Objects': [
-                        {'Key': key}
-                    ],
-                    'Quiet': True
-                }
-            )
+        s3 = await get_s3_client()
+        await s3.delete_objects(
+            Bucket=BUCKET_NAME,
+            Delete={
+                'Objects': [
+                    {'Key': key}
+                ],
+                'Quiet': True
+            }
+        )
 
     except ClientError as e:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+    document_cache.invalidate(key)
+
+    # Removed from the index only once S3 has deleted the object
+    async with get_async_db() as conn:
+        await delete_document(conn, int(project_id), document_id)
\ No newline at end of file
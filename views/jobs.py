@@ -0,0 +1,34 @@
+from fastapi import HTTPException, status, Depends, APIRouter
+from fastapi.responses import JSONResponse
+
+from views.auth import request_context
+from db.context import RequestContext
+from db.aio import select_job
+
+router = APIRouter(tags=["Jobs"])
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: int, context: RequestContext = Depends(request_context)) -> JSONResponse:
+    """Returns state of a background job started by the user.
+
+    Returns:
+        JSONResponse: `job_id`, `kind`, `status` (`queued`, `running`, `succeeded` or `failed`),
+            `attempts`, `last_error`, `result`, `created_at` and `updated_at`.
+
+    Raises:
+        HTTPException 404: If there is no such job or another user started it.
+    """
+    job = await select_job(await context.connection(), job_id)
+    if job is None or job["created_by"] != context.user_id:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Job not found")
+
+    return JSONResponse({
+        "job_id": job["job_id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "last_error": job["last_error"],
+        "result": job["result"],
+        "created_at": job["created_at"].isoformat(),
+        "updated_at": job["updated_at"].isoformat(),
+    }, status.HTTP_200_OK)
@@ -1,26 +1,85 @@
-from fastapi import HTTPException, status, Depends, Query, APIRouter, Path, File, UploadFile, Response
+from fastapi import HTTPException, status, Depends, Query, APIRouter, Path, File, UploadFile, Response, Request
 from fastapi.responses import JSONResponse
 
+from psycopg2.errors import QueryCanceled
+
 import asyncio
+import hashlib
+import logging
+import os
+import time
+from datetime import datetime, timezone
 
-from views.auth import auth_requierd
-from db.db import *
-from views.document import get_s3_documents_list, upload_s3_file, delete_s3_folder, check_file_extension
+from views.auth import request_context
+from db.context import RequestContext
+from db.models import *
+from db.aio import *
+from db.db import POOL_CONFIG
+from views.document import upload_s3_file, check_file_extension, is_not_modified, not_modified_response, validator_headers
+from tasks.queue import enqueue_job, job_worker
+from tasks.handlers import DELETE_PROJECT_OBJECTS
 
 router = APIRouter(tags=["Projects"])
 
+logger = logging.getLogger(__name__)
+
+PROJECTS_PAGE_SIZE = int(os.getenv("PROJECTS_PAGE_SIZE", 50))
+PROJECTS_MAX_PAGE_SIZE = int(os.getenv("PROJECTS_MAX_PAGE_SIZE", 500))
+
+DOCUMENT_LISTING_BATCH_SIZE = max(int(os.getenv("DOCUMENT_LISTING_BATCH_SIZE", 100)), 1)
+# One request never takes more than a quarter of the pool for its listings
+DOCUMENT_LISTING_CONCURRENCY = max(min(int(os.getenv("DOCUMENT_LISTING_CONCURRENCY", 4)), POOL_CONFIG["max_size"] // 4), 1)
+DOCUMENT_LISTING_TIMEOUT_SECONDS = float(os.getenv("DOCUMENT_LISTING_TIMEOUT_SECONDS", 5))
+UPLOAD_CONCURRENCY = max(int(os.getenv("UPLOAD_CONCURRENCY", 4)), 1)
+
+async def get_documents_lists(project_ids: list[int]) -> dict[int, dict]:
+    """Lists documents of many projects in batches fetched concurrently.
+
+    Each batch runs on its own pooled connection, at most
+    `DOCUMENT_LISTING_CONCURRENCY` at once. `DOCUMENT_LISTING_TIMEOUT_SECONDS`
+    limits the wait for the connection together with the query, which also
+    gets it as its statement timeout. Projects of a batch that timed out or
+    failed get an error marker instead of failing the whole listing.
+
+    Args:
+        project_ids (list): IDs of listed projects.
+
+    Returns:
+        dict: `{"documents": [...]}` or `{"documents": None, "documents_error": "..."}` for every project ID.
+    """
+    slots = asyncio.Semaphore(DOCUMENT_LISTING_CONCURRENCY)
+    batches = [project_ids[i:i + DOCUMENT_LISTING_BATCH_SIZE] for i in range(0, len(project_ids), DOCUMENT_LISTING_BATCH_SIZE)]
+
+    async def select_batch(batch: list[int]) -> dict[int, list[str]]:
+        async with get_async_db() as conn:
+            return await select_document_names_by_project(conn, batch, timeout=DOCUMENT_LISTING_TIMEOUT_SECONDS)
+
+    async def list_batch(batch: list[int]) -> dict[int, dict]:
+        async with slots:
+            try:
+                documents = await asyncio.wait_for(select_batch(batch), DOCUMENT_LISTING_TIMEOUT_SECONDS)
+                return {project_id: {"documents": names} for project_id, names in documents.items()}
+            except Exception as e:
+                error = "timeout" if isinstance(e, (QueryCanceled, TimeoutError)) else "unavailable"
+                logger.warning("Listing documents of projects %s failed: %r", batch, e)
+                return {project_id: {"documents": None, "documents_error": error} for project_id in batch}
+
+    results = {}
+    for batch_result in await asyncio.gather(*(list_batch(batch) for batch in batches)):
+        results.update(batch_result)
+    return results
+
 @router.post("/project")
-def post_project(project: Project, user_payload: dict = Depends(auth_requierd)) -> JSONResponse:
-    user_id = user_payload["sub"]
+async def post_project(project: Project, context: RequestContext = Depends(request_context)) -> JSONResponse:
+    user_id = context.user_id
 
     if not project.name:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Project name is required")
 
-    with get_db() as conn:
-        try:
-            project_id = insert_project(conn, user_id, project)
-        except Exception as e:
-            raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    try:
+        project_id = await insert_project(await context.connection(), user_id, project)
+    except Exception as e:
+        raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
     return JSONResponse(
         {
@@ -30,32 +89,70 @@ def post_project(project: Project, user_payload: dict = Depends(auth_requierd))
         status_code=201)
 
 @router.get("/projects")
-async def get_all_projects(user_payload: dict = Depends(auth_requierd)) -> JSONResponse:
-    with get_db() as conn:
-        try:
-            result = select_project_info(conn, user_payload["sub"])
-        except Exception as e:
-            raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, str(e))
-
-    for project_id in result:
-        documents = await get_s3_documents_list(project_id)
-        result[project_id]["documents"] = documents
-    return JSONResponse(result, status_code=200)
+async def get_all_projects(
+    limit: int = Query(PROJECTS_PAGE_SIZE, ge=1, le=PROJECTS_MAX_PAGE_SIZE),
+    after: int | None = Query(None, description="Cursor, `project_id` of the last project from the previous page"),
+    order: SortOrder = SortOrder.asc,
+    include: str = Query("documents", description="Comma separated extras, pass it empty to get only project metadata"),
+    context: RequestContext = Depends(request_context)
+) -> JSONResponse:
+    try:
+        # One extra row tells if there is a next page
+        result = await select_project_info(await context.connection(), context.user_id, limit=limit + 1, after=after, order=order)
+    except Exception as e:
+        raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, str(e))
+    await context.release()
+
+    headers = {}
+    if len(result) > limit:
+        result.popitem()
+        headers["X-Next-Cursor"] = str(next(reversed(result)))
+
+    if "documents" in {extra.strip() for extra in include.split(",")}:
+        for project_id, documents in (await get_documents_lists(list(result))).items():
+            result[project_id].update(documents)
+    return JSONResponse(result, status_code=200, headers=headers)
+
+def project_validators(version: dict) -> tuple[str, datetime]:
+    """Derives a weak ETag and `Last-Modified` of a project response from `select_project_version`.
+
+    Returns:
+        tuple: ETag changing with the project's details or any of its documents, and time of the latest of those changes.
+    """
+    fingerprint = f"{version['modified_at'].isoformat()}|{version['documents']}|{version['listing_digest']}"
+    etag = f'W/"{hashlib.sha256(fingerprint.encode()).hexdigest()[:32]}"'
+    # `projects.modified_at` is stored in the server's local time
+    last_modified = version["modified_at"].astimezone(timezone.utc)
+    if version["documents_modified_at"] is not None:
+        last_modified = max(last_modified, version["documents_modified_at"])
+    return etag, last_modified
 
 @router.get("/projects/{project_id}")
-async def get_project(project_id: int, user_payload: dict = Depends(auth_requierd)):
+async def get_project(request: Request, project_id: int, context: RequestContext = Depends(request_context)):
+    """Returns project's details and names of its documents.
+
+    The response has an `ETag` and `Last-Modified` covering the details and the
+    documents listing. A request with a matching `If-None-Match` or
+    `If-Modified-Since` gets `304 Not Modified` after one small query.
+    """
     if not project_id:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Project ID is required")
-    with get_db() as conn:
-        try:
-            user_perm = check_permission(conn, user_payload["sub"], project_id)
-            if user_perm is not None:
-                project_info = select_project_info(conn, user_payload["sub"], project_id=project_id)
-                documents_list = await get_s3_documents_list(project_id)
-            else:
-                raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Unauthorized")
-        except Exception as e:
-            raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, str(e))
+    etag = last_modified = None
+    try:
+        user_perm = await context.permission(project_id)
+        if user_perm is not None:
+            conn = await context.connection()
+            version = await select_project_version(conn, project_id)
+            if version is not None:
+                etag, last_modified = project_validators(version)
+                if is_not_modified(request, etag, last_modified):
+                    return not_modified_response(etag, last_modified)
+            project_info = await select_project_info(conn, context.user_id, project_id=project_id, permission=user_perm)
+            documents_list = await select_document_names(conn, project_id)
+        else:
+            raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Unauthorized")
+    except Exception as e:
+        raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, str(e))
     
     return JSONResponse({
         project_info["project_id"]: 
@@ -67,76 +164,146 @@ async def get_project(project_id: int, user_payload: dict = Depends(auth_requier
                 "documents": documents_list
             }  
         }, 
-        status_code=200
+        status_code=200,
+        headers=validator_headers(etag, last_modified)
     )
 
 @router.put("/projects/{project_id}")
-def update_projects_details(project_id: int, project: Project, user_payload: dict = Depends(auth_requierd)):
+async def update_projects_details(project_id: int, project: Project, context: RequestContext = Depends(request_context)):
     if not project_id:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Project ID is required")
 
-    with get_db() as conn:
-        try:
-            result = update_project(conn, project)
-            return JSONResponse({'msg': 'Project details updated succesfully', 'update': result}, status.HTTP_202_ACCEPTED)
-        except Exception as e:
-            raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, e)
+    try:
+        result = await update_project(await context.connection(), project)
+        return JSONResponse({'msg': 'Project details updated succesfully', 'update': result}, status.HTTP_202_ACCEPTED)
+    except Exception as e:
+        raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, e)
 
 @router.delete("/projects/{project_id}")
-async def remove_project(project_id: int, user_payload: dict = Depends(auth_requierd)) -> JSONResponse:
+async def remove_project(project_id: int, context: RequestContext = Depends(request_context)) -> JSONResponse:
+    """Deletes a project and queues removal of its documents from S3.
+
+    The removal job is added in the same transaction as the delete, so it's
+    never lost, and its progress is available at `GET /jobs/{job_id}`.
+
+    Raises:
+        HTTPException 401: If user isn't the owner of the project.
+    """
     if not project_id:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Project ID is required")
 
-    with get_db() as conn:
-        user_permission = check_permission(conn, user_payload["sub"], project_id)
+    user_permission = await context.permission(project_id)
 
-        if user_permission == Permission.owner.value:
-            delete_project(conn, user_payload["sub"], project_id)
+    if user_permission == Permission.owner.value:
+        conn = await context.connection()
+        await delete_project(conn, context.user_id, project_id, permission=user_permission)
+        job_id = await enqueue_job(conn, DELETE_PROJECT_OBJECTS, {"project_id": project_id}, created_by=context.user_id)
+        await context.release()
+        job_worker.wake()
 
-            await delete_s3_folder(project_id)
-        
-            return JSONResponse(status_code=status.HTTP_204_NO_CONTENT, content=None)
-        else:
-            raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Unauthorized")
+        return JSONResponse(
+            {"msg": "Project deleted, its documents are being removed", "job_id": job_id},
+            status_code=status.HTTP_202_ACCEPTED,
+            headers={"Location": f"/jobs/{job_id}"},
+        )
+    else:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Unauthorized")
 
 @router.get("/projects/{project_id}/documents")
-async def get_project_documents(project_id: str = Path(...), user_payload: dict = Depends(auth_requierd)) -> JSONResponse:
-    user_id = user_payload["sub"]
+async def get_project_documents(project_id: str = Path(...), context: RequestContext = Depends(request_context)) -> JSONResponse:
     project_id = int(project_id)
-    with get_db() as conn:
-        user_premission = check_permission(conn, user_id, project_id)
+    user_premission = await context.permission(project_id)
     
     if user_premission is not None:
-        response = await get_s3_documents_list(project_id)
+        response = await select_document_names(await context.connection(), project_id)
         return JSONResponse(response, status.HTTP_200_OK)
     else:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Unauthorized")
 
+async def upload_files(files: list[UploadFile], project_id: int, continue_on_error: bool = False) -> list[dict]:
+    """Uploads files with at most `UPLOAD_CONCURRENCY` of them at once.
+
+    Args:
+        files (list): Uploaded files.
+        project_id (int): ID of a project the files are added to.
+        continue_on_error (bool): Keep uploading after a failure, otherwise files not started yet are skipped.
+
+    Returns:
+        list: Result of every file, in order: `name`, `status` (`uploaded`, `failed` or `skipped`),
+            `key`, `size`, `etag` and `elapsed_ms` of uploaded files, `error` and `elapsed_ms` of failed ones.
+    """
+    slots = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+    failed = False
+
+    async def upload(file: UploadFile) -> dict:
+        nonlocal failed
+        async with slots:
+            if failed and not continue_on_error:
+                return {"name": file.filename, "status": "skipped"}
+
+            started = time.perf_counter()
+            try:
+                uploaded = await upload_s3_file(file, project_id)
+            except Exception as e:
+                failed = True
+                logger.warning("Upload of %s to project %s failed: %r", file.filename, project_id, e)
+                return {
+                    "name": file.filename,
+                    "status": "failed",
+                    "error": str(e),
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+                }
+            return {
+                "name": file.filename,
+                "status": "uploaded",
+                "key": uploaded["key"],
+                "size": uploaded["size"],
+                "etag": uploaded["etag"],
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            }
+
+    return await asyncio.gather(*(upload(file) for file in files))
+
 @router.post("/projects/{project_id}/documents")
-async def upload_project_documents(files: list[UploadFile] = File(...), project_id: str = Path(...), user_payload: dict = Depends(auth_requierd)) -> JSONResponse:
+async def upload_project_documents(files: list[UploadFile] = File(...), project_id: str = Path(...), continue_on_error: bool = False, context: RequestContext = Depends(request_context)) -> JSONResponse:
+    """Uploads documents to a project.
 
+    Returns:
+        JSONResponse: Counts of `uploaded`, `failed` and `skipped` files and per file `results`,
+            status 200 when every file was uploaded, 207 when only some were and 500 when none was.
+
+    Raises:
+        HTTPException 401: If user has no permission to the project.
+        HTTPException 406: If a file has a not allowed extension.
+    """
     await check_file_extension(files)
     
-    with get_db() as conn:
-        user_permission = check_permission(conn, user_payload["sub"], project_id)
+    user_permission = await context.permission(project_id)
+    await context.release()
     
     if user_permission is None:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Unauthorized")
-        
 
-    uploaded_files = await asyncio.gather(*(upload_s3_file(file, project_id) for file in files))
-    return JSONResponse(f"Files uploaded successfully: {uploaded_files}", status.HTTP_200_OK)
+    results = await upload_files(files, int(project_id), continue_on_error)
+    counts = {outcome: sum(result["status"] == outcome for result in results) for outcome in ("uploaded", "failed", "skipped")}
+    if counts["uploaded"] == len(results):
+        status_code = status.HTTP_200_OK
+    elif counts["uploaded"]:
+        status_code = status.HTTP_207_MULTI_STATUS
+    else:
+        status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+    return JSONResponse({**counts, "results": results}, status_code)
 
 @router.post("/projects/{project_id}/invite")
-async def invite_user(project_id: int, user: str = Query(...), user_payload: dict = Depends(auth_requierd), db = Depends(get_db)) -> JSONResponse:
-    inviter_id = user_payload["sub"]
+async def invite_user(project_id: int, user: str = Query(...), context: RequestContext = Depends(request_context)) -> JSONResponse:
+    inviter_permission = await context.permission(project_id)
+    conn = await context.connection()
 
-    inviter_permission = check_permission(db, inviter_id, project_id)
-    if select_user(db, user) is None:
+    if await select_user(conn, user) is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "User doesn't exist")
     
     if inviter_permission == Permission.owner.value:
-        insert_permission(db, user, project_id, Permission.participant.value)
+        await insert_permission(conn, user, project_id, Permission.participant.value)
     else:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Only owner can add user to project")
     
@@ -0,0 +1,55 @@
+from fastapi import Depends, Query, APIRouter
+from fastapi.responses import JSONResponse
+
+from dotenv import load_dotenv
+import os
+
+from views.auth import request_context
+from db.context import RequestContext
+from db.aio import search_documents
+from search.indexer import SEARCH_CONFIG
+
+router = APIRouter(tags=["Search"])
+
+load_dotenv()
+
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 20))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", 100))
+
+@router.get("/search")
+async def search(
+    q: str = Query(..., min_length=1, max_length=500, description="Search terms, quote phrases and prefix excluded words with `-`"),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    context: RequestContext = Depends(request_context)
+) -> JSONResponse:
+    """Searches names and text of documents in projects the user has access to.
+
+    Results are ranked, matches in a document's name count more than matches
+    in its text. When there are more results, the response has an
+    `X-Next-Offset` header with the `offset` of the next page.
+
+    Returns:
+        JSONResponse: `query` and `results` with `project_id`, `project_name`, `name` and `rank`.
+    """
+    # One extra row tells if there is a next page
+    results = await search_documents(await context.connection(), context.user_id, q, SEARCH_CONFIG, limit + 1, offset)
+    await context.release()
+
+    headers = {}
+    if len(results) > limit:
+        results = results[:limit]
+        headers["X-Next-Offset"] = str(offset + limit)
+
+    return JSONResponse({
+        "query": q,
+        "results": [
+            {
+                "project_id": row["project_id"],
+                "project_name": row["project_name"],
+                "name": row["name"],
+                "rank": round(row["rank"], 6),
+            }
+            for row in results
+        ],
+    }, status_code=200, headers=headers)
@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+
+from views.auth import auth_requierd
+from db.db import get_db, pool_stats, permission_cache, select_dedup_stats
+from storage.disk_cache import document_cache
+from observability.watchdog import loop_watchdog
+
+router = APIRouter(tags=["Stats"])
+
+@router.get("/stats")
+def get_stats(user_payload: dict = Depends(auth_requierd)) -> JSONResponse:
+    """Returns runtime statistics of the application's shared resources.
+
+    Returns:
+        JSONResponse: Dictionary with keys:
+            `db_pool`: connection pool statistics,
+            `permission_cache`: hits, misses, evictions and size of the permission cache,
+            `document_cache`: hit ratio, bytes saved and size of the on-disk document cache,
+            `dedup`: logical and stored bytes of deduplicated documents and their ratio,
+            `event_loop`: recent event loop lag percentiles and number of times the loop was blocked.
+    """
+    with get_db() as conn:
+        dedup = select_dedup_stats(conn)
+    return JSONResponse({
+        "db_pool": pool_stats(),
+        "permission_cache": permission_cache.stats(),
+        "document_cache": document_cache.stats(),
+        "dedup": dedup,
+        "event_loop": loop_watchdog.stats(),
+    })